@@ -26,4 +26,5 @@ spec.loader.exec_module(wedding_app)
 app = wedding_app.app
 
 if __name__ == '__main__':
+    wedding_app.run_migrations()
     app.run(debug=False, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
\ No newline at end of file
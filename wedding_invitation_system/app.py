@@ -1,17 +1,30 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, make_response
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, make_response, abort, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from datetime import datetime, timedelta
 import pytz
 import uuid
 import os
+import base64
+import hashlib
+import json
+import re
+import time
 import shutil
 from dotenv import load_dotenv
-import qrcode
-from io import BytesIO
-import base64
 import pandas as pd
-import tempfile
 from werkzeug.utils import secure_filename
+from tokens import make_guest_token, parse_guest_token, is_legacy_token
+from rsvp_journal import RSVPJournal, RSVPFlusher, DEFAULT_JOURNAL_PATH
+import guest_search
+import guest_import
+import phones
+import xlsx_stream
+import export_formats
+import export_pipeline
+from export_cache import export_cache, export_key
+import migrations
+import jobs
+from qr_cache import get_rsvp_qr, invalidate_rsvp_qr, qr_etag, rsvp_url, MIMETYPES as QR_MIMETYPES
 
 # טעינת משתני סביבה
 load_dotenv()
@@ -20,6 +33,8 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'default-secret-key')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///wedding.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# כתיבה דחויה של תשובות RSVP דרך יומן מקומי (לספיגת עומסים על SQLite)
+app.config['RSVP_WRITE_BEHIND'] = os.getenv('RSVP_WRITE_BEHIND', '').lower() in ('1', 'true', 'yes')
 
 db = SQLAlchemy(app)
 
@@ -63,7 +78,10 @@ def require_admin_for_nonpublic():
     if is_logged_in():
         return None
     # allow guest-facing endpoints (keep RSVP and bot APIs public)
-    if path.startswith('/api/guest_stats'):
+    if path == '/api/guest_stats':
+        return None
+    # /api/guests בודק בעצמו: התחברות מנהל או מפתח הבוט
+    if path == '/api/guests':
         return None
     return redirect(url_for('login', next=path))
 
@@ -105,6 +123,10 @@ def get_local_time():
     israel_tz = pytz.timezone(timezone)
     return datetime.now(israel_tz)
 
+def _default_phone_e164(context):
+    # INSERT בלי phone_e164 (INSERT מרובה, סקריפטים) - מחושב מהטלפון של אותה שורה
+    return phones.to_e164(context.get_current_parameters().get('phone'))
+
 # מודל האורחים
 class Guest(db.Model):
 
@@ -116,27 +138,89 @@ class Guest(db.Model):
 # ====== כל הראוטים של Flask אחרי הגדרות מחלקות ======
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
-    phone = db.Column(db.String(20), nullable=False)
+    name = db.Column(db.String(100), nullable=False, index=True)  # מיון בעמוד הניהול
+    phone = db.Column(db.String(20), nullable=False, index=True)  # כפי שהוקלד
+    # המפתח הקנוני (phones.to_e164, למשל 972501234567) - כל התאמה לפי טלפון היא השוואה עליו
+    phone_e164 = db.Column(db.String(20), unique=True, index=True, default=_default_phone_e164)
     email = db.Column(db.String(100))  # כתובת מייל
     unique_token = db.Column(db.String(36), unique=True, nullable=False)
+    legacy_token = db.Column(db.String(36), index=True)  # טוקן UUID ישן שכבר נשלח לאורח
     invited_count = db.Column(db.Integer, default=1)  # כמה יגיעו
     confirmed_count = db.Column(db.Integer, default=0)  # כמה אישרו הגעה
-    group_affiliation = db.Column(db.String(100))  # שיוך לקבוצה
-    side = db.Column(db.String(50))  # מהצד של (חתן/כלה)
+    group_affiliation = db.Column(db.String(100), index=True)  # שיוך לקבוצה
+    side = db.Column(db.String(50), index=True)  # מהצד של (חתן/כלה)
     attendance_status = db.Column(db.String(20), default='ממתין')  # יגיע/מתלבט/לא יגיע/ממתין
     estimated_gift_amount = db.Column(db.Float, default=0.0)  # סכום מתנה משוער
     is_attending = db.Column(db.Boolean, default=False)
     message_sent = db.Column(db.Boolean, default=False)
     response_date = db.Column(db.DateTime)
     notes = db.Column(db.Text)  # הערות
-    table_number = db.Column(db.Integer)  # לסידור ישיבה
+    table_number = db.Column(db.Integer, index=True)  # לסידור ישיבה
     added_by = db.Column(db.String(20))  # מספר הטלפון של המשתמש שהוסיף
+    import_hash = db.Column(db.String(32), index=True)  # hash שורת הגיליון בסנכרון האחרון (None = לא מסונכרן)
+    # נעילה זמנית של בוט ששלף את האורח לשליחה (/api/bot/pending) - עד סימון השליחה או עד שפג התוקף
+    bot_lease_owner = db.Column(db.String(32))
+    bot_lease_until = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=get_local_time)
+    # מתעדכן בכל UPDATE (גם ב-Query.update) - משמש ל-ETag של עמוד ה-RSVP ול-since= ב-/api/guests
+    updated_at = db.Column(db.DateTime, default=get_local_time, onupdate=get_local_time, index=True)
+
+    __table_args__ = (
+        # ממתינים לשליחה (הבוט) / נשלח ועוד לא ענו (תזכורות)
+        db.Index('ix_guest_message_sent_response', 'message_sent', 'response_date'),
+        # מגיעים / לא מגיעים (סינון בעמוד הניהול, סידור ישיבה)
+        db.Index('ix_guest_attending_response', 'is_attending', 'response_date'),
+        # עוד לא ענו - בלי קשר לשליחה
+        db.Index('ix_guest_response_date', 'response_date'),
+    )
 
     def __repr__(self):
         return f'<Guest {self.name}>'
 
+@db.event.listens_for(Guest.phone, 'set')
+def _sync_phone_e164(target, value, oldvalue, initiator):
+    # רק כשהטלפון באמת השתנה - אורח כפול שהמיגרציה השאירה בלי מפתח נשאר כך עד שמתקנים את המספר
+    if value != oldvalue:
+        target.phone_e164 = phones.to_e164(value)
+
+def find_guest_by_phone(phone):
+    """האורח עם הטלפון הזה בכל כתיב (050-..., +972..., 972...) - השוואה על phone_e164"""
+    key = phones.to_e164(phone)
+    return Guest.query.filter_by(phone_e164=key).first() if key else None
+
+def phone_conflict(phone, guest_id=None):
+    """הודעת שגיאה אם הטלפון לא תקין או כבר שייך לאורח אחר (phone_e164 ייחודי), אחרת None"""
+    if phones.to_e164(phone) is None:
+        return f'מספר הטלפון {phone} לא תקין'
+    other = find_guest_by_phone(phone)
+    if other is not None and other.id != guest_id:
+        return f'הטלפון {phone} כבר שייך לאורח {other.name}'
+    return None
+
+@db.event.listens_for(Guest.unique_token, 'set')
+def _drop_stale_qr(target, value, oldvalue, initiator):
+    # טוקן שהוחלף - קוד ה-QR הישן כבר לא רלוונטי
+    if isinstance(oldvalue, str) and oldvalue != value:
+        invalidate_rsvp_qr(os.getenv('WEBSITE_URL', 'http://localhost:5000'), oldvalue)
+
+def issue_guest_token(guest):
+    """מחליף את הטוקן הזמני בטוקן חתום - דורש guest.id, כלומר אחרי flush"""
+    guest.unique_token = make_guest_token(guest.id, app.config['SECRET_KEY'])
+
+def get_guest_by_token_or_404(token):
+    """טוקן חתום נפתר לפי מפתח ראשי; זיוף נדחה בלי שאילתה. טוקני UUID ישנים עדיין נתמכים."""
+    guest_id = parse_guest_token(token, app.config['SECRET_KEY'])
+    if guest_id is not None:
+        guest = Guest.query.get(guest_id)
+        if guest is None or guest.unique_token != token:
+            abort(404)
+        return guest
+    if is_legacy_token(token):
+        return Guest.query.filter(
+            (Guest.unique_token == token) | (Guest.legacy_token == token)
+        ).first_or_404()
+    abort(404)
+
 # מודל שולחנות
 class Table(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -154,16 +238,256 @@ class MessageLog(db.Model):
     error = db.Column(db.Text)  # פירוט שגיאה במקרה כשלון
     created_at = db.Column(db.DateTime, default=get_local_time, index=True)
 
+    __table_args__ = (
+        # אורחים שהשליחה אליהם נכשלה (resend) - האינדקס מכסה את השאילתה כולה
+        db.Index('ix_message_log_status_guest', 'status', 'guest_id'),
+    )
+
     def __repr__(self):
         return f'<MessageLog guest={self.guest_id} status={self.status}>'
 
+# מונים מצטברים לדשבורד (אופציונלי, GUEST_STATS_COUNTERS=1) - שורה אחת בלבד, id=1
+class GuestStatsCounters(db.Model):
+    __tablename__ = 'guest_stats_counters'
     id = db.Column(db.Integer, primary_key=True)
-    table_number = db.Column(db.Integer, unique=True, nullable=False)
-    capacity = db.Column(db.Integer, default=8)
-    description = db.Column(db.String(200))
-    
-    def __repr__(self):
-        return f'<Table {self.table_number}>'
+    total_guests = db.Column(db.Integer, nullable=False, default=0)
+    confirmed = db.Column(db.Integer, nullable=False, default=0)
+    declined = db.Column(db.Integer, nullable=False, default=0)
+    pending = db.Column(db.Integer, nullable=False, default=0)
+    total_attending = db.Column(db.Integer, nullable=False, default=0)
+    awaiting_reply = db.Column(db.Integer, nullable=False, default=0)
+
+# מונה גרסה גלובלי - עולה בכל כתיבה ל-Guest או ל-MessageLog (לזיהוי שינויים בזול)
+class DataVersion(db.Model):
+    __tablename__ = 'data_version'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+# משימות רקע (ייבוא, ייצוא, הפעלת הבוט) - ראו jobs.py
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(40), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default=jobs.QUEUED)
+    params = db.Column(db.Text)  # JSON
+    result = db.Column(db.Text)  # JSON
+    error = db.Column(db.Text)
+    message = db.Column(db.String(500))
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    worker = db.Column(db.String(200))
+    created_at = db.Column(db.DateTime, default=get_local_time)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        # תור המשימות + בדיקת ״יש משימה רצה מהסוג הזה״
+        db.Index('ix_job_status_kind', 'status', 'kind'),
+        db.Index('ix_job_kind', 'kind', 'id'),
+        # לכל היותר משימה רצה אחת לכל סוג, גם כששני workers תופסים משימות באותו רגע
+        db.Index('ux_job_running_kind', 'kind', unique=True,
+                 sqlite_where=db.text("status = 'running'"), postgresql_where=db.text("status = 'running'")),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': self.progress,
+            'total': self.total,
+            'message': self.message,
+            'result': json.loads(self.result) if self.result else None,
+            'error': self.error,
+            'cancel_requested': self.cancel_requested,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+def get_data_version():
+    return db.session.query(DataVersion.version).filter(DataVersion.id == 1).scalar() or 0
+
+def bump_data_version(session=None):
+    session = session or db.session
+    table = DataVersion.__table__
+    if not session.execute(table.update().where(table.c.id == 1).values(version=table.c.version + 1)).rowcount:
+        session.execute(table.insert().values(id=1, version=1))
+
+STATS_FIELDS = ('total_guests', 'confirmed', 'declined', 'pending', 'total_attending', 'awaiting_reply')
+
+app.config['GUEST_STATS_COUNTERS'] = os.getenv('GUEST_STATS_COUNTERS', '').lower() in ('1', 'true', 'yes')
+
+def _sum_if(condition, value=1):
+    return db.func.coalesce(db.func.sum(db.case((condition, value), else_=0)), 0)
+
+# תנאי הסטטוס - משותפים לסטטיסטיקה הכללית ולפילוח לפי צד/קבוצה
+def _confirmed_condition():
+    return Guest.is_attending.is_(True)
+
+def _declined_condition():
+    return (Guest.is_attending == False) & Guest.response_date.isnot(None)  # noqa: E712
+
+def _pending_condition():
+    return Guest.response_date.is_(None)
+
+def compute_guest_stats():
+    """כל הסטטיסטיקות בשאילתה אחת (סכומים מותנים) במקום סריקה נפרדת לכל מונה"""
+    row = db.session.query(
+        db.func.count(Guest.id),
+        _sum_if(_confirmed_condition()),
+        _sum_if(_declined_condition()),
+        _sum_if(_pending_condition()),
+        _sum_if(_confirmed_condition(), Guest.confirmed_count),
+        _sum_if((Guest.is_attending == False) & (Guest.message_sent == True)),  # noqa: E712
+    ).one()
+    return {field: int(value or 0) for field, value in zip(STATS_FIELDS, row)}
+
+def rebuild_guest_stats_counters(session=None):
+    """חישוב מלא של שורת המונים (אחרי פעולות bulk או כשהשורה חסרה)"""
+    session = session or db.session
+    stats = compute_guest_stats()
+    table = GuestStatsCounters.__table__
+    updated = session.execute(table.update().where(table.c.id == 1).values(**stats)).rowcount
+    if not updated:
+        session.execute(table.insert().values(id=1, **stats))
+    return stats
+
+def get_guest_stats():
+    if not app.config['GUEST_STATS_COUNTERS']:
+        return compute_guest_stats()
+    row = db.session.get(GuestStatsCounters, 1)
+    if row is None:
+        stats = rebuild_guest_stats_counters()
+        db.session.commit()
+        return stats
+    return {field: getattr(row, field) for field in STATS_FIELDS}
+
+def _stats_contribution(is_attending, message_sent, response_date, confirmed_count):
+    """התרומה של אורח בודד לכל מונה - חייבת להתאים לתנאים ב-compute_guest_stats"""
+    return (
+        1,
+        1 if is_attending is True else 0,
+        1 if is_attending is False and response_date is not None else 0,
+        1 if response_date is None else 0,
+        (confirmed_count or 0) if is_attending is True else 0,
+        1 if is_attending is False and message_sent is True else 0,
+    )
+
+_STATS_ATTRS = ('is_attending', 'message_sent', 'response_date', 'confirmed_count')
+
+def _guest_stats_state(guest, before):
+    """ערכי האורח לפני/אחרי ה-flush; None אם הערך הקודם לא נטען ולכן לא ידוע"""
+    values = []
+    state = db.inspect(guest)
+    for name in _STATS_ATTRS:
+        if before:
+            hist = state.attrs[name].history
+            if hist.deleted:
+                values.append(hist.deleted[0])
+                continue
+            if hist.added:
+                return None
+        values.append(getattr(guest, name))
+    return values
+
+@db.event.listens_for(db.session, 'after_flush')
+def _update_guest_stats_counters(session, flush_context):
+    """עדכון מונים לפי ההפרש בלבד - O(שורות שהשתנו) ולא O(כל האורחים)"""
+    if any(isinstance(obj, (Guest, MessageLog)) for obj in (*session.new, *session.dirty, *session.deleted)):
+        bump_data_version(session)
+    if not app.config['GUEST_STATS_COUNTERS']:
+        return
+    delta = [0] * len(STATS_FIELDS)
+    changes = [(g, None, False) for g in session.new if isinstance(g, Guest)]
+    changes += [(g, True, True) for g in session.dirty if isinstance(g, Guest)]
+    changes += [(g, True, None) for g in session.deleted if isinstance(g, Guest)]
+    if not changes:
+        return
+    for guest, has_before, has_after in changes:
+        if has_before:
+            before = _guest_stats_state(guest, before=True)
+            if before is None:
+                rebuild_guest_stats_counters(session)
+                return
+            for i, v in enumerate(_stats_contribution(*before)):
+                delta[i] -= v
+        if has_after is not None:
+            for i, v in enumerate(_stats_contribution(*_guest_stats_state(guest, before=False))):
+                delta[i] += v
+    if not any(delta):
+        return
+    table = GuestStatsCounters.__table__
+    values = {field: table.c[field] + d for field, d in zip(STATS_FIELDS, delta) if d}
+    if not session.execute(table.update().where(table.c.id == 1).values(**values)).rowcount:
+        rebuild_guest_stats_counters(session)
+
+# ====== אינדקס החיפוש (guest_search.py) ======
+_SEARCH_COLUMNS = [getattr(Guest, attr) for attr in ('id',) + guest_search.SEARCH_ATTRS]
+
+def rebuild_guest_search(session=None):
+    session = session or db.session
+    rows = session.execute(db.select(*_SEARCH_COLUMNS)).all()
+    guest_search.rebuild(session.connection(), rows)
+
+@db.event.listens_for(db.session, 'after_flush')
+def _sync_guest_search(session, flush_context):
+    """עדכון האינדקס רק לאורחים שנוספו/נמחקו או ששדה מחופש שלהם השתנה"""
+    changed = [g for g in session.new if isinstance(g, Guest)]
+    for g in session.dirty:
+        if isinstance(g, Guest):
+            state = db.inspect(g)
+            if any(state.attrs[attr].history.has_changes() for attr in guest_search.SEARCH_ATTRS):
+                changed.append(g)
+    deleted = [g.id for g in session.deleted if isinstance(g, Guest)]
+    if not changed and not deleted:
+        return
+    conn = session.connection()
+    guest_search.remove_guests(conn, deleted)
+    guest_search.index_guests(conn, [(g.id,) + tuple(getattr(g, a) for a in guest_search.SEARCH_ATTRS) for g in changed])
+
+def index_new_guests(session, after_id):
+    """אינדוקס האורחים שנוספו אחרי after_id בלבד (INSERT מרובה) - בלי לבנות את כל האינדקס"""
+    rows = session.execute(db.select(*_SEARCH_COLUMNS).where(Guest.id > after_id)).all()
+    conn = session.connection()
+    for i in range(0, len(rows), 1000):
+        guest_search.index_guests(conn, rows[i:i + 1000])
+
+def _bulk_update_keys(orm_execute_state):
+    """שמות העמודות ש-UPDATE מרובה משנה (מתוך values() או מרשימת הפרמטרים)"""
+    params = orm_execute_state.parameters
+    if isinstance(params, list) and params:
+        # UPDATE לפי מפתח ראשי (רשימת dicts) - בלי values(); compile() היה מחזיר את כל העמודות
+        return set(params[0])
+    keys = set(orm_execute_state.statement.compile().params)
+    if isinstance(params, dict):
+        keys |= set(params)
+    return keys
+
+@db.event.listens_for(db.session, 'do_orm_execute')
+def _bulk_write_hooks(orm_execute_state):
+    """Query.update / Query.delete / insert מרובה עוקפים את after_flush - מטפלים בהם כאן"""
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper not in (Guest.__mapper__, MessageLog.__mapper__):
+        return
+    session = orm_execute_state.session
+    is_guest_insert = mapper is Guest.__mapper__ and orm_execute_state.is_insert
+    if is_guest_insert:
+        last_id = session.execute(db.select(db.func.max(Guest.id))).scalar() or 0
+    result = orm_execute_state.invoke_statement()
+    bump_data_version(session)
+    if mapper is Guest.__mapper__ and app.config['GUEST_STATS_COUNTERS']:
+        rebuild_guest_stats_counters(session)
+    if is_guest_insert:
+        index_new_guests(session, last_id)
+    elif mapper is Guest.__mapper__ and (
+            orm_execute_state.is_delete
+            or _bulk_update_keys(orm_execute_state) & set(guest_search.SEARCH_ATTRS)):
+        rebuild_guest_search(session)
+    return result
 
 
 # ====== ראוט עריכת אורח ======
@@ -171,6 +495,10 @@ class MessageLog(db.Model):
 def edit_guest(guest_id):
     guest = Guest.query.get_or_404(guest_id)
     if request.method == 'POST':
+        error = phone_conflict(request.form['phone'], guest.id) if request.form['phone'] != guest.phone else None
+        if error:
+            flash(error, 'error')
+            return render_template('edit_guest.html', guest=guest)
         guest.name = request.form['name']
         guest.phone = request.form['phone']
         guest.email = request.form.get('email', '').strip() or None
@@ -199,29 +527,210 @@ def delete_all_guests():
     flash('כל האורחים נמחקו בהצלחה', 'success')
     return redirect(url_for('admin'))
 
-# יצירת הטבלאות
+# ====== סכמה ======
+# הסכמה מנוהלת ב-migrations.py ורצה בזמן deploy (python migrate_db.py), לא בכל import של worker
+def run_migrations(target=None):
+    with app.app_context():
+        return migrations.migrate(db.engine, db.metadata, target=target)
+
+def reset_database():
+    """מוחק הכל ובונה מחדש דרך המיגרציות (לסקריפטים של בדיקות ביצועים בלבד)"""
+    with app.app_context():
+        db.drop_all()
+        with db.engine.begin() as conn:
+            for table in (migrations.SCHEMA_TABLE, guest_search.SQLITE_TABLE, guest_search.POSTGRES_TABLE):
+                conn.execute(db.text(f'DROP TABLE IF EXISTS {table}'))
+    run_migrations()
+
 with app.app_context():
-    db.create_all()
+    try:
+        pending = migrations.pending_migrations(db.engine)
+    except Exception as e:
+        pending = None
+        print(f"⚠️ schema version check failed: {e}")
+    if pending:
+        print(f"⚠️ {len(pending)} pending migrations (run python migrate_db.py): "
+              + ', '.join(str(m.version) for m in pending))
 
 @app.route('/')
 def index():
     """עמוד הבית - סטטיסטיקות כלליות"""
-    total_guests = Guest.query.count()
-    confirmed_guests = Guest.query.filter_by(is_attending=True).count()
-    total_attending = db.session.query(db.func.sum(Guest.confirmed_count)).filter_by(is_attending=True).scalar() or 0
-    pending_responses = Guest.query.filter_by(is_attending=False, message_sent=True).count()
-    
+    data_version = get_data_version()
+    stats = get_guest_stats()
     return render_template('index.html', 
-                         total_guests=total_guests,
-                         confirmed_guests=confirmed_guests,
-                         total_attending=total_attending,
-                         pending_responses=pending_responses)
+                         stats=stats,
+                         data_version=data_version,
+                         total_guests=stats['total_guests'],
+                         confirmed_guests=stats['confirmed'],
+                         total_attending=stats['total_attending'],
+                         pending_responses=stats['awaiting_reply'])
 
 @app.route('/admin')
 def admin():
-    """עמוד ניהול - רשימת כל האורחים"""
-    guests = Guest.query.all()
-    return render_template('admin.html', guests=guests)
+    """עמוד ניהול - השורות נטענות בהדרגה דרך /api/admin/guests"""
+    _, breakdown = get_guest_breakdown()
+    return render_template('admin.html',
+                           total_guests=breakdown['totals']['guests'],
+                           sides=sorted(s for s in breakdown['by_side'] if s),
+                           groups=sorted(g for g in breakdown['by_group'] if g),
+                           tables=[t for (t,) in db.session.query(Table.table_number).order_by(Table.table_number)],
+                           sort_keys=ADMIN_SORT_KEYS,
+                           page_size=ADMIN_PAGE_SIZE)
+
+# ====== רשימת האורחים לעמוד הניהול: עימוד keyset, מיון וסינון בצד השרת ======
+# מיון רק לפי עמודות עם אינדקס; id משמש לשבירת שוויון ולכן הסמן הוא (ערך, id)
+ADMIN_SORT_KEYS = {
+    'id': Guest.id,
+    'name': Guest.name,
+}
+ADMIN_PAGE_SIZE = 50
+ADMIN_MAX_PAGE_SIZE = 200
+ADMIN_STATUS_FILTERS = {
+    'confirmed': _confirmed_condition,
+    'declined': _declined_condition,
+    'pending': _pending_condition,
+}
+
+def encode_admin_cursor(value, guest_id):
+    raw = json.dumps([value, guest_id], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_admin_cursor(cursor):
+    """סמן לא תקין מחזיר None (הקורא עונה 400)"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value, guest_id = json.loads(raw.decode('utf-8'))
+        return value, int(guest_id)
+    except (ValueError, TypeError):
+        return None
+
+def admin_guest_filters(args):
+    """תנאי WHERE מתוך פרמטרי הבקשה. צד/קבוצה ריקים (side=) = ללא צד/קבוצה; table=none = ללא שולחן"""
+    conditions = []
+    status = args.get('status')
+    if status:
+        if status not in ADMIN_STATUS_FILTERS:
+            raise ValueError(f'unknown status: {status}')
+        conditions.append(ADMIN_STATUS_FILTERS[status]())
+    for param, column in (('side', Guest.side), ('group', Guest.group_affiliation)):
+        if param in args:
+            value = args.get(param, '').strip()
+            conditions.append(column == value if value else or_(column.is_(None), column == ''))
+    message_sent = args.get('message_sent')
+    if message_sent in ('1', 'true'):
+        conditions.append(Guest.message_sent.is_(True))
+    elif message_sent in ('0', 'false'):
+        conditions.append(or_(Guest.message_sent.is_(False), Guest.message_sent.is_(None)))
+    elif message_sent:
+        raise ValueError(f'invalid message_sent: {message_sent}')
+    table = args.get('table')
+    if table == 'none':
+        conditions.append(Guest.table_number.is_(None))
+    elif table:
+        conditions.append(Guest.table_number == int(table))
+    return conditions
+
+def serialize_admin_guest(guest):
+    return {
+        'id': guest.id,
+        'name': guest.name,
+        'phone': guest.phone,
+        'email': guest.email,
+        'notes': guest.notes,
+        'group_affiliation': guest.group_affiliation,
+        'side': guest.side,
+        'invited_count': guest.invited_count,
+        'confirmed_count': guest.confirmed_count,
+        'is_attending': bool(guest.is_attending),
+        'attendance_status': guest.attendance_status,
+        'response_date': guest.response_date.strftime('%d/%m %H:%M') if guest.response_date else None,
+        'estimated_gift_amount': guest.estimated_gift_amount,
+        'message_sent': bool(guest.message_sent),
+        'table_number': guest.table_number,
+        'unique_token': guest.unique_token,
+        'rsvp_url': url_for('rsvp_form', token=guest.unique_token),
+        'edit_url': url_for('edit_guest', guest_id=guest.id),
+    }
+
+@app.route('/api/guests/search')
+def api_guests_search():
+    """חיפוש חופשי בשם/טלפון/הערות/קבוצה: ?q=כהן&limit=20 (+ אותם מסננים של /api/admin/guests)"""
+    query = request.args.get('q', '').strip()
+    try:
+        limit = max(1, min(int(request.args.get('limit', 20)), ADMIN_MAX_PAGE_SIZE))
+        conditions = admin_guest_filters(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    started = time.perf_counter()
+    # כשיש מסננים מבקשים יותר מועמדים, כי חלקם יסוננו
+    ranked = guest_search.search(db.session.connection(), query, limit * 5 if conditions else limit)
+    guests = {}
+    if ranked:
+        guests = {g.id: g for g in Guest.query.filter(Guest.id.in_([gid for gid, _ in ranked]), *conditions)}
+    results = []
+    for guest_id, score in ranked:
+        guest = guests.get(guest_id)
+        if guest is not None:
+            results.append({**serialize_admin_guest(guest), 'score': round(score, 4)})
+            if len(results) >= limit:
+                break
+    return jsonify({
+        'success': True,
+        'query': query,
+        'guests': results,
+        'took_ms': round((time.perf_counter() - started) * 1000, 2),
+    })
+
+@app.route('/api/admin/guests')
+def api_admin_guests():
+    """עמוד אחד של אורחים: ?sort=name&dir=desc&status=pending&side=...&group=...&message_sent=0&table=3&cursor=...
+
+    מחזיר next_cursor לעמוד הבא (null בסוף הרשימה). total (ספירה לפי הסינון) נשלח רק בעמוד הראשון."""
+    sort = request.args.get('sort', 'id')
+    direction = request.args.get('dir', 'asc')
+    if sort not in ADMIN_SORT_KEYS or direction not in ('asc', 'desc'):
+        return jsonify({'success': False, 'message': 'invalid sort'}), 400
+    try:
+        limit = max(1, min(int(request.args.get('limit', ADMIN_PAGE_SIZE)), ADMIN_MAX_PAGE_SIZE))
+        conditions = admin_guest_filters(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    column = ADMIN_SORT_KEYS[sort]
+    query = Guest.query.filter(*conditions)
+    total = query.count() if not request.args.get('cursor') else None
+
+    cursor = request.args.get('cursor')
+    if cursor:
+        decoded = decode_admin_cursor(cursor)
+        if decoded is None:
+            return jsonify({'success': False, 'message': 'invalid cursor'}), 400
+        value, last_id = decoded
+        if column is Guest.id:
+            query = query.filter(Guest.id > last_id if direction == 'asc' else Guest.id < last_id)
+        elif direction == 'asc':
+            query = query.filter(or_(column > value, (column == value) & (Guest.id > last_id)))
+        else:
+            query = query.filter(or_(column < value, (column == value) & (Guest.id < last_id)))
+
+    if direction == 'asc':
+        query = query.order_by(column.asc(), Guest.id.asc())
+    else:
+        query = query.order_by(column.desc(), Guest.id.desc())
+    # שורה אחת נוספת מגלה אם יש עמוד הבא בלי שאילתת ספירה
+    guests = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(guests) > limit:
+        guests = guests[:limit]
+        last = guests[-1]
+        next_cursor = encode_admin_cursor(getattr(last, column.key), last.id)
+
+    return jsonify({
+        'success': True,
+        'guests': [serialize_admin_guest(g) for g in guests],
+        'next_cursor': next_cursor,
+        'total': total,
+    })
 
 @app.route('/add_guest', methods=['GET', 'POST'])
 def add_guest():
@@ -229,6 +738,10 @@ def add_guest():
     if request.method == 'POST':
         name = request.form['name']
         phone = request.form['phone']
+        error = phone_conflict(phone)
+        if error:
+            flash(error, 'error')
+            return render_template('add_guest.html')
         invited_count = int(request.form.get('invited_count', 1))
         
         # שדות חדשים
@@ -270,6 +783,8 @@ def add_guest():
             guest.is_attending = None
         
         db.session.add(guest)
+        db.session.flush()
+        issue_guest_token(guest)
         db.session.commit()
         
         flash(f'האורח {name} נוסף בהצלחה!', 'success')
@@ -277,41 +792,86 @@ def add_guest():
     
     return render_template('add_guest.html')
 
+# גרסת תבנית ה-RSVP נכנסת ל-ETag כדי שפריסה חדשה לא תגיש עמוד ישן מהמטמון
+_rsvp_template_path = os.path.join(app.root_path, 'templates', 'rsvp.html')
+RSVP_PAGE_VERSION = str(int(os.path.getmtime(_rsvp_template_path))) if os.path.exists(_rsvp_template_path) else '0'
+
+def rsvp_page_etag(guest):
+    pending = rsvp_journal.pending(guest.id) if app.config['RSVP_WRITE_BEHIND'] else None
+    parts = [
+        RSVP_PAGE_VERSION,
+        str(guest.id),
+        guest.unique_token,
+        str(guest.updated_at or guest.created_at or ''),
+        pending['response_date'] if pending else '',
+    ]
+    return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()[:32]
+
 @app.route('/rsvp/<token>')
 def rsvp_form(token):
     """טופס RSVP לאורח"""
-    guest = Guest.query.filter_by(unique_token=token).first_or_404()
-    
-    # יצירת קוד QR עם הקישור
+    guest = get_guest_by_token_or_404(token)
+    etag = rsvp_page_etag(guest)
+    # הודעות flash מוצגות פעם אחת בלבד, ולכן אז תמיד מרנדרים מחדש
+    if '_flashes' not in session and request.if_none_match.contains(etag):
+        resp = make_response('', 304)
+    else:
+        guest = overlay_pending_rsvp(guest)
+        # קוד ה-QR נטען בנפרד מ-/rsvp/<token>/qr כדי שהדפדפן ישמור אותו במטמון
+        resp = make_response(render_template('rsvp.html', guest=guest))
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    return resp
+
+@app.route('/rsvp/<token>/qr')
+def rsvp_qr(token):
+    """קוד QR לקישור האישי - SVG כברירת מחדל, PNG עם ?format=png"""
+    fmt = request.args.get('format', 'svg')
+    if fmt not in QR_MIMETYPES:
+        fmt = 'svg'
     website_url = os.getenv('WEBSITE_URL', 'http://localhost:5000')
-    qr_url = f"{website_url}/rsvp/{token}"
-    
-    qr = qrcode.QRCode(version=1, box_size=10, border=5)
-    qr.add_data(qr_url)
-    qr.make(fit=True)
-    
-    img = qr.make_image(fill_color="black", back_color="white")
-    buffered = BytesIO()
-    img.save(buffered)
-    img_str = base64.b64encode(buffered.getvalue()).decode()
-    
-    return render_template('rsvp.html', guest=guest, qr_code=img_str)
+    etag = qr_etag(rsvp_url(website_url, token), fmt)
+    cache_control = 'public, max-age=86400'
+
+    # התוכן נגזר מהקישור בלבד, כך שבקשה מותנית לא צריכה DB או רינדור
+    if request.if_none_match.contains(etag):
+        resp = make_response('', 304)
+        resp.set_etag(etag)
+        resp.headers['Cache-Control'] = cache_control
+        return resp
+
+    get_guest_by_token_or_404(token)
+    resp = make_response(get_rsvp_qr(website_url, token, fmt))
+    resp.mimetype = QR_MIMETYPES[fmt]
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = cache_control
+    return resp
 
 @app.route('/rsvp/<token>', methods=['POST'])
 def submit_rsvp(token):
     """עדכון RSVP"""
-    guest = Guest.query.filter_by(unique_token=token).first_or_404()
+    guest = get_guest_by_token_or_404(token)
     
     is_attending = request.form.get('is_attending') == 'yes'
     confirmed_count = int(request.form.get('confirmed_count', 0)) if is_attending else 0
     notes = request.form.get('notes', '')
+    response_date = get_local_time()
     
-    guest.is_attending = is_attending
-    guest.confirmed_count = confirmed_count
-    guest.notes = notes
-    guest.response_date = get_local_time()
-    
-    db.session.commit()
+    if app.config['RSVP_WRITE_BEHIND']:
+        # נרשם ביומן (fsync) ומאושר מיד; ה-flusher יכתוב ל-DB במנות
+        rsvp_journal.append({
+            'guest_id': guest.id,
+            'is_attending': is_attending,
+            'confirmed_count': confirmed_count,
+            'notes': notes,
+            'response_date': response_date.isoformat(),
+        })
+        rsvp_flusher.ensure_running()
+        db.session.expunge(guest)
+        apply_rsvp(guest, is_attending, confirmed_count, notes, response_date)
+    else:
+        apply_rsvp(guest, is_attending, confirmed_count, notes, response_date)
+        db.session.commit()
     
     if is_attending:
         flash(f'תודה {guest.name}! אנחנו שמחים שתגיעו ({confirmed_count} אנשים)', 'success')
@@ -320,16 +880,64 @@ def submit_rsvp(token):
     
     return render_template('rsvp_success.html', guest=guest)
 
+def apply_rsvp(guest, is_attending, confirmed_count, notes, response_date):
+    guest.is_attending = is_attending
+    guest.confirmed_count = confirmed_count
+    guest.notes = notes
+    guest.response_date = response_date
+
+def overlay_pending_rsvp(guest):
+    """מציג לאורח את התשובה האחרונה שלו גם אם עדיין לא נכתבה ל-DB"""
+    if not app.config['RSVP_WRITE_BEHIND']:
+        return guest
+    entry = rsvp_journal.pending(guest.id)
+    if entry:
+        db.session.expunge(guest)
+        apply_rsvp(guest, entry['is_attending'], entry['confirmed_count'], entry['notes'],
+                   datetime.fromisoformat(entry['response_date']))
+    return guest
+
+def apply_rsvp_journal(entries, batch_size=500):
+    """מחיל רשומות יומן על טבלת האורחים - רק התשובה האחרונה של כל אורח, בטרנזקציות של batch_size"""
+    latest = {}
+    for entry in entries:
+        latest[entry['guest_id']] = entry
+    ids = list(latest)
+    with app.app_context():
+        try:
+            for start in range(0, len(ids), batch_size):
+                chunk = ids[start:start + batch_size]
+                for guest in Guest.query.filter(Guest.id.in_(chunk)).all():
+                    entry = latest[guest.id]
+                    apply_rsvp(guest, entry['is_attending'], entry['confirmed_count'], entry['notes'],
+                               datetime.fromisoformat(entry['response_date']))
+                db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+rsvp_journal = RSVPJournal(os.getenv('RSVP_JOURNAL_PATH', DEFAULT_JOURNAL_PATH))
+rsvp_flusher = RSVPFlusher(rsvp_journal, apply_rsvp_journal,
+                           interval=float(os.getenv('RSVP_FLUSH_INTERVAL', '1.0')))
+if app.config['RSVP_WRITE_BEHIND']:
+    # משלים תשובות שנשארו ביומן מהרצה קודמת
+    rsvp_flusher.ensure_running()
+
 @app.route('/seating')
 def seating_chart():
     """תכנון סידור ישיבה"""
     tables = Table.query.all()
-    guests_with_tables = Guest.query.filter(Guest.table_number.isnot(None)).all()
+    # ממוין לפי שולחן (דרך האינדקס) ומקובץ פעם אחת, במקום סינון של כל הרשימה לכל שולחן בתבנית
+    guests_with_tables = Guest.query.filter(Guest.table_number.isnot(None)).order_by(Guest.table_number, Guest.id).all()
     guests_without_tables = Guest.query.filter_by(is_attending=True, table_number=None).all()
+    guests_by_table = {}
+    for guest in guests_with_tables:
+        guests_by_table.setdefault(guest.table_number, []).append(guest)
     
     return render_template('seating.html', 
                          tables=tables, 
                          guests_with_tables=guests_with_tables,
+                         guests_by_table=guests_by_table,
                          guests_without_tables=guests_without_tables)
 
 @app.route('/add_table', methods=['POST'])
@@ -362,14 +970,109 @@ def assign_table():
 @app.route('/api/guest_stats')
 def guest_stats():
     """API לסטטיסטיקות (לצרכי JavaScript)"""
-    stats = {
-        'total_guests': Guest.query.count(),
-        'confirmed': Guest.query.filter_by(is_attending=True).count(),
-        'declined': Guest.query.filter_by(is_attending=False).filter(Guest.response_date.isnot(None)).count(),
-        'pending': Guest.query.filter(Guest.response_date.is_(None)).count(),
-        'total_attending': db.session.query(db.func.sum(Guest.confirmed_count)).filter_by(is_attending=True).scalar() or 0
-    }
-    return jsonify(stats)
+    stats = get_guest_stats()
+    return jsonify({field: stats[field] for field in ('total_guests', 'confirmed', 'declined', 'pending', 'total_attending')})
+
+BREAKDOWN_FIELDS = ('guests', 'invited', 'confirmed', 'declined', 'pending', 'attending', 'gift_total', 'gift_confirmed')
+_breakdown_cache = (None, None)  # (data_version, result)
+
+def compute_guest_breakdown():
+    """פילוח לפי צד וקבוצה ב-GROUP BY אחד; הסיכומים לפי צד/קבוצה נגזרים מהשורות בפייתון"""
+    side = db.func.coalesce(Guest.side, '')
+    group = db.func.coalesce(Guest.group_affiliation, '')
+    rows = db.session.query(
+        side,
+        group,
+        db.func.count(Guest.id),
+        db.func.coalesce(db.func.sum(Guest.invited_count), 0),
+        _sum_if(_confirmed_condition()),
+        _sum_if(_declined_condition()),
+        _sum_if(_pending_condition()),
+        _sum_if(_confirmed_condition(), Guest.confirmed_count),
+        db.func.coalesce(db.func.sum(Guest.estimated_gift_amount), 0),
+        _sum_if(_confirmed_condition(), Guest.estimated_gift_amount),
+    ).group_by(side, group).all()
+
+    def empty():
+        return dict.fromkeys(BREAKDOWN_FIELDS, 0)
+
+    def add(target, values):
+        for field in BREAKDOWN_FIELDS:
+            target[field] += values[field]
+
+    groups, by_side, by_group, totals = [], {}, {}, empty()
+    for row in rows:
+        values = {field: float(v or 0) if field.startswith('gift') else int(v or 0)
+                  for field, v in zip(BREAKDOWN_FIELDS, row[2:])}
+        groups.append({'side': row[0], 'group': row[1], **values})
+        add(by_side.setdefault(row[0], empty()), values)
+        add(by_group.setdefault(row[1], empty()), values)
+        add(totals, values)
+    return {'rows': groups, 'by_side': by_side, 'by_group': by_group, 'totals': totals}
+
+def get_guest_breakdown():
+    """(data_version, פילוח) - מהמטמון כל עוד הנתונים לא השתנו"""
+    global _breakdown_cache
+    version = get_data_version()
+    cached_version, result = _breakdown_cache
+    if cached_version != version:
+        result = compute_guest_breakdown()
+        _breakdown_cache = (version, result)
+    return version, result
+
+@app.route('/api/guest_stats/breakdown')
+def guest_stats_breakdown():
+    """אישרו/לא יגיעו/ממתינים וסכומי מתנות לפי צד וקבוצה"""
+    version, result = get_guest_breakdown()
+    return jsonify({'data_version': version, **result})
+
+# ====== עדכונים חיים לדשבורד (Server-Sent Events) ======
+# SSE_HOLD_SECONDS=0 (ברירת מחדל): כל חיבור עונה מיד ונסגר, והדפדפן מתחבר מחדש אחרי retry -
+# כך חיבור פתוח לא מחזיק worker סינכרוני של gunicorn. עם workers אסינכרוניים (gevent/gthread)
+# אפשר להחזיק את החיבור פתוח ולדחוף שינויים מיד.
+app.config['SSE_HOLD_SECONDS'] = float(os.getenv('SSE_HOLD_SECONDS', '0'))
+app.config['SSE_RETRY_MS'] = int(os.getenv('SSE_RETRY_MS', '5000'))
+app.config['SSE_POLL_SECONDS'] = float(os.getenv('SSE_POLL_SECONDS', '1.0'))
+app.config['SSE_COALESCE_SECONDS'] = float(os.getenv('SSE_COALESCE_SECONDS', '1.0'))
+
+@app.route('/api/stats/stream')
+def stats_stream():
+    """שולח את הסטטיסטיקות רק כשגרסת הנתונים השתנתה; בתוך חיבור פתוח - רק השדות שהשתנו"""
+    # Last-Event-ID אחרי חיבור מחדש; ?since= לחיבור הראשון מהעמוד (שכבר מכיל את הנתונים)
+    try:
+        last_version = int(request.headers.get('Last-Event-ID') or request.args.get('since', ''))
+    except ValueError:
+        last_version = None
+    hold = app.config['SSE_HOLD_SECONDS']
+    poll = app.config['SSE_POLL_SECONDS']
+    coalesce = app.config['SSE_COALESCE_SECONDS']
+
+    def events():
+        version = last_version
+        sent = None
+        deadline = time.monotonic() + hold
+        yield f"retry: {app.config['SSE_RETRY_MS']}\n\n"
+        while True:
+            current = get_data_version()
+            if current != version:
+                if sent is not None and coalesce:
+                    # מאחדים רצף כתיבות (למשל גל אישורי הגעה) לדחיפה אחת
+                    db.session.remove()
+                    time.sleep(coalesce)
+                    current = get_data_version()
+                stats = get_guest_stats()
+                payload = stats if sent is None else {k: v for k, v in stats.items() if sent.get(k) != v}
+                if payload:
+                    yield f"id: {current}\nevent: stats\ndata: {json.dumps(payload)}\n\n"
+                sent, version = stats, current
+            # לא מחזיקים חיבור ל-DB בזמן המתנה
+            db.session.remove()
+            if time.monotonic() + poll > deadline:
+                break
+            time.sleep(poll)
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 def check_chrome_availability():
     """בדיקה אם Chrome זמין במערכת"""
@@ -419,25 +1122,96 @@ def require_bot_auth():
     return True, None
 
 # ====== Message generation for bot ======
+def invitation_message_template():
+    # שלום / הזמנה / תאריך / קישור / מספר מקומות - משותף ל-API של הבוט ולקבצי הייצוא (export_pipeline.py)
+    return export_pipeline.invitation_template(DEFAULT_WEBSITE_URL, COUPLE_NAMES, WEDDING_DATE)
+
 def build_invitation_message(guest: 'Guest') -> str:
-    base_link = f"{DEFAULT_WEBSITE_URL.rstrip('/')}/rsvp/{guest.unique_token}"
-    parts = [
-        f"שלום {guest.name}!",  # greeting
-        f"אתם מוזמנים ל{COUPLE_NAMES}!" if COUPLE_NAMES else "אתם מוזמנים לחתונה שלנו!",
-    ]
-    if WEDDING_DATE:
-        parts.append(f"התאריך: {WEDDING_DATE}")
-    parts.append(f"נשמח לאישור הגעה כאן: {base_link}")
-    if guest.invited_count and guest.invited_count > 1:
-        parts.append(f"מספר מקומות שמורים לכם: {guest.invited_count}")
-    return '\n'.join(parts)
+    return invitation_message_template().render(guest.name, guest.unique_token, guest.invited_count)
 
 # ====== Bot-facing API endpoints (used only by local runner) ======
 from sqlalchemy import or_  # placed here to avoid circular issues if imported earlier
-import json  # lightweight usage
+
+# שליפת אורחים לשליחה היא "השכרה": האורחים שנשלפו שמורים לבוט ששלף אותם עד שהוא מסמן אותם
+# (/api/bot/mark) או עד שפג התוקף - כך כמה בוטים (כמה חשבונות WhatsApp) שולחים במקביל בלי כפילויות.
+BOT_LEASE_SECONDS = int(os.getenv('BOT_LEASE_SECONDS', 15 * 60))
+BOT_LEASE_MAX_SECONDS = 6 * 3600
+BOT_CLAIM_ATTEMPTS = 3  # סבבים להשלמת limit כשבוט אחר תפס חלק מהמועמדים באותו רגע
+
+def _lease_now():
+    # שעון מקומי בלי אזור זמן - כמו שהעמודה נשמרת (DateTime נאיבי ב-SQLite וב-Postgres)
+    return get_local_time().replace(tzinfo=None)
+
+def _claimable(table, now, resend=False):
+    """ממתינים לשליחה (או, עם resend, כאלה שנכשלו) שאין עליהם השכרה בתוקף"""
+    pending = table.c.message_sent == False  # noqa: E712
+    if resend:
+        # include those that previously failed (appear in MessageLog with status failed)
+        failed_ids = db.select(MessageLog.guest_id).where(MessageLog.status == 'failed').distinct()
+        pending = or_(pending, table.c.id.in_(failed_ids))
+    return pending & or_(table.c.bot_lease_until.is_(None), table.c.bot_lease_until < now)
+
+def claim_bot_guests(limit, lease_seconds=BOT_LEASE_SECONDS, resend=False):
+    """שולף עד limit אורחים לשליחה ושומר אותם לבוט הזה. מחזיר (lease, lease_until, [guest_id]).
+    Postgres: SELECT ... FOR UPDATE SKIP LOCKED - בוטים במקביל מדלגים על השורות של השני.
+    SQLite (כותב אחד בכל רגע): UPDATE מותנה (compare-and-set) על המועמדים - שורה שבוט אחר
+    הספיק לתפוס לא עונה יותר על התנאי ולא נלקחת פעמיים."""
+    table = Guest.__table__
+    lease = uuid.uuid4().hex
+    postgres = db.engine.dialect.name == 'postgresql'
+    claimed = []
+    until = None
+    for _ in range(BOT_CLAIM_ATTEMPTS):
+        now = _lease_now()
+        until = now + timedelta(seconds=lease_seconds)
+        query = (db.select(table.c.id).where(_claimable(table, now, resend))
+                 .order_by(table.c.id).limit(limit - len(claimed)))
+        if postgres:
+            query = query.with_for_update(skip_locked=True)
+        ids = db.session.execute(query).scalars().all()
+        if not ids:
+            db.session.rollback()
+            break
+        # updated_at נשאר כמו שהוא: ההשכרה לא משנה את האורח (since= ב-/api/guests, ETag של ה-RSVP)
+        won = db.session.execute(
+            table.update().where(table.c.id.in_(ids), _claimable(table, now, resend))
+            .values(bot_lease_owner=lease, bot_lease_until=until, updated_at=table.c.updated_at)).rowcount
+        db.session.commit()
+        if won == len(ids):
+            claimed += ids
+            break
+        claimed += db.session.execute(db.select(table.c.id).where(
+            table.c.id.in_(ids), table.c.bot_lease_owner == lease)).scalars().all()
+        if len(claimed) >= limit:
+            break
+    return lease, until, sorted(claimed)
+
+def release_bot_leases(guest_ids, lease=None):
+    """משחרר השכרות (אורח שנכשל / שלא הגיע תורו) - רק של ה-lease הזה אם ניתן. בלי commit"""
+    if not guest_ids:
+        return
+    table = Guest.__table__
+    condition = table.c.id == db.bindparam('guest_id')
+    if lease:
+        condition &= table.c.bot_lease_owner == lease
+    db.session.execute(
+        table.update().where(condition)
+        .values(bot_lease_owner=None, bot_lease_until=None, updated_at=table.c.updated_at),
+        [{'guest_id': guest_id} for guest_id in dict.fromkeys(guest_ids)])
+
+def _int_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _int_ids(values):
+    return [i for i in map(_int_id, values or []) if i is not None]
 
 @app.route('/api/bot/pending')
 def api_bot_pending():
+    """שולף ושומר לבוט עד limit אורחים (?limit=, ברירת מחדל 20) ל-lease_seconds (?lease=).
+    התשובה כוללת lease - מחזירים אותו ב-/api/bot/mark. ?resend=1 כולל גם אורחים שהשליחה אליהם נכשלה."""
     ok, resp = require_bot_auth()
     if not ok:
         return resp
@@ -447,15 +1221,16 @@ def api_bot_pending():
     except ValueError:
         limit = 20
     limit = max(1, min(limit, 100))
+    try:
+        lease_seconds = int(request.args.get('lease', BOT_LEASE_SECONDS))
+    except ValueError:
+        lease_seconds = BOT_LEASE_SECONDS
+    lease_seconds = max(30, min(lease_seconds, BOT_LEASE_MAX_SECONDS))
 
     # guests not yet sent (message_sent False) OR explicitly requested resend via ?resend=1 & failed entries
     resend = request.args.get('resend') == '1'
-    q = Guest.query.filter_by(message_sent=False)
-    if resend:
-        # include those that previously failed (appear in MessageLog with status failed)
-        failed_ids = db.session.query(MessageLog.guest_id).filter(MessageLog.status == 'failed').distinct()
-        q = Guest.query.filter(or_(Guest.message_sent == False, Guest.id.in_(failed_ids)))  # noqa: E712
-    guests = q.order_by(Guest.id.asc()).limit(limit).all()
+    lease, lease_until, guest_ids = claim_bot_guests(limit, lease_seconds, resend)
+    guests = Guest.query.filter(Guest.id.in_(guest_ids)).order_by(Guest.id.asc()).all() if guest_ids else []
 
     data = []
     for g in guests:
@@ -463,11 +1238,14 @@ def api_bot_pending():
             'id': g.id,
             'name': g.name,
             'phone': g.phone,
+            'phone_e164': g.phone_e164,
             'invited_count': g.invited_count,
             'unique_token': g.unique_token,
             'message': build_invitation_message(g)
         })
-    return jsonify({'success': True, 'count': len(data), 'guests': data})
+    return jsonify({'success': True, 'count': len(data), 'guests': data, 'lease': lease,
+                    'lease_until': lease_until.isoformat() if lease_until else None,
+                    'lease_seconds': lease_seconds})
 
 @app.route('/api/bot/mark', methods=['POST'])
 def api_bot_mark():
@@ -475,23 +1253,24 @@ def api_bot_mark():
     if not ok:
         return resp
     payload = request.get_json(force=True, silent=True) or {}
-    sent_ids = payload.get('sent', []) or []
+    sent_ids = _int_ids(payload.get('sent'))
     failures = payload.get('failed', []) or []  # list of {id, error}
-    updated = []
-    for gid in sent_ids:
-        g = Guest.query.get(gid)
-        if g and not g.message_sent:
-            g.message_sent = True
-            updated.append(gid)
-            db.session.add(MessageLog(guest_id=g.id, status='sent'))
-    for item in failures:
-        gid = item.get('id')
-        err = item.get('error')
-        g = Guest.query.get(gid) if gid else None
-        if g:
-            db.session.add(MessageLog(guest_id=g.id, status='failed', error=str(err)[:1000]))
+    failed = [(_int_id(item.get('id')), item.get('error')) for item in failures]
+    failed_ids = [gid for gid, _ in failed if gid is not None]
+    release_ids = _int_ids(payload.get('release'))  # נשלפו ולא טופלו (הבוט נעצר באמצע)
+    lease = payload.get('lease')
+    found = _fetch_in_chunks(Guest.id, sent_ids + failed_ids)
+    # סימון כנשלח משחרר גם את ההשכרה (mark_guests_sent)
+    updated = [gid for gid in dict.fromkeys(sent_ids) if gid in found and not found[gid].message_sent]
+    mark_guests_sent(updated)
+    for gid, err in failed:
+        if gid in found:
+            db.session.add(MessageLog(guest_id=gid, status='failed', error=str(err)[:1000]))
+    # נכשלו / לא טופלו - חוזרים לתור מיד (ומי שכבר סומן קודם - רק משתחרר)
+    release_bot_leases([gid for gid in sent_ids if gid not in updated] + failed_ids + release_ids, lease)
     db.session.commit()
-    return jsonify({'success': True, 'marked_sent': updated, 'failed_logged': len(failures)})
+    return jsonify({'success': True, 'marked_sent': updated, 'failed_logged': len(failures),
+                    'released': len(set(failed_ids + release_ids))})
 
 @app.route('/api/bot/logs')
 def api_bot_logs():
@@ -515,6 +1294,96 @@ def api_bot_logs():
         })
     return jsonify({'success': True, 'logs': out})
 
+# ====== רשימת האורחים כזרם (NDJSON) לאינטגרציות ולסקריפטים ======
+GUEST_API_FIELDS = (
+    'id', 'name', 'phone', 'email', 'group_affiliation', 'side', 'invited_count', 'confirmed_count',
+    'attendance_status', 'estimated_gift_amount', 'is_attending', 'message_sent', 'response_date',
+    'notes', 'table_number', 'unique_token', 'created_at', 'updated_at',
+)
+
+def _to_local_naive(dt):
+    """הזמנים נשמרים כשעון מקומי בלי אזור זמן - ממירים לשם את הפרמטר לפני השוואה"""
+    if dt.tzinfo is None:
+        return dt
+    return dt.astimezone(pytz.timezone(os.getenv('TIMEZONE', 'Asia/Jerusalem'))).replace(tzinfo=None)
+
+def iter_guest_rows(fields=GUEST_API_FIELDS, since=None, batch_size=1000):
+    """אורחים כ-dict לפי עמודות נבחרות, בקריאה מ-cursor בצד השרת (yield_per) - בלי אובייקטי ORM
+    ובלי לטעון את כל הטבלה לזיכרון. עם since: רק מי שהשתנה מאז (updated_at >= since), לפי סדר השינוי."""
+    stmt = db.select(*[getattr(Guest, f) for f in fields])
+    if since is not None:
+        stmt = stmt.where(Guest.updated_at >= _to_local_naive(since)).order_by(Guest.updated_at, Guest.id)
+    else:
+        stmt = stmt.order_by(Guest.id)
+    result = db.session.execute(stmt, execution_options={'yield_per': batch_size})
+    try:
+        for row in result.mappings():
+            yield dict(row)
+    finally:
+        result.close()
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+@app.route('/api/guests')
+def api_guests():
+    """כל האורחים כ-NDJSON (שורה לכל אורח), או format=json למערך JSON.
+
+    ?fields=id,name,phone - רק העמודות האלה; ?since=2025-01-01T12:00:00 - רק מי שהשתנה מאז.
+    הרשאה: התחברות מנהל או X-API-KEY של הבוט."""
+    if not is_logged_in():
+        ok, resp = require_bot_auth()
+        if not ok:
+            return resp
+    fields = GUEST_API_FIELDS
+    if request.args.get('fields'):
+        fields = tuple(f.strip() for f in request.args['fields'].split(',') if f.strip())
+        unknown = [f for f in fields if f not in GUEST_API_FIELDS]
+        if unknown or not fields:
+            return jsonify({'success': False, 'message': f"unknown fields: {', '.join(unknown)}"}), 400
+    since = None
+    if request.args.get('since'):
+        try:
+            since = datetime.fromisoformat(request.args['since'])
+        except ValueError:
+            return jsonify({'success': False, 'message': 'since must be an ISO 8601 datetime'}), 400
+    as_array = request.args.get('format') == 'json'
+
+    def generate():
+        # שורות נשלחות בחבילות - chunk לכל שורה מאט את שרת ה-WSGI
+        chunk = []
+        prefix = '['
+        for row in iter_guest_rows(fields, since):
+            line = json.dumps(row, ensure_ascii=False, default=_json_default)
+            if as_array:
+                chunk.append(prefix + line)
+                prefix = ',\n'
+            else:
+                chunk.append(line + '\n')
+            if len(chunk) >= 500:
+                yield ''.join(chunk)
+                chunk = []
+        if as_array:
+            chunk.append('[]\n' if prefix == '[' else ']\n')
+        yield ''.join(chunk)
+
+    response = Response(stream_with_context(generate()),
+                        mimetype='application/json' if as_array else 'application/x-ndjson')
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['X-Data-Version'] = str(get_data_version())
+    return response
+
+def start_bot_job(command, started_message):
+    """הבוט רץ כמשימת רקע (לכל היותר אחת בכל פעם) - מחזיר את ה-job_id למעקב ולביטול"""
+    active = job_queue.active(BOT_JOB_KIND)
+    if active is not None:
+        return jsonify({'success': True, 'job_id': active['id'], 'already_running': True,
+                        'message': 'הבוט כבר פועל - ממתינים לסיום הריצה הנוכחית'})
+    job_id, _ = enqueue_job(BOT_JOB_KIND, {'command': command})
+    return jsonify({'success': True, 'job_id': job_id, 'message': started_message})
+
 @app.route('/api/send_invitations', methods=['POST'])
 def api_send_invitations():
     """API להפעלת בוט שליחת הזמנות"""
@@ -526,20 +1395,7 @@ def api_send_invitations():
                 'message': '📱 שירות WhatsApp זמין רק בסביבת פיתוח מקומית. באפליקציה המוצגת באינטרנט, תוכל לצפות ברשימת האורחים, להוסיף אורחים, לקבל תגובות ולראות מי הגיע. שליחת הודעות WhatsApp מתבצעת בסביבה מקומית בלבד.'
             })
         
-        import subprocess
-        import sys
-        
-        # הפעלת הבוט ברקע
-        python_exe = sys.executable
-        script_path = os.path.join(os.getcwd(), 'whatsapp_bot.py')
-        
-        # הפעלה בתהליך נפרד
-        subprocess.Popen([python_exe, script_path, 'send_all'])
-        
-        return jsonify({
-            'success': True,
-            'message': 'تהליך השליחה התחיל בהצלחה'
-        })
+        return start_bot_job('send_all', 'تהליך השליחה התחיל בהצלחה')
     except Exception as e:
         return jsonify({
             'success': False,
@@ -557,18 +1413,7 @@ def api_send_reminders():
                 'message': '📱 שירות WhatsApp זמין רק בסביבת פיתוח מקומית. באפליקציה המוצגת באינטרנט, תוכל לצפות ברשימת האורחים, להוסיף אורחים, לקבל תגובות ולראות מי הגיע. שליחת הודעות WhatsApp מתבצעת בסביבה מקומית בלבד.'
             })
         
-        import subprocess
-        import sys
-        
-        python_exe = sys.executable
-        script_path = os.path.join(os.getcwd(), 'whatsapp_bot.py')
-        
-        subprocess.Popen([python_exe, script_path, 'send_reminders'])
-        
-        return jsonify({
-            'success': True,
-            'message': 'תהליך שליחת התזכורות התחיל בהצלחה'
-        })
+        return start_bot_job('send_reminders', 'תהליך שליחת התזכורות התחיל בהצלחה')
     except Exception as e:
         return jsonify({
             'success': False,
@@ -603,88 +1448,76 @@ def api_generate_links():
             'message': f'שגיאה ביצירת הקישורים: {str(e)}'
         })
 
-
-        df = pd.DataFrame(data)
-        
-        # יצירת קובץ זמני
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp:
-            df.to_excel(tmp.name, index=False, engine='openpyxl')
-            tmp_path = tmp.name
-        
-        return send_file(
-            tmp_path,
-            as_attachment=True,
-            download_name=f'wedding_guests_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx',
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-        
-    except Exception as e:
-        flash(f'שגיאה בייצוא: {str(e)}', 'error')
-        return redirect(url_for('admin'))
-
+# ====== ייצוא Excel / CSV / Parquet (export_pipeline.py, export_formats.py, xlsx_stream.py) ======
+XLSX_MIMETYPE = export_formats.FORMATS['xlsx'][0]
+EXPORT_BATCH_SIZE = 1000  # אורחים לכל שאילתה בייצוא
+
+def iter_guest_batches(fields, batch_size=EXPORT_BATCH_SIZE):
+    """רשימת שורות (עמודות fields, ואחריהן id) לכל batch של אורחים לפי סדר ה-id - keyset (id > האחרון).
+    כל batch הוא שאילתה קצרה שנקראת עד הסוף - הורדה איטית לא מחזיקה נעילת קריאה על המסד."""
+    columns = [getattr(Guest, f) for f in fields] + [Guest.id]
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            db.select(*columns).where(Guest.id > last_id).order_by(Guest.id).limit(batch_size)).all()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][-1]
+
+def xlsx_response(rows, download_name):
+    """קובץ xlsx שנבנה תוך כדי שליחה - בלי קובץ זמני ובלי להחזיק את כל הקובץ בזיכרון"""
+    response = Response(stream_with_context(xlsx_stream.iter_xlsx(rows)), mimetype=XLSX_MIMETYPE)
+    response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+def export_context():
+    return export_pipeline.ExportContext(os.getenv('WEBSITE_URL', DEFAULT_WEBSITE_URL), invitation_message_template())
+
+def export_rows(export):
+    """שורות הייצוא: רק העמודות שהייצוא צריך, batch אחרי batch, כל עמודה מחושבת ל-batch שלם (export_pipeline.py)"""
+    return export_pipeline.project(export, iter_guest_batches(export.fields), export_context())
+
+def export_cache_key(name, fmt, data_version):
+    """מפתח המטמון: גרסת הנתונים ועוד מה שנכנס לשורות - העמודות, הקישורים ונוסח ההזמנה"""
+    export = EXPORTS[name]
+    return export_key(name, fmt, data_version, export.title, *export.headers,
+                      os.getenv('WEBSITE_URL', DEFAULT_WEBSITE_URL), DEFAULT_WEBSITE_URL, COUPLE_NAMES, WEDDING_DATE)
+
+def export_download_name(export, fmt):
+    return f'{export.prefix}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{export_formats.FORMATS[fmt][1]}'
+
+def send_export(name, fmt=None):
+    """ייצוא ישיר: הקובץ נבנה מ-batches של אורחים תוך כדי ההורדה; לרשימות גדולות - משימת רקע
+    דרך /api/exports/<name>. fmt (או ?format=) - xlsx (ברירת מחדל), csv או parquet.
+    פורמט לא מוכר / parquet בלי pyarrow נזרקים כאן, לפני שנשלח משהו.
+    אם הנתונים לא השתנו מאז הייצוא הקודם - הקובץ נשלח מ-export_cache בלי לגשת לאורחים"""
+    export = EXPORTS[name]
+    fmt = fmt or request.args.get('format', export_formats.DEFAULT_FORMAT)
+    export_formats.check_available(fmt)
+    mimetype = export_formats.FORMATS[fmt][0]
+    download_name = export_download_name(export, fmt)
+    version = get_data_version()
+    key = export_cache_key(name, fmt, version)
+    cached = export_cache.open(key)
+    if cached is not None:
+        response = send_file(cached, mimetype=mimetype, as_attachment=True, download_name=download_name)
+        response.headers['X-Export-Cache'] = 'hit'
+    else:
+        chunks = export_formats.iter_export(fmt, export.headers, export_rows(export), export.title, export.int_columns)
+        # נשמר למטמון רק אם אף כתיבה לא נכנסה בזמן שה-batches נקראו
+        chunks = export_cache.tee(key, chunks, still_valid=lambda: get_data_version() == version)
+        response = Response(stream_with_context(chunks), mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+        response.headers['X-Export-Cache'] = 'miss'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
 
 @app.route('/export_for_bot')
 def export_for_bot():
-    """Export guests into a bot-friendly Excel file containing:
-    - name
-    - phone_e164_no_plus (e.g. 972501234567 without leading +)
-    - link (personal RSVP link)
-    - personal_message (invitation text the bot can send)
-    """
     try:
-        guests = Guest.query.all()
-        website_url = os.getenv('WEBSITE_URL', DEFAULT_WEBSITE_URL)
-
-        rows = []
-        for g in guests:
-            token = getattr(g, 'unique_token', None)
-            link = f"{website_url.rstrip('/')}/rsvp/{token}" if token else website_url
-            # Try to use existing message builder; fallback to a simple template
-            try:
-                message = build_invitation_message(g)
-            except Exception:
-                message = f"שלום {g.name}!\nנשמח לאישור הגעה כאן: {link}"
-
-            # normalize phone to E.164 without leading + (e.g. 97250...)
-            raw_phone = (g.phone or '')
-            digits = ''.join(ch for ch in raw_phone if ch.isdigit())
-            if digits.startswith('0') and len(digits) >= 10:
-                # convert local 0-leading Israeli numbers to 972...
-                digits = '972' + digits[1:]
-            elif raw_phone.startswith('+') and digits.startswith(''):
-                digits = digits.lstrip('+')
-
-            # determine RSVP status
-            if g.attendance_status:
-                status = g.attendance_status
-            elif g.is_attending is True:
-                status = 'יגיע'
-            elif g.is_attending is False:
-                status = 'לא יגיע'
-            else:
-                status = 'ממתין'
-
-            rows.append({
-                'guest_id': g.id,
-                'name': g.name,
-                'phone_e164_no_plus': digits,
-                'link': link,
-                'personal_message': message,
-                'status': status,
-            })
-
-        df = pd.DataFrame(rows)
-
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp:
-            df.to_excel(tmp.name, index=False, engine='openpyxl')
-            tmp_path = tmp.name
-
-        return send_file(
-            tmp_path,
-            as_attachment=True,
-            download_name=f'wedding_bot_upload_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx',
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
+        return send_export('bot')
     except Exception as e:
         flash(f'שגיאה ביצירת קובץ לבוט: {str(e)}', 'error')
         return redirect(url_for('admin'))
@@ -692,126 +1525,299 @@ def export_for_bot():
 
 @app.route('/export_for_bot_simple')
 def export_for_bot_simple():
-    """Export simplified Excel for the bot with only name and personal_message (contains RSVP link).
-    Useful if the bot UI only needs a two-column file (name + message) for bulk sending.
-    """
     try:
-        guests = Guest.query.all()
-        website_url = os.getenv('WEBSITE_URL', DEFAULT_WEBSITE_URL)
-
-        rows = []
-        for g in guests:
-            token = getattr(g, 'unique_token', None)
-            link = f"{website_url.rstrip('/')}/rsvp/{token}" if token else website_url
-            try:
-                message = build_invitation_message(g)
-            except Exception:
-                message = f"שלום {g.name}!\nנשמח לאישור הגעה כאן: {link}"
-
-            # include raw phone as stored (so the bot can use it).
-            # include guest id and phone for reliable matching on upload
-            if g.attendance_status:
-                status = g.attendance_status
-            elif g.is_attending is True:
-                status = 'יגיע'
-            elif g.is_attending is False:
-                status = 'לא יגיע'
-            else:
-                status = 'ממתין'
-
-            rows.append({
-                'guest_id': g.id,
-                'name': g.name,
-                'phone': g.phone or '',
-                'personal_message': message,
-                'status': status,
-            })
-        df = pd.DataFrame(rows)
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp:
-            df.to_excel(tmp.name, index=False, engine='openpyxl')
-            tmp_path = tmp.name
-
-        return send_file(
-            tmp_path,
-            as_attachment=True,
-            download_name=f'wedding_bot_simple_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx',
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
+        return send_export('bot_simple')
     except Exception as e:
         flash(f'שגיאה ביצירת קובץ לבוט: {str(e)}', 'error')
         return redirect(url_for('admin'))
 
 
+# תוצאה לכל שורה בקובץ התוצאות של הבוט
+BOT_RESULT_MARKED = 'marked_sent'
+BOT_RESULT_ALREADY_SENT = 'already_sent'
+BOT_RESULT_CONFIRMED = 'skipped_confirmed'
+BOT_RESULT_NOT_FOUND = 'not_found'
+_BOT_RESULT_COLUMNS = (Guest.id, Guest.phone_e164, Guest.message_sent, Guest.is_attending)
+
+def _fetch_in_chunks(column, values):
+    """{ערך: שורה} ל-_BOT_RESULT_COLUMNS - שאילתת IN אחת לכל IMPORT_LOOKUP_CHUNK ערכים"""
+    values = [v for v in dict.fromkeys(values) if v is not None]
+    found = {}
+    for i in range(0, len(values), IMPORT_LOOKUP_CHUNK):
+        query = db.select(*_BOT_RESULT_COLUMNS).where(column.in_(values[i:i + IMPORT_LOOKUP_CHUNK]))
+        for row in db.session.execute(query):
+            found[getattr(row, column.key)] = row
+    return found
+
+def mark_guests_sent(guest_ids):
+    """message_sent=True (ושחרור ההשכרה של הבוט) ורשומת MessageLog 'sent' לכל אורח: UPDATE אחד
+    ו-INSERT אחד (executemany של Core), בלי commit. Core עוקף את ה-hooks של ה-session - גרסת הנתונים והמונים מתעדכנים כאן."""
+    if not guest_ids:
+        return
+    table = Guest.__table__
+    db.session.execute(table.update().where(table.c.id == db.bindparam('guest_id'))
+                       .values(message_sent=True, bot_lease_owner=None, bot_lease_until=None),
+                       [{'guest_id': guest_id} for guest_id in guest_ids])
+    db.session.execute(MessageLog.__table__.insert(),
+                       [{'guest_id': guest_id, 'status': 'sent'} for guest_id in guest_ids])
+    bump_data_version(db.session)
+    if app.config['GUEST_STATS_COUNTERS']:
+        rebuild_guest_stats_counters(db.session)
+
+def reconcile_bot_results(df):
+    """מתאים כל שורה בקובץ התוצאות לאורח - לפי guest_id, ואם אין (או שלא נמצא) לפי הטלפון
+    (phone / phone_e164_no_plus, השוואה על phone_e164) - בשתי שאילתות IN מרוכזות, ומסמן את
+    כולם בבת אחת (mark_guests_sent). מחזיר (counts, report) - report: {row, guest_id, result}
+    לכל שורה בקובץ, לפי הסדר."""
+    ids = [None] * len(df)
+    if 'guest_id' in df.columns:
+        numeric = pd.to_numeric(df['guest_id'], errors='coerce').tolist()
+        ids = [int(v) if v == v and float(v).is_integer() else None for v in numeric]
+    by_id = _fetch_in_chunks(Guest.id, ids)
+
+    keys = [None] * len(df)
+    for col in ('phone', 'phone_e164_no_plus'):
+        if col in df.columns:
+            keys = [key or (phones.to_e164(value) if guest_id not in by_id else None)
+                    for key, guest_id, value in zip(keys, ids, df[col].tolist())]
+    by_key = _fetch_in_chunks(Guest.phone_e164, keys)
+
+    report, to_mark = [], []
+    counts = dict.fromkeys((BOT_RESULT_MARKED, BOT_RESULT_ALREADY_SENT, BOT_RESULT_CONFIRMED, BOT_RESULT_NOT_FOUND), 0)
+    marked = set()
+    for row, guest_id, key in zip(df.index + 2, ids, keys):
+        guest = by_id.get(guest_id) or by_key.get(key)
+        if guest is None:
+            result = BOT_RESULT_NOT_FOUND
+        elif guest.is_attending:
+            result = BOT_RESULT_CONFIRMED
+        elif guest.message_sent or guest.id in marked:
+            result = BOT_RESULT_ALREADY_SENT
+        else:
+            result = BOT_RESULT_MARKED
+            marked.add(guest.id)
+            to_mark.append(guest.id)
+        counts[result] += 1
+        report.append({'row': int(row), 'guest_id': guest.id if guest else None, 'result': result})
+    mark_guests_sent(to_mark)
+    return counts, report
+
 @app.route('/upload_bot_results', methods=['POST'])
 def upload_bot_results():
     """Accept an Excel/CSV file exported back from the local bot run.
-    Expected columns: guest_id (preferred) or phone, and optionally status or sent flag.
+    Expected columns: guest_id (preferred) or phone / phone_e164_no_plus.
     The endpoint will:
-      - mark guests as message_sent when present in file
-      - create MessageLog entries for sent or failed rows
+      - mark guests as message_sent when present in file (one bulk UPDATE)
+      - create a MessageLog 'sent' entry for every guest it marks
       - skip guests who already confirmed attendance (is_attending True)
+    With ?format=json (or Accept: application/json) it returns the per-row
+    reconciliation report instead of redirecting to the admin page.
     """
-    if 'file' not in request.files:
-        flash('לא נבחר קובץ להתעדכון', 'error')
+    wants_json = request.args.get('format') == 'json' or request.accept_mimetypes.best == 'application/json'
+
+    def fail(message):
+        if wants_json:
+            return jsonify({'success': False, 'message': message}), 400
+        flash(message, 'error')
         return redirect(url_for('admin'))
+
+    if 'file' not in request.files:
+        return fail('לא נבחר קובץ להתעדכון')
     file = request.files['file']
     if file.filename == '':
-        flash('לא נבחר קובץ', 'error')
-        return redirect(url_for('admin'))
+        return fail('לא נבחר קובץ')
 
     try:
         if file.filename.lower().endswith('.csv'):
-            df = pd.read_csv(file, encoding='utf-8-sig')
+            df = pd.read_csv(file, encoding='utf-8-sig', dtype=str)
         else:
-            df = pd.read_excel(file, engine='openpyxl')
+            df = pd.read_excel(file, engine='openpyxl', dtype=str)
     except Exception as e:
-        flash(f'שגיאה בקריאת הקובץ: {e}', 'error')
-        return redirect(url_for('admin'))
+        return fail(f'שגיאה בקריאת הקובץ: {e}')
 
-    # normalize columns to lower
-    cols = [str(c).strip() for c in df.columns]
-    df.columns = cols
-
-    updated = 0
-    skipped_confirmed = 0
-    for idx, row in df.iterrows():
-        gid = None
-        if 'guest_id' in df.columns:
-            try:
-                gid = int(row.get('guest_id'))
-            except Exception:
-                gid = None
-        if not gid and 'phone' in df.columns:
-            phone = str(row.get('phone') or '').strip()
-            g = Guest.query.filter_by(phone=phone).first()
-            gid = g.id if g else None
-        if not gid and 'phone_e164_no_plus' in df.columns:
-            phone = str(row.get('phone_e164_no_plus') or '').strip()
-            # try matching by normalized form
-            g = Guest.query.filter(Guest.phone.like(f"%{phone[-9:]}%" )).first()
-            gid = g.id if g else None
-
-        if not gid:
-            continue
-        guest = Guest.query.get(gid)
-        if not guest:
-            continue
-
-        # skip if already confirmed
-        if guest.is_attending:
-            skipped_confirmed += 1
-            continue
-
-        # mark message_sent and log
-        if not guest.message_sent:
-            guest.message_sent = True
-            db.session.add(MessageLog(guest_id=guest.id, status='sent'))
-            updated += 1
+    df.columns = [str(c).strip() for c in df.columns]
 
-    db.session.commit()
-    flash(f'עודכנו {updated} אורחים. דילוג על {skipped_confirmed} שאישרו הגעה.', 'success')
+    try:
+        counts, report = reconcile_bot_results(df)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return fail(f'שגיאה בעדכון תוצאות הבוט: {e}')
+
+    if wants_json:
+        return jsonify({'success': True, 'counts': counts, 'rows': report})
+    message = (f'עודכנו {counts[BOT_RESULT_MARKED]} אורחים. '
+               f'דילוג על {counts[BOT_RESULT_CONFIRMED]} שאישרו הגעה.')
+    missing = [r['row'] for r in report if r['result'] == BOT_RESULT_NOT_FOUND]
+    if missing:
+        shown = ', '.join(str(row) for row in missing[:10]) + (' ...' if len(missing) > 10 else '')
+        message += f' {len(missing)} שורות לא זוהו (שורות {shown}).'
+    flash(message, 'warning' if missing else 'success')
     return redirect(url_for('admin'))
 
+# ====== ייבוא אורחים (guest_import.py) ======
+IMPORT_LOOKUP_CHUNK = 500  # טלפונים לכל שאילתת IN (מגבלת המשתנים של SQLite)
+# קובץ גדול מזה (או mode=stream בטופס) מיובא בחלקים של IMPORT_CHUNK_SIZE שורות, commit לכל חלק
+IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', guest_import.DEFAULT_CHUNK_SIZE))
+IMPORT_STREAM_THRESHOLD = int(os.getenv('IMPORT_STREAM_THRESHOLD', 2 * 1024 * 1024))
+IMPORT_MAX_ERRORS = 1000  # הודעות שגיאה שנשמרות בייבוא בחלקים (הספירה נשמרת במלואה)
+
+def find_existing_phones(keys):
+    """אילו מהטלפונים (phone_e164) כבר קיימים - שאילתת IN אחת לכל IMPORT_LOOKUP_CHUNK טלפונים"""
+    keys = list(dict.fromkeys(keys))
+    existing = set()
+    for i in range(0, len(keys), IMPORT_LOOKUP_CHUNK):
+        chunk = keys[i:i + IMPORT_LOOKUP_CHUNK]
+        existing.update(db.session.scalars(db.select(Guest.phone_e164).where(Guest.phone_e164.in_(chunk))))
+    return existing
+
+def insert_guest_rows(values):
+    """INSERT מרובה של אורחים (dicts עם IMPORT_FIELDS) כולל הנפקת טוקנים חתומים, בלי commit.
+    מחזיר את מספר האורחים שנוספו."""
+    now = get_local_time()
+    # טוקן זמני עם קידומת משותפת לכל הייבוא - כך מוצאים את ה-ids החדשים בסריקת טווח על
+    # האינדקס של unique_token, בלי RETURNING (שמאט את ה-INSERT המרובה פי 1.5)
+    prefix = f'import-{uuid.uuid4().hex[:16]}-'
+    for i, v in enumerate(values):
+        v['unique_token'] = f'{prefix}{i:x}'
+        v['created_at'] = v['updated_at'] = now
+    # render_nulls: בלי זה שורות עם None בעמודות שונות מתפצלות לאלפי batches קטנים
+    db.session.execute(db.insert(Guest), values, execution_options={'render_nulls': True})
+    ids = db.session.scalars(db.select(Guest.id).where(
+        Guest.unique_token >= prefix, Guest.unique_token < prefix + '~'
+    )).all()
+    secret = app.config['SECRET_KEY']
+    # UPDATE של Core ב-executemany אחד: UPDATE לפי מפתח ראשי של ה-ORM רץ ב-SQLite שורה-שורה
+    # (בדיקת rowcount). הטוקן אינו שדה מחופש והגרסה כבר עלתה ב-INSERT - אין צורך ב-hooks
+    table = Guest.__table__
+    if ids:
+        db.session.execute(
+            table.update().where(table.c.id == db.bindparam('guest_id')).values(unique_token=db.bindparam('token')),
+            [{'guest_id': guest_id, 'token': make_guest_token(guest_id, secret)} for guest_id in ids],
+        )
+    return len(ids)
+
+def import_guest_frame(df):
+    """ייבוא DataFrame של אורחים: נרמול וקטורי, בדיקת כפילויות מרוכזת ו-INSERT אחד.
+    מחזיר ImportResult(imported, errors) - שגיאה לכל שורה שלא יובאה, לפי סדר השורות."""
+    rows, errors = guest_import.prepare_rows(df)
+    existing = find_existing_phones(rows['phone_e164'])
+    if existing:
+        dup = rows['phone_e164'].isin(existing)
+        for row, name, phone in zip(rows.index[dup], rows.loc[dup, 'name'], rows.loc[dup, 'phone']):
+            errors[row] = f'שורה {row}: האורח {name} ({phone}) כבר קיים במערכת'
+        rows = rows[~dup]
+
+    imported = insert_guest_rows(guest_import.records(rows)) if len(rows) else 0
+    db.session.commit()
+    return guest_import.ImportResult(imported, [errors[row] for row in sorted(errors)], len(errors))
+
+def import_guest_chunks(chunks, progress=None):
+    """ייבוא בחלקים: commit אחרי כל chunk, כך שהזיכרון תחום בגודל ה-chunk וכשל באמצע
+    לא מבטל את מה שכבר יובא. הכשל עצמו מדווח כשגיאה עם השורה שממנה להמשיך.
+    progress(rows_done) נקרא אחרי ה-commit של כל chunk (משימת רקע - עדכון התקדמות וביטול)."""
+    imported, errors, error_count, next_row = 0, [], 0, 2
+    try:
+        for chunk in chunks:
+            next_row = int(chunk.index[0]) + 2
+            result = import_guest_frame(chunk)
+            imported += result.imported
+            error_count += result.error_count
+            errors.extend(result.errors[:IMPORT_MAX_ERRORS - len(errors)])
+            if progress:
+                progress(int(chunk.index[-1]) + 1)
+    except jobs.JobCancelled:
+        raise
+    except Exception as e:
+        db.session.rollback()
+        errors.insert(0, f'הייבוא נעצר בשורה {next_row} (השורות שלפניה נשמרו): {str(e)}')
+        error_count += 1
+    return guest_import.ImportResult(imported, errors, error_count)
+
+_SYNC_KEY_COLUMNS = [Guest.id, Guest.phone_e164, Guest.phone, Guest.name, Guest.import_hash]
+_SYNC_DETAIL_COLUMNS = [Guest.id, Guest.response_date] + [getattr(Guest, f) for f in guest_import.IMPORT_FIELDS]
+
+def load_sync_state(keys):
+    """{phone_e164: id, phone, name, import_hash} לאורחים מסנכרון קודם ולאורחים שהטלפון שלהם
+    בקובץ. שאר העמודות נטענות רק לשורות שהשתנו (load_sync_details)."""
+    current = {}
+    def add(query):
+        # phone_e164 ייחודי - אורח אחד לכל מפתח; אורח בלי מפתח (כפול מלפני המיגרציה) לא מסונכרן
+        for guest_id, key, phone, name, import_hash in db.session.execute(query):
+            if key is not None:
+                current[key] = {'id': guest_id, 'phone': phone, 'name': name, 'import_hash': import_hash}
+    # import_hash > '' ולא IS NOT NULL: SQLite משתמש באינדקס רק לתנאי טווח (ה-hash הוא hex לא ריק)
+    add(db.select(*_SYNC_KEY_COLUMNS).where(Guest.import_hash > ''))
+    keys = [k for k in dict.fromkeys(keys) if k not in current]
+    for i in range(0, len(keys), IMPORT_LOOKUP_CHUNK):
+        add(db.select(*_SYNC_KEY_COLUMNS).where(Guest.phone_e164.in_(keys[i:i + IMPORT_LOOKUP_CHUNK])))
+    return current
+
+def load_sync_details(current, keys):
+    ids = {current[k]['id']: current[k] for k in keys}
+    keys = list(ids)
+    for i in range(0, len(keys), IMPORT_LOOKUP_CHUNK):
+        query = db.select(*_SYNC_DETAIL_COLUMNS).where(Guest.id.in_(keys[i:i + IMPORT_LOOKUP_CHUNK]))
+        for row in db.session.execute(query).mappings():
+            ids[row['id']].update(row)
+
+def apply_guest_sync(plan):
+    """מחיל את התוכנית בטרנזקציה אחת. UPDATE ו-DELETE עוברים ב-Core (executemany אחד) ולכן
+    האינדקס, המונים וגרסת הנתונים מתעדכנים כאן במפורש - רק לאורחים שהשתנו."""
+    table = Guest.__table__
+    session = db.session
+    if plan.inserts:
+        insert_guest_rows([dict(r) for r in plan.inserts])  # ה-INSERT של ה-ORM מפעיל את ה-hooks בעצמו
+    # executemany אחד לכל קבוצת עמודות (אורח שכבר ענה באתר לא מקבל את RSVP_FIELDS)
+    groups = {}
+    for u in plan.updates:
+        groups.setdefault(tuple(u['values']), []).append({'guest_id': u['id'], **u['values']})
+    for keys, params in groups.items():
+        session.execute(table.update().where(table.c.id == db.bindparam('guest_id'))
+                        .values({k: db.bindparam(k) for k in keys}), params)
+    delete_ids = [d['id'] for d in plan.deletes]
+    conn = session.connection()
+    for i in range(0, len(delete_ids), IMPORT_LOOKUP_CHUNK):
+        chunk = delete_ids[i:i + IMPORT_LOOKUP_CHUNK]
+        session.execute(MessageLog.__table__.delete().where(MessageLog.__table__.c.guest_id.in_(chunk)))
+        session.execute(table.delete().where(table.c.id.in_(chunk)))
+        guest_search.remove_guests(conn, chunk)
+    searched = [u['id'] for u in plan.updates if set(u['changed']) & set(guest_search.SEARCH_ATTRS)]
+    for i in range(0, len(searched), IMPORT_LOOKUP_CHUNK):
+        rows = session.execute(db.select(*_SEARCH_COLUMNS).where(
+            Guest.id.in_(searched[i:i + IMPORT_LOOKUP_CHUNK]))).all()
+        guest_search.index_guests(conn, rows)
+    if plan.updates or delete_ids:
+        bump_data_version(session)
+        if app.config['GUEST_STATS_COUNTERS']:
+            rebuild_guest_stats_counters(session)
+
+def sync_guest_frame(df, dry_run=False):
+    """סנכרון (upsert) מגיליון ראשי: רק השורות שה-hash שלהן השתנה נכתבות, בטרנזקציה אחת.
+    dry_run - מחשב ומחזיר את ההבדלים בלי לכתוב. מחזיר (ImportResult, counts, preview)."""
+    rows, errors = guest_import.prepare_rows(df)
+    hashes = guest_import.row_hashes(rows)
+    current = load_sync_state(rows['phone_e164'])
+    load_sync_details(current, guest_import.changed_phones(rows, hashes, current))
+    plan = guest_import.plan_sync(rows, hashes, current, guest_import.file_phones(df))
+    if not len(rows) and plan.deletes:
+        # קובץ בלי אף שורה תקינה (קובץ שגוי?) לא מוחק את כל הרשימה
+        plan = plan._replace(deletes=[])
+        errors[0] = 'אין בקובץ אף שורה תקינה - אורחים לא נמחקו'
+    counts = {'inserted': len(plan.inserts), 'updated': len(plan.changed_updates),
+              'deleted': len(plan.deletes), 'unchanged': plan.unchanged,
+              # אורחים קיימים שזהים לשורה בגיליון ורק מסומנים כמסונכרנים (import_hash)
+              'linked': len(plan.updates) - len(plan.changed_updates)}
+    if not dry_run:
+        try:
+            apply_guest_sync(plan)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    result = guest_import.ImportResult(len(plan.inserts), [errors[row] for row in sorted(errors)], len(errors))
+    return result, counts, guest_import.sync_preview(plan, current)
+
 @app.route('/import_guests', methods=['POST'])
 def import_guests():
     """ייבוא אורחים מקובץ Excel/CSV"""
@@ -829,177 +1835,24 @@ def import_guests():
             flash('סוג קובץ לא נתמך. אנא העלה קובץ Excel או CSV', 'error')
             return redirect(url_for('admin'))
         
-        # קריאת הקובץ
-        try:
-            # ננסה לזהות אם השורה הראשונה אינה שמות עמודות (כמו "קובץ רשימות מוזמנים...")
-            if file.filename.lower().endswith('.csv'):
-                df_preview = pd.read_csv(file, encoding='utf-8-sig', nrows=2, header=None)
-                file.seek(0)
-                if 'שם המוזמן' not in df_preview.iloc[0].astype(str).tolist() and 'שם המוזמן' in df_preview.iloc[1].astype(str).tolist():
-                    df = pd.read_csv(file, encoding='utf-8-sig', header=1)
-                else:
-                    df = pd.read_csv(file, encoding='utf-8-sig')
-            else:
-                df_preview = pd.read_excel(file, engine='openpyxl', nrows=2, header=None)
-                file.seek(0)
-                if 'שם המוזמן' not in df_preview.iloc[0].astype(str).tolist() and 'שם המוזמן' in df_preview.iloc[1].astype(str).tolist():
-                    df = pd.read_excel(file, engine='openpyxl', header=1)
-                else:
-                    df = pd.read_excel(file, engine='openpyxl')
-        except Exception as e:
-            flash(f'שגיאה בקריאת הקובץ: {str(e)}', 'error')
-            return redirect(url_for('admin'))
-        
-        print(f"עמודות בקובץ: {list(df.columns)}")  # לדיבוג
-        print(f"מספר שורות: {len(df)}")  # לדיבוג
-        
-        # ניקוי שמות עמודות - הסרת רווחים מיותרים ותווים מיוחדים
-        df.columns = [str(col).strip().replace('\n', ' ').replace('\r', '') for col in df.columns]
-        
-        # מיפוי עמודות גמיש יותר
-        column_mapping = {}
-        for col in df.columns:
-            col_clean = str(col).strip()
-            col_lower = col_clean.lower()
-            
-            # חיפוש מדויק יותר
-            if col_clean == 'שם המוזמן' or 'שם' in col_lower:
-                column_mapping[col] = 'name'
-            elif col_clean == 'נייד' or 'נייד' in col_lower or 'טלפון' in col_lower:
-                column_mapping[col] = 'phone'
-            elif col_clean == 'כמה יגיעו' or ('כמה' in col_lower and 'יגיעו' in col_lower):
-                column_mapping[col] = 'invited_count'
-            elif col_clean == 'שיוך לקבוצה' or 'קבוצה' in col_lower:
-                column_mapping[col] = 'group_affiliation'
-            elif col_clean == 'מהצד של...' or ('צד' in col_lower and 'של' in col_lower):
-                column_mapping[col] = 'side'
-            elif 'סטטוס הגעה' in col_clean or ('סטטוס' in col_lower and 'הגעה' in col_lower):
-                column_mapping[col] = 'attendance_status'
-            elif col_clean == 'סכום מתנה משוער' or ('מתנה' in col_lower and ('משוער' in col_lower or 'סכום' in col_lower)):
-                column_mapping[col] = 'estimated_gift_amount'
-            elif 'האם נשלחה הזמנה' in col_clean or ('הזמנה' in col_lower and 'נשלחה' in col_lower):
-                column_mapping[col] = 'message_sent_text'
-            elif col_clean == 'mail' or 'mail' in col_lower or 'מייל' in col_lower:
-                column_mapping[col] = 'email'
-            elif col_clean == 'הערות (מלל חופשי)' or 'הערות' in col_lower:
-                column_mapping[col] = 'notes'
-            elif 'מספר הטלפון של המשתמש' in col_clean or ('מספר' in col_lower and 'הכניס' in col_lower):
-                column_mapping[col] = 'added_by'
-        
-        print(f"מיפוי עמודות: {column_mapping}")  # לדיבוג
-        
-        success_count = 0
-        error_count = 0
-        errors = []
-        
-        for index, row in df.iterrows():
-            try:
-                # פונקציה לקבלת ערך מהשורה
-                def get_value(mapping_key):
-                    for col, mapped in column_mapping.items():
-                        if mapped == mapping_key:
-                            value = row.get(col)
-                            if pd.notna(value) and str(value).strip() not in ['', 'nan', 'NaN', 'null', 'None']:
-                                return str(value).strip()
-                    return None
-                
-                # קבלת נתונים בסיסיים
-                name = get_value('name')
-                phone = get_value('phone')
-                # תיקון: הוספת 0 אם חסר במספר סלולרי ישראלי
-                if phone and phone.isdigit() and len(phone) == 10 and not phone.startswith('0') and phone.startswith('5'):
-                    phone = '0' + phone
-                
-                if not name:
-                    errors.append(f'שורה {index + 2}: חסר שם אורח')
-                    error_count += 1
-                    continue
-                
-                if not phone:
-                    errors.append(f'שורה {index + 2}: חסר מספר טלפון עבור {name}')
-                    error_count += 1
-                    continue
-                
-                # בדיקה אם האורח כבר קיים
-                existing_guest = Guest.query.filter_by(phone=phone).first()
-                if existing_guest:
-                    errors.append(f'שורה {index + 2}: האורח {name} ({phone}) כבר קיים במערכת')
-                    error_count += 1
-                    continue
-                
-                # יצירת אורח חדש
-                guest = Guest(
-                    name=name,
-                    phone=phone,
-                    unique_token=str(uuid.uuid4())
-                )
-                
-                # מילוי שדות נוספים
-                guest.email = get_value('email')
-                guest.group_affiliation = get_value('group_affiliation')
-                guest.side = get_value('side')
-                guest.notes = get_value('notes')
-                guest.added_by = get_value('added_by')
-                guest.attendance_status = get_value('attendance_status') or 'ממתין'
-                
-                # טיפול במספר מוזמנים
-                invited_count_str = get_value('invited_count')
-                try:
-                    guest.invited_count = int(float(invited_count_str)) if invited_count_str else 1
-                except (ValueError, TypeError):
-                    guest.invited_count = 1
-                
-                # טיפול בסכום מתנה
-                gift_amount_str = get_value('estimated_gift_amount')
-                try:
-                    guest.estimated_gift_amount = float(gift_amount_str) if gift_amount_str else 0.0
-                except (ValueError, TypeError):
-                    guest.estimated_gift_amount = 0.0
-                
-                # טיפול בסטטוס שליחת הזמנה
-                message_sent_str = get_value('message_sent_text')
-                if message_sent_str:
-                    guest.message_sent = message_sent_str.lower() in ['נשלחה', 'true', '1', 'yes', 'כן']
-                else:
-                    guest.message_sent = False
-                
-                # עדכון is_attending לפי attendance_status
-                if guest.attendance_status == 'יגיע':
-                    guest.is_attending = True
-                elif guest.attendance_status == 'לא יגיע':
-                    guest.is_attending = False
-                else:
-                    guest.is_attending = None
-                
-                db.session.add(guest)
-                success_count += 1
-                
-            except Exception as e:
-                errors.append(f'שורה {index + 2}: {str(e)}')
-                error_count += 1
-        
-        # שמירה במסד הנתונים
-        db.session.commit()
-        
-        # הודעת סיכום
-        message = f'יובאו בהצלחה {success_count} אורחים'
-        if error_count > 0:
-            message += f', {error_count} שגיאות'
-            if len(errors) <= 5:  # מציג עד 5 שגיאות ראשונות
-                message += f': {"; ".join(errors[:5])}'
-            elif len(errors) > 5:
-                message += f'. דוגמאות: {"; ".join(errors[:3])}...'
-        
-        flash(message, 'success' if error_count == 0 else 'warning')
-        
-        # הדפסה למסוף לדיבוג
-        print(f"סיכום ייבוא: {success_count} הצליחו, {error_count} נכשלו")
-        if errors:
-            print("שגיאות:")
-            for error in errors[:10]:  # מדפיס 10 ראשונות
-                print(f"  {error}")
-        
+        mode = request.form.get('mode') or 'append'
+        streaming = mode == 'stream' or (mode == 'append' and (request.content_length or 0) > IMPORT_STREAM_THRESHOLD)
+        # הקובץ נשמר ל-JOB_FILES_DIR והייבוא רץ כמשימת רקע; עמוד הניהול עוקב אחריה
+        upload_name = f'upload_{uuid.uuid4().hex}_{secure_filename(file.filename) or "guests"}'
+        os.makedirs(JOB_FILES_DIR, exist_ok=True)
+        path = os.path.join(JOB_FILES_DIR, upload_name)
+        file.save(path)
+        params = {'path': path, 'filename': file.filename, 'streaming': streaming}
+        if mode == 'sync':
+            # סנכרון מגיליון ראשי: קודם תצוגה מקדימה של ההבדלים (אלא אם dry_run=0)
+            params.update(mode='sync', dry_run=request.form.get('dry_run', '1') != '0')
+        job_id, _ = enqueue_job('import', params)
+        print(f"ייבוא {file.filename} הוכנס לתור (משימה {job_id}, {mode})")  # לדיבוג
+        flash(f'הקובץ התקבל והייבוא רץ ברקע (משימה #{job_id})', 'info')
+        return redirect(url_for('admin', job=job_id))
+
     except Exception as e:
+        db.session.rollback()
         flash(f'שגיאה בייבוא הקובץ: {str(e)}', 'error')
     
     return redirect(url_for('admin'))
@@ -1024,7 +1877,7 @@ def download_template():
                 'מספר הטלפון של המשתמש שהכניס את המוזמן באפליקציה': '0507654321'
             },
             {
-                'שם המוزמן': 'שרה לוי',
+                'שם המוזמן': 'שרה לוי',
                 'נייד': '0507654321',
                 'כמה יגיעו': 1,
                 'שיוך לקבוצה': 'משפחה',
@@ -1038,71 +1891,310 @@ def download_template():
             }
         ]
         
-        df = pd.DataFrame(template_data)
-        
-        # יצירת קובץ זמני
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp:
-            df.to_excel(tmp.name, index=False, engine='openpyxl')
-            tmp_path = tmp.name
-        
-        return send_file(
-            tmp_path,
-            as_attachment=True,
-            download_name='wedding_guests_template.xlsx',
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
+        columns = list(template_data[0])
+        rows = [columns] + [[row.get(c, '') for c in columns] for row in template_data]
+        return xlsx_response(rows, 'wedding_guests_template.xlsx')
         
     except Exception as e:
         flash(f'שגיאה ביצירת התבנית: {str(e)}', 'error')
         return redirect(url_for('admin'))
 
 
+# כל ייצוא הוא רשימת עמודות (export_pipeline.py) - אותו pipeline לכל הקבצים ולכל הפורמטים.
+# ב-Excel של האורחים: כותרת ראשית כמו בדוגמה, ואחריה שורת העמודות (אותו מבנה שהייבוא קורא)
+GUESTS_EXPORT_TITLE = 'קובץ רשימות מוזמנים לחתונה, שנוצר באמצעות אפליקציית מאורסים מאורסות'
+GUESTS_EXPORT = export_pipeline.ExportSpec('wedding_guests', [
+    export_pipeline.field('name', 'שם המוזמן', empty=None),
+    export_pipeline.field('phone', 'נייד', empty=None),
+    export_pipeline.field('invited_count', 'כמה יגיעו', empty=None, integer=True),
+    export_pipeline.field('group_affiliation', 'שיוך לקבוצה'),
+    export_pipeline.field('side', 'מהצד של...'),
+    export_pipeline.status('סטטוס הגעה (יגיע, מתלבט, לא יגיע)'),
+    export_pipeline.gift_amount('סכום מתנה משוער'),
+    export_pipeline.sent_text('האם נשלחה הזמנה? (נשלחה, לא נשלחה)'),
+    export_pipeline.field('email', 'mail'),
+    export_pipeline.field('notes', 'הערות (מלל חופשי)'),
+    export_pipeline.field('added_by', 'מספר הטלפון של המשתמש שהכניס את המוזמן באפליקציה'),
+], GUESTS_EXPORT_TITLE)
+
+# לבוט: מזהה האורח (להתאמה בהעלאת התוצאות), טלפון E.164 בלי '+', קישור אישי והודעת ההזמנה
+BOT_EXPORT = export_pipeline.ExportSpec('wedding_bot_upload', [
+    export_pipeline.field('id', 'guest_id', empty=None, integer=True),
+    export_pipeline.field('name', 'name', empty=None),
+    export_pipeline.phone_e164('phone_e164_no_plus'),
+    export_pipeline.rsvp_link('link'),
+    export_pipeline.invitation_message('personal_message'),
+    export_pipeline.status('status'),
+])
+
+# גרסה פשוטה לבוט: הטלפון כפי שנשמר, וההודעה (שכבר כוללת את הקישור)
+BOT_SIMPLE_EXPORT = export_pipeline.ExportSpec('wedding_bot_simple', [
+    export_pipeline.field('id', 'guest_id', empty=None, integer=True),
+    export_pipeline.field('name', 'name', empty=None),
+    export_pipeline.field('phone', 'phone'),
+    export_pipeline.invitation_message('personal_message'),
+    export_pipeline.status('status'),
+])
+
+EXPORTS = {
+    'guests': GUESTS_EXPORT,
+    'bot': BOT_EXPORT,
+    'bot_simple': BOT_SIMPLE_EXPORT,
+}
+
 @app.route('/export_guests')
 def export_guests():
-    guests = Guest.query.all()
-    # כותרת ראשית כמו בדוגמה
-    header_row = [
-        'קובץ רשימות מוזמנים לחתונה, שנוצר באמצעות אפליקציית מאורסים מאורסות'] * 11
-    columns = [
-        'שם המוזמן', 'נייד', 'כמה יגיעו', 'שיוך לקבוצה', 'מהצד של...',
-        'סטטוס הגעה (יגיע, מתלבט, לא יגיע)', 'סכום מתנה משוער', 'האם נשלחה הזמנה? (נשלחה, לא נשלחה)',
-        'mail', 'הערות (מלל חופשי)', 'מספר הטלפון של המשתמש שהכניס את המוזמן באפליקציה'
-    ]
-    rows = []
-    for g in guests:
-        status = g.attendance_status or ('יגיע' if g.is_attending else 'לא יגיע' if g.is_attending is False else 'ממתין')
-        sent_status = 'נשלחה' if g.message_sent else 'לא נשלחה'
-        rows.append([
-            g.name,
-            g.phone,
-            g.invited_count,
-            g.group_affiliation or '',
-            g.side or '',
-            status,
-            int(g.estimated_gift_amount) if g.estimated_gift_amount else '',
-            sent_status,
-            g.email or '',
-            g.notes or '',
-            g.added_by or ''
-        ])
-    import openpyxl
-    from openpyxl import Workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.append(header_row)
-    ws.append(columns)
-    for row in rows:
-        ws.append(row)
-    # שמירה לקובץ זמני
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp:
-        wb.save(tmp.name)
-        tmp_path = tmp.name
-    return send_file(
-        tmp_path,
-        as_attachment=True,
-        download_name=f'wedding_guests_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx',
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    )
+    try:
+        return send_export('guests')
+    except (ValueError, export_formats.FormatUnavailable) as e:
+        flash(f'שגיאה בייצוא: {str(e)}', 'error')
+        return redirect(url_for('admin'))
+
+# ====== משימות רקע (jobs.py) ======
+# ייבוא, ייצוא והפעלת הבוט רצים ב-worker ולא בבקשת ה-HTTP: הבקשה מכניסה משימה לתור ומחזירה
+# את ה-id שלה, והדפדפן עוקב אחרי /api/jobs/<id>. ה-worker הוא thread בתהליך ה-web
+# (JOB_WORKER_EMBEDDED, ברירת מחדל) או תהליך נפרד: python job_worker.py
+JOB_FILES_DIR = os.getenv('JOB_FILES_DIR', os.path.join(app.instance_path, 'jobs'))
+JOB_FILE_TTL = int(os.getenv('JOB_FILE_TTL', 24 * 3600))  # קבצי ייצוא/העלאה נמחקים אחרי יממה
+app.config['JOB_WORKER_EMBEDDED'] = os.getenv('JOB_WORKER_EMBEDDED', '1').lower() in ('1', 'true', 'yes')
+BOT_JOB_KIND = 'whatsapp_bot'  # הזמנות ותזכורות משתמשות באותו פרופיל Chrome - אחת בכל פעם
+BOT_PROGRESS_RE = re.compile(r'\[(\d+)/(\d+)\]')
+
+def job_file(job_id, name):
+    os.makedirs(JOB_FILES_DIR, exist_ok=True)
+    return os.path.join(JOB_FILES_DIR, f'job{job_id}_{secure_filename(name) or "file"}')
+
+def enqueue_job(kind, params=None):
+    """מכניס משימה לתור, או מחזיר משימה פעילה זהה (אותו סוג ואותם params). מחזיר (job_id, created)"""
+    active = job_queue.active(kind, params or {})
+    if active is not None:
+        return active['id'], False
+    job_id = job_queue.enqueue(kind, params)
+    if app.config['JOB_WORKER_EMBEDDED']:
+        job_worker.ensure_running()
+        job_worker.wake()
+    return job_id, True
+
+def run_import_job(ctx, params):
+    path = params['path']
+    if params.get('mode') == 'sync':
+        return run_sync_job(ctx, params)
+    try:
+        with open(path, 'rb') as f:
+            if params.get('streaming'):
+                def progress(rows_done):
+                    ctx.progress(rows_done, message=f'נקראו {rows_done} שורות', force=True)
+                chunks = guest_import.iter_guest_chunks(f, params['filename'], IMPORT_CHUNK_SIZE)
+                result = import_guest_chunks(chunks, progress=progress)
+            else:
+                df = guest_import.read_guest_file(f, params['filename'])
+                ctx.progress(0, len(df), message=f'מייבא {len(df)} שורות', force=True)
+                result = import_guest_frame(df)
+    finally:
+        os.remove(path)
+    success_count, errors, error_count = result
+
+    # הודעת סיכום
+    message = f'יובאו בהצלחה {success_count} אורחים'
+    if error_count > 0:
+        message += f', {error_count} שגיאות'
+        if error_count <= 5:  # מציג עד 5 שגיאות ראשונות
+            message += f': {"; ".join(errors[:5])}'
+        else:
+            message += f'. דוגמאות: {"; ".join(errors[:3])}...'
+
+    # הדפסה למסוף לדיבוג
+    print(f"סיכום ייבוא: {success_count} הצליחו, {error_count} נכשלו")
+    for error in errors[:10]:  # מדפיס 10 ראשונות
+        print(f"  {error}")
+    return {'imported': success_count, 'error_count': error_count, 'errors': errors[:20], 'summary': message}
+
+def run_sync_job(ctx, params):
+    """סנכרון מגיליון ראשי. ב-dry run הקובץ נשמר, כדי שאפשר יהיה להחיל את אותה תוכנית אחרי התצוגה המקדימה"""
+    dry_run = bool(params.get('dry_run'))
+    try:
+        with open(params['path'], 'rb') as f:
+            df = guest_import.read_guest_file(f, params['filename'])
+        ctx.progress(0, len(df), message=f'משווה {len(df)} שורות', force=True)
+        result, counts, preview = sync_guest_frame(df, dry_run=dry_run)
+    finally:
+        if not dry_run:
+            os.remove(params['path'])
+    message = (f"{'תצוגה מקדימה: ' if dry_run else ''}{counts['inserted']} חדשים, {counts['updated']} עודכנו,"
+               f" {counts['deleted']} נמחקו, {counts['unchanged']} ללא שינוי")
+    if result.error_count:
+        message += f', {result.error_count} שגיאות: {"; ".join(result.errors[:3])}'
+    ctx.progress(len(df), len(df), force=True)
+    print(f"סנכרון אורחים{' (dry run)' if dry_run else ''}: {counts}")
+    return {'mode': 'sync', 'dry_run': dry_run, **counts, 'error_count': result.error_count,
+            'errors': result.errors[:20], 'preview': preview, 'summary': message}
+
+def run_export_job(ctx, params):
+    export = EXPORTS[params['name']]
+    fmt = params.get('format', export_formats.DEFAULT_FORMAT)
+    version = get_data_version()
+    key = export_cache_key(params['name'], fmt, version)
+    total = db.session.query(db.func.count(Guest.id)).scalar()
+    download_name = export_download_name(export, fmt)
+    path = job_file(ctx.job_id, download_name)
+    if export_cache.copy_to(key, path):
+        # שורה לכל אורח - total הוא מספר השורות בקובץ השמור
+        ctx.progress(total, total, message='מהמטמון', force=True)
+        return {'rows': total, 'file': download_name, 'format': fmt, 'cached': True}
+    ctx.progress(0, total, message='יוצר קובץ', force=True)
+    written = 0
+
+    def counted():
+        # בין batches אין שאילתה פתוחה - בטוח לעדכן התקדמות (וביטול) גם ב-SQLite
+        nonlocal written
+        for written, row in enumerate(export_rows(export), 1):
+            if written % EXPORT_BATCH_SIZE == 0:
+                ctx.progress(written, total)
+            yield row
+
+    try:
+        export_formats.write_export(path, fmt, export.headers, counted(), export.title, export.int_columns)
+    except BaseException:
+        os.remove(path)  # ביטול או כשל באמצע - לא משאירים קובץ חלקי
+        raise
+    if get_data_version() == version:
+        export_cache.put_file(key, path)
+    ctx.progress(written, total, force=True)
+    return {'rows': written, 'file': download_name, 'format': fmt}
+
+def run_bot_job(ctx, params):
+    """whatsapp_bot.py בתהליך בן; ההתקדמות נקראת מהשורות [i/N] בפלט שלו, ביטול עוצר את התהליך"""
+    import subprocess
+    import sys
+
+    command = params['command']
+    log_path = job_file(ctx.job_id, f'{command}.log')
+    script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'whatsapp_bot.py')
+    with open(log_path, 'w', encoding='utf-8') as log:
+        proc = subprocess.Popen([sys.executable, '-u', script_path, command],
+                                cwd=os.path.dirname(script_path), stdout=log, stderr=subprocess.STDOUT,
+                                env={**os.environ, 'PYTHONIOENCODING': 'utf-8'})
+    done, total, last_line = 0, None, ''
+    try:
+        while proc.poll() is None:
+            time.sleep(1)
+            with open(log_path, encoding='utf-8', errors='replace') as log:
+                lines = [line.strip() for line in log if line.strip()]
+            for line in reversed(lines):
+                match = BOT_PROGRESS_RE.search(line)
+                if match:
+                    done, total = int(match.group(1)), int(match.group(2))
+                    break
+            last_line = lines[-1] if lines else ''
+            ctx.progress(done, total, message=last_line)
+    except jobs.JobCancelled:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        raise
+    if proc.returncode != 0:
+        raise RuntimeError(f'הבוט הסתיים עם קוד {proc.returncode}: {last_line}')
+    return {'command': command, 'processed': done, 'total': total, 'log': os.path.basename(log_path)}
+
+JOB_HANDLERS = {
+    'import': run_import_job,
+    'export': run_export_job,
+    BOT_JOB_KIND: run_bot_job,
+}
+
+def cleanup_job_files():
+    if not os.path.isdir(JOB_FILES_DIR):
+        return
+    cutoff = time.time() - JOB_FILE_TTL
+    for name in os.listdir(JOB_FILES_DIR):
+        path = os.path.join(JOB_FILES_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+with app.app_context():
+    job_queue = jobs.JobQueue(db.engine, Job.__table__, get_local_time,
+                              stale_seconds=int(os.getenv('JOB_STALE_SECONDS', '120')))
+job_worker = jobs.JobWorker(job_queue, JOB_HANDLERS, context_factory=app.app_context,
+                            poll_interval=float(os.getenv('JOB_POLL_INTERVAL', '1.0')),
+                            housekeeping=cleanup_job_files)
+
+@app.before_request
+def start_embedded_job_worker():
+    # ה-thread מתחיל בבקשה הראשונה של כל תהליך (אחרי fork של gunicorn), לא ב-import -
+    # כך migrate_db.py וסקריפטים שמייבאים את app לא מריצים משימות
+    if app.config['JOB_WORKER_EMBEDDED']:
+        job_worker.ensure_running()
+
+def job_response(job, status=200, **extra):
+    return jsonify({'success': True, 'job': job.to_dict(), **extra}), status
+
+@app.route('/api/jobs')
+def api_jobs():
+    """המשימות האחרונות (?kind=, ?active=1 לרצות/בתור בלבד)"""
+    query = Job.query
+    if request.args.get('kind'):
+        query = query.filter(Job.kind == request.args['kind'])
+    if request.args.get('active'):
+        query = query.filter(Job.status.in_(jobs.ACTIVE_STATUSES))
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    return jsonify({'success': True, 'jobs': [j.to_dict() for j in query.order_by(Job.id.desc()).limit(limit)]})
+
+@app.route('/api/jobs/<int:job_id>')
+def api_job(job_id):
+    job = db.session.get(Job, job_id) or abort(404)
+    response = jsonify({'success': True, 'job': job.to_dict()})
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/api/jobs/<int:job_id>/cancel', methods=['POST'])
+def api_job_cancel(job_id):
+    db.session.get(Job, job_id) or abort(404)
+    job_queue.cancel(job_id)
+    db.session.expire_all()
+    return job_response(db.session.get(Job, job_id))
+
+@app.route('/api/jobs/<int:job_id>/download')
+def api_job_download(job_id):
+    job = db.session.get(Job, job_id) or abort(404)
+    result = json.loads(job.result) if job.result else {}
+    if job.status != jobs.DONE or not result.get('file'):
+        abort(404)
+    path = job_file(job.id, result['file'])
+    if not os.path.exists(path):
+        abort(410)  # נמחק אחרי JOB_FILE_TTL - צריך לייצא מחדש
+    mimetype = export_formats.FORMATS[result.get('format', export_formats.DEFAULT_FORMAT)][0]
+    return send_file(path, as_attachment=True, download_name=result['file'], mimetype=mimetype)
+
+@app.route('/api/imports/<int:job_id>/apply', methods=['POST'])
+def api_apply_sync(job_id):
+    """החלת סנכרון אחרי תצוגה מקדימה - אותו קובץ, הפעם עם כתיבה (ההבדלים מחושבים מחדש מול המסד)"""
+    job = db.session.get(Job, job_id) or abort(404)
+    params = json.loads(job.params or '{}')
+    if job.kind != 'import' or job.status != jobs.DONE or not params.get('dry_run'):
+        abort(400)
+    if not os.path.exists(params['path']):
+        abort(410)  # הקובץ נמחק (JOB_FILE_TTL או שכבר הוחל) - צריך להעלות שוב
+    new_id, created = enqueue_job('import', {**params, 'dry_run': False})
+    return job_response(db.session.get(Job, new_id), 202 if created else 200, created=created)
+
+@app.route('/api/exports/<name>', methods=['POST'])
+def api_start_export(name):
+    if name not in EXPORTS:
+        abort(404)
+    fmt = request.args.get('format', export_formats.DEFAULT_FORMAT)
+    try:
+        export_formats.check_available(fmt)
+    except (ValueError, export_formats.FormatUnavailable) as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    # ייצוא אחד בכל פעם; בקשה לאותו ייצוא (ואותו פורמט) בזמן שהוא רץ מחזירה את המשימה הקיימת
+    job_id, created = enqueue_job('export', {'name': name, 'format': fmt})
+    return job_response(db.session.get(Job, job_id), 202 if created else 200, created=created)
 
 if __name__ == '__main__':
+    run_migrations()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,191 @@
+"""
+Disk cache for finished export files (guests / bot lists as xlsx, csv, parquet).
+
+Admins tend to click "export" again and again while nothing changed. Every
+file is stored under a key made of the export name, the format, the global
+``data_version`` (bumped by every Guest / MessageLog write, see app.py) and a
+stamp of the settings that end up in the rows (site URL, invitation text).
+A repeat export with the same key is the cached file; any write to the guest
+list changes the key, so nothing is ever served stale and nothing needs to be
+invalidated explicitly.
+
+The cache is a directory, so all gunicorn workers (and the job worker process)
+on the machine share it: entries are written to a temp file and renamed into
+place, readers open the file once and keep the handle, and eviction tolerates
+files that another process already removed. Total size is bounded by
+``max_bytes``; the least recently used files go first (a hit touches the
+file's mtime). Storing a new version of an export drops its older versions
+right away - they can never be hit again.
+
+No app imports here.
+"""
+
+import hashlib
+import os
+import shutil
+import time
+from typing import BinaryIO, Iterable, Iterator, Optional
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'export_cache')
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+TMP_SUFFIX = '.tmp'
+STALE_TMP_SECONDS = 3600  # קובץ זמני של תהליך שנהרג באמצע כתיבה
+
+
+def export_key(name: str, fmt: str, data_version: int, *stamp) -> str:
+    """מפתח לקובץ: שם הייצוא, פורמט, גרסת הנתונים וחותמת ההגדרות שמשפיעות על התוכן"""
+    digest = hashlib.sha256('\0'.join(map(str, stamp)).encode('utf-8')).hexdigest()[:16]
+    return f'{name}.{fmt}.{data_version}.{digest}'
+
+
+class ExportCache:
+    """LRU of export files in a directory, bounded by total size."""
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def open(self, key: str) -> Optional[BinaryIO]:
+        """הקובץ השמור פתוח לקריאה, או None. ההחזקה ב-handle שומרת עליו גם אם תהליך אחר מפנה אותו"""
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            return None
+        try:
+            os.utime(path)  # LRU: פגיעה מרעננת את ה-mtime
+        except OSError:
+            pass
+        return f
+
+    def copy_to(self, key: str, dest_path: str) -> bool:
+        """מעתיק את הקובץ השמור ל-dest_path (קובץ של משימת ייצוא). False אם אין"""
+        f = self.open(key)
+        if f is None:
+            return False
+        with f, open(dest_path, 'wb') as out:
+            shutil.copyfileobj(f, out)
+        return True
+
+    def put_file(self, key: str, src_path: str) -> None:
+        """שומר עותק של קובץ מוכן"""
+        if not self.enabled or os.path.getsize(src_path) > self.max_bytes:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = self._tmp_path(key)
+            shutil.copyfile(src_path, tmp_path)
+            self._commit(key, tmp_path)
+        except OSError:
+            # דיסק מלא / לקריאה בלבד - רק מפסידים את המטמון
+            pass
+
+    def tee(self, key: str, chunks: Iterable[bytes], still_valid=None) -> Iterator[bytes]:
+        """מעביר את החתיכות הלאה ושומר אותן בדרך. הקובץ נכנס למטמון רק אם הזרם הסתיים
+        ו-still_valid() (אם ניתן) מאשר שהנתונים לא השתנו בזמן הבנייה"""
+        if not self.enabled:
+            yield from chunks
+            return
+        tmp_path, out, size = None, None, 0
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = self._tmp_path(key)
+            out = open(tmp_path, 'wb')
+        except OSError:
+            pass
+        try:
+            for chunk in chunks:
+                if out is not None:
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        out.close()
+                        os.remove(tmp_path)
+                        out = None
+                    else:
+                        out.write(chunk)
+                yield chunk
+            if out is not None:
+                out.close()
+                out = None
+                if still_valid is None or still_valid():
+                    try:
+                        self._commit(key, tmp_path)
+                    except OSError:
+                        pass
+        finally:
+            # הורדה שבוטלה / שגיאה באמצע - לא משאירים קובץ חלקי
+            if out is not None:
+                out.close()
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _tmp_path(self, key: str) -> str:
+        return f'{self._path(key)}.{os.getpid()}.{time.monotonic_ns()}{TMP_SUFFIX}'
+
+    def _commit(self, key: str, tmp_path: str) -> None:
+        os.replace(tmp_path, self._path(key))
+        self._drop_older_versions(key)
+        self._evict()
+
+    def _entries(self):
+        """(mtime, size, name) לכל קובץ במטמון, בלי קבצים זמניים (ישנים מהם נמחקים)"""
+        entries = []
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return entries
+        now = time.time()
+        for name in names:
+            try:
+                st = os.stat(self._path(name))
+            except OSError:
+                continue  # תהליך אחר כבר פינה
+            if name.endswith(TMP_SUFFIX):
+                if now - st.st_mtime > STALE_TMP_SECONDS:
+                    self._remove(name)
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+        return entries
+
+    def _remove(self, name: str) -> None:
+        try:
+            os.remove(self._path(name))
+        except OSError:
+            pass
+
+    def _drop_older_versions(self, key: str) -> None:
+        # name.fmt.<version>.<stamp>: גרסה ישנה של אותו ייצוא לא תיפגע שוב
+        # (גרסה חדשה יותר, ששמר תהליך אחר בינתיים, נשארת)
+        prefix, version, _ = key.rsplit('.', 2)
+        for _, _, name in self._entries():
+            head, other, _ = name.rsplit('.', 2) if name.count('.') >= 2 else (None, None, None)
+            if head == prefix and other.isdigit() and int(other) < int(version):
+                self._remove(name)
+
+    def _evict(self) -> None:
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(name)
+            total -= size
+
+    def clear(self) -> None:
+        for _, _, name in self._entries():
+            self._remove(name)
+
+
+export_cache = ExportCache(
+    cache_dir=os.getenv('EXPORT_CACHE_DIR', DEFAULT_CACHE_DIR),
+    max_bytes=int(os.getenv('EXPORT_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)),
+)
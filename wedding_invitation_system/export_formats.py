@@ -0,0 +1,147 @@
+"""
+Export file formats - the same rows as xlsx, csv or parquet, produced while they are sent.
+
+Every export is a list of column names plus an iterator of rows (app.py reads
+them from batched queries). ``iter_export`` turns them into a stream of bytes:
+
+* xlsx    - ``xlsx_stream.iter_xlsx``; an optional title row above the columns
+            (the layout of the invitation sites, which the import also reads).
+* csv     - UTF-8 with a BOM so Excel shows the Hebrew headers; the column row
+            first, no title row, so pandas / spreadsheets read it as a table.
+* parquet - one row group every ``ROW_GROUP_SIZE`` rows, written through
+            pyarrow's ParquetWriter into an unseekable buffer and yielded per
+            row group. Columns are typed (``int_columns`` -> int64, the rest
+            string); an empty cell ('' in the Excel file) is null.
+
+pyarrow is optional: it is imported only for parquet, and ``FormatUnavailable``
+is raised (before anything was sent - call ``check_available`` first) when it
+is not installed.
+
+No app imports here.
+"""
+
+import csv
+import io
+import itertools
+import math
+import numbers
+from typing import Iterable, Iterator, Optional, Sequence
+
+import xlsx_stream
+
+CHUNK_SIZE = xlsx_stream.CHUNK_SIZE
+ROW_GROUP_SIZE = 10000  # שורות לכל row group בקובץ parquet
+
+# פורמט -> (mimetype, סיומת)
+FORMATS = {
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+DEFAULT_FORMAT = 'xlsx'
+
+
+class FormatUnavailable(RuntimeError):
+    """הפורמט דורש ספרייה שלא מותקנת (parquet בלי pyarrow)"""
+
+
+def check_available(fmt: str) -> None:
+    """ValueError לפורמט לא מוכר, FormatUnavailable לפורמט בלי הספרייה שלו"""
+    if fmt not in FORMATS:
+        raise ValueError(f'פורמט ייצוא לא מוכר: {fmt} (אפשר: {", ".join(FORMATS)})')
+    if fmt == 'parquet':
+        _pyarrow()
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise FormatUnavailable('ייצוא parquet דורש את pyarrow (pip install pyarrow)') from None
+    return pyarrow, pyarrow.parquet
+
+
+class _Sink(xlsx_stream._Buffer):
+    """יעד ל-ParquetWriter: כמו ה-buffer של ה-xlsx, עם tell() (המיקום נשמר ב-footer)"""
+
+    def __init__(self):
+        super().__init__()
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.position += len(data)
+        return super().write(data)
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        self.closed = True
+
+
+def iter_csv(columns: Sequence[str], rows: Iterable[Sequence], chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """CSV כזרם של חתיכות bytes, עם BOM כדי ש-Excel יזהה UTF-8"""
+    text = io.StringIO()
+    writer = csv.writer(text)
+    text.write('\ufeff')
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow(['' if _is_empty(v) else v for v in row])
+        if text.tell() >= chunk_size:
+            yield text.getvalue().encode('utf-8')
+            text.seek(0)
+            text.truncate()
+    yield text.getvalue().encode('utf-8')
+
+
+def _is_empty(value) -> bool:
+    if value is None or value == '':
+        return True
+    return isinstance(value, numbers.Real) and not isinstance(value, numbers.Integral) and not math.isfinite(value)
+
+
+def iter_parquet(columns: Sequence[str], rows: Iterable[Sequence], int_columns: Iterable[str] = (),
+                 row_group_size: int = ROW_GROUP_SIZE) -> Iterator[bytes]:
+    """Parquet כזרם: row group לכל row_group_size שורות, והבתים שלו יוצאים מיד"""
+    pa, pq = _pyarrow()
+    int_columns = set(int_columns)
+    schema = pa.schema([(c, pa.int64() if c in int_columns else pa.string()) for c in columns])
+    convert = [int if c in int_columns else str for c in columns]
+    sink = _Sink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        batch = [[] for _ in columns]
+        for count, row in enumerate(rows, 1):
+            for values, to_type, value in zip(batch, convert, row):
+                values.append(None if _is_empty(value) else to_type(value))
+            if count % row_group_size == 0:
+                writer.write_table(pa.Table.from_arrays(batch, schema=schema))
+                batch = [[] for _ in columns]
+                yield sink.take()
+        if batch[0]:
+            writer.write_table(pa.Table.from_arrays(batch, schema=schema))
+    finally:
+        writer.close()  # ה-footer; גם בקובץ ריק יוצא parquet תקין עם הסכמה
+    yield sink.take()
+
+
+def iter_export(fmt: str, columns: Sequence[str], rows: Iterable[Sequence], title: Optional[str] = None,
+                int_columns: Iterable[str] = ()) -> Iterator[bytes]:
+    """הקובץ בפורמט המבוקש כזרם של bytes. title - שורת כותרת מעל העמודות (xlsx בלבד)"""
+    check_available(fmt)
+    if fmt == 'csv':
+        return iter_csv(columns, rows)
+    if fmt == 'parquet':
+        return iter_parquet(columns, rows, int_columns)
+    header = ([[title] * len(columns)] if title else []) + [list(columns)]
+    return xlsx_stream.iter_xlsx(itertools.chain(header, rows))
+
+
+def write_export(path: str, fmt: str, columns: Sequence[str], rows: Iterable[Sequence],
+                 title: Optional[str] = None, int_columns: Iterable[str] = ()) -> None:
+    """אותו זרם לקובץ (ייצוא כמשימת רקע)"""
+    with open(path, 'wb') as f:
+        for chunk in iter_export(fmt, columns, rows, title, int_columns):
+            f.write(chunk)
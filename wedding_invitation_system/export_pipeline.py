@@ -0,0 +1,148 @@
+"""
+Export pipeline - one columnar projection for every export file.
+
+An export is a list of ``Column``s: the header, the guest fields it reads and
+a function that derives the whole column for a batch at once. app.py reads
+the union of the fields with a plain Core select in keyset batches (no ORM
+objects), ``project`` transposes each batch into columns (field -> list),
+derives every output column with one list-level pass and zips the columns back
+into rows for export_formats.py. Adding an export (or a column to one) is
+configuration: ``EXPORTS`` in app.py.
+
+The invitation text is rendered from ``invitation_template``: everything but
+the guest's name, token and seat count is formatted once per export (and
+cached across exports), so a row costs one string join instead of rebuilding
+the message. app.build_invitation_message uses the same template.
+
+No app imports here.
+"""
+
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import phones
+
+# סטטוס הגעה כשאין attendance_status - לפי is_attending
+ATTENDANCE_TEXT = {True: 'יגיע', False: 'לא יגיע'}
+PENDING_TEXT = 'ממתין'
+SENT_TEXT = {True: 'נשלחה', False: 'לא נשלחה'}
+
+
+class ExportContext(NamedTuple):
+    """הגדרות שנכנסות לשורות - נקבעות פעם אחת לכל ייצוא"""
+    website_url: str
+    template: 'InvitationTemplate'
+
+
+class Column(NamedTuple):
+    header: str
+    fields: Tuple[str, ...]   # עמודות Guest שהעמודה קוראת
+    derive: Callable          # (batch, context) -> רשימת ערכים, אחד לכל אורח ב-batch
+    integer: bool = False     # int64 ב-parquet (השאר מחרוזות)
+
+
+class ExportSpec(NamedTuple):
+    prefix: str                  # קידומת שם הקובץ
+    columns: List[Column]
+    title: Optional[str] = None  # שורת כותרת מעל העמודות (xlsx בלבד)
+
+    @property
+    def headers(self) -> List[str]:
+        return [c.header for c in self.columns]
+
+    @property
+    def int_columns(self) -> Tuple[str, ...]:
+        return tuple(c.header for c in self.columns if c.integer)
+
+    @property
+    def fields(self) -> Tuple[str, ...]:
+        """כל עמודות Guest שהייצוא צריך, בלי כפילויות ובסדר קבוע"""
+        return tuple(dict.fromkeys(f for c in self.columns for f in c.fields))
+
+
+def project(spec: ExportSpec, batches: Iterable[Sequence], context: ExportContext) -> Iterator[list]:
+    """שורות הקובץ. batches - רשימות של שורות DB שהעמודות שלהן לפי spec.fields"""
+    fields = spec.fields
+    for rows in batches:
+        batch: Dict[str, tuple] = dict(zip(fields, zip(*rows)))
+        yield from map(list, zip(*(c.derive(batch, context) for c in spec.columns)))
+
+
+# ---- עמודות ----
+
+def field(name: str, header: str, empty='', integer: bool = False) -> Column:
+    """הערך כפי שהוא; None (או ריק) -> empty"""
+    if empty is None:
+        return Column(header, (name,), lambda b, ctx: list(b[name]), integer)
+    return Column(header, (name,), lambda b, ctx: [v or empty for v in b[name]], integer)
+
+
+def _status(b, ctx):
+    return [s or ATTENDANCE_TEXT.get(a, PENDING_TEXT) for s, a in zip(b['attendance_status'], b['is_attending'])]
+
+
+def status(header: str) -> Column:
+    """attendance_status, או יגיע / לא יגיע / ממתין לפי is_attending"""
+    return Column(header, ('attendance_status', 'is_attending'), _status)
+
+
+def _phone_e164(b, ctx):
+    # E.164 בלי '+' (97250...) שמור על האורח; חישוב רק לשורות ישנות בלי phone_e164 - ראו phones.py
+    return [e or phones.to_e164(p) or '' for e, p in zip(b['phone_e164'], b['phone'])]
+
+
+def phone_e164(header: str) -> Column:
+    return Column(header, ('phone_e164', 'phone'), _phone_e164)
+
+
+def _rsvp_links(b, ctx):
+    base = f"{ctx.website_url.rstrip('/')}/rsvp/"
+    return [base + t if t else ctx.website_url for t in b['unique_token']]
+
+
+def rsvp_link(header: str) -> Column:
+    return Column(header, ('unique_token',), _rsvp_links)
+
+
+def _messages(b, ctx):
+    return ctx.template.render_many(b['name'], b['unique_token'], b['invited_count'])
+
+
+def invitation_message(header: str) -> Column:
+    return Column(header, ('name', 'unique_token', 'invited_count'), _messages)
+
+
+def gift_amount(header: str) -> Column:
+    """סכום שלם; 0 / חסר -> ריק"""
+    return Column(header, ('estimated_gift_amount',),
+                  lambda b, ctx: [int(v) if v else '' for v in b['estimated_gift_amount']], True)
+
+
+def sent_text(header: str) -> Column:
+    return Column(header, ('message_sent',), lambda b, ctx: [SENT_TEXT[bool(v)] for v in b['message_sent']])
+
+
+# ---- נוסח ההזמנה ----
+
+class InvitationTemplate(NamedTuple):
+    body: str        # מה שבין ברכת השלום לטוקן
+    seats_line: str  # שורת מספר המקומות, עם {} למספר
+
+    def render(self, name, token, invited_count) -> str:
+        message = f'שלום {name}!{self.body}{token}'
+        if invited_count and invited_count > 1:
+            message += self.seats_line.format(invited_count)
+        return message
+
+    def render_many(self, names, tokens, counts) -> list:
+        return list(map(self.render, names, tokens, counts))
+
+
+@lru_cache(maxsize=8)
+def invitation_template(website_url: str, couple_names: str, wedding_date: str) -> InvitationTemplate:
+    """ההודעה לאורח (שלום / הזמנה / תאריך / קישור / מקומות) - הכול מלבד השם, הטוקן ומספר המקומות"""
+    lines = ['', f'אתם מוזמנים ל{couple_names}!' if couple_names else 'אתם מוזמנים לחתונה שלנו!']
+    if wedding_date:
+        lines.append(f'התאריך: {wedding_date}')
+    lines.append(f"נשמח לאישור הגעה כאן: {website_url.rstrip('/')}/rsvp/")
+    return InvitationTemplate('\n'.join(lines), '\nמספר מקומות שמורים לכם: {}')
@@ -3,21 +3,21 @@
 ריצה: python get_links.py
 """
 
-from app import app, Guest
+from app import app, iter_guest_rows
+from qr_cache import get_rsvp_qr, rsvp_url
+from io import BytesIO
 import os
 
 def generate_guest_links():
     """יצירת קישורים ייחודיים לכל אורח"""
     with app.app_context():
-        guests = Guest.query.all()
+        # קריאה בזרם - רק העמודות הנחוצות, בלי לטעון את כל האורחים לזיכרון
+        guests = iter_guest_rows(('name', 'phone', 'invited_count', 'unique_token'))
         website_url = os.getenv('WEBSITE_URL', 'http://localhost:5000')
         
-        if not guests:
-            print("❌ אין אורחים במערכת")
-            return
-        
-        print(f"📋 רשימת קישורים ייחודיים עבור {len(guests)} אורחים:\n")
+        print("📋 רשימת קישורים ייחודיים לאורחים:\n")
         print("=" * 80)
+        count = 0
         
         # יצירת קובץ טקסט עם הקישורים
         with open('guest_links.txt', 'w', encoding='utf-8') as f:
@@ -25,22 +25,27 @@ def generate_guest_links():
             f.write("=" * 50 + "\n\n")
             
             for i, guest in enumerate(guests, 1):
-                link = f"{website_url}/rsvp/{guest.unique_token}"
+                count = i
+                name, phone, invited_count = guest['name'], guest['phone'], guest['invited_count']
+                link = f"{website_url}/rsvp/{guest['unique_token']}"
                 
                 # הדפסה למסך
-                print(f"{i:2d}. {guest.name:<20} | {guest.phone:<15} | מוזמנים: {guest.invited_count}")
+                print(f"{i:2d}. {name:<20} | {phone:<15} | מוזמנים: {invited_count}")
                 print(f"    🔗 {link}")
-                print(f"    📱 WhatsApp: https://wa.me/{guest.phone.replace('+', '').replace('-', '').replace(' ', '')}?text=שלום%20{guest.name.replace(' ', '%20')}!%20הנה%20הקישור%20לאישור%20הגעה:%20{link}")
+                print(f"    📱 WhatsApp: https://wa.me/{phone.replace('+', '').replace('-', '').replace(' ', '')}?text=שלום%20{name.replace(' ', '%20')}!%20הנה%20הקישור%20לאישור%20הגעה:%20{link}")
                 print()
                 
                 # כתיבה לקובץ
-                f.write(f"{i}. {guest.name} ({guest.phone}) - מוזמנים: {guest.invited_count}\n")
+                f.write(f"{i}. {name} ({phone}) - מוזמנים: {invited_count}\n")
                 f.write(f"   קישור: {link}\n")
-                f.write(f"   WhatsApp: https://wa.me/{guest.phone.replace('+', '').replace('-', '').replace(' ', '')}?text=שלום%20{guest.name.replace(' ', '%20')}!%20הנה%20הקישור%20לאישור%20הגעה:%20{link}\n")
+                f.write(f"   WhatsApp: https://wa.me/{phone.replace('+', '').replace('-', '').replace(' ', '')}?text=שלום%20{name.replace(' ', '%20')}!%20הנה%20הקישור%20לאישור%20הגעה:%20{link}\n")
                 f.write("\n")
         
+        if not count:
+            print("❌ אין אורחים במערכת")
+            return
         print("=" * 80)
-        print(f"✅ הקישורים נשמרו גם בקובץ: guest_links.txt")
+        print(f"✅ {count} קישורים נשמרו גם בקובץ: guest_links.txt")
         print("\n📱 דרכים לשליחה:")
         print("   1. העתק את הקישור לכל אורח ושלח ידנית")
         print("   2. לחץ על קישור WhatsApp לשליחה מהירה")
@@ -49,11 +54,10 @@ def generate_guest_links():
 def generate_guest_cards():
     """יצירת כרטיסיות להדפסה עם QR codes"""
     try:
-        import qrcode
         from PIL import Image, ImageDraw, ImageFont
         
         with app.app_context():
-            guests = Guest.query.all()
+            guests = iter_guest_rows(('name', 'invited_count', 'unique_token'))
             website_url = os.getenv('WEBSITE_URL', 'http://localhost:5000')
             
             if not os.path.exists('invitation_cards'):
@@ -61,14 +65,12 @@ def generate_guest_cards():
             
             print("🎨 יוצר כרטיסי הזמנה עם QR codes...")
             
+            count = 0
             for guest in guests:
-                # יצירת QR code
-                qr_url = f"{website_url}/rsvp/{guest.unique_token}"
-                qr = qrcode.QRCode(version=1, box_size=10, border=5)
-                qr.add_data(qr_url)
-                qr.make(fit=True)
-                
-                qr_img = qr.make_image(fill_color="black", back_color="white")
+                count += 1
+                # QR code - משותף עם עמוד ה-RSVP דרך המטמון
+                qr_url = rsvp_url(website_url, guest['unique_token'])
+                qr_img = Image.open(BytesIO(get_rsvp_qr(website_url, guest['unique_token'])))
                 
                 # יצירת כרטיס
                 card = Image.new('RGB', (800, 600), color='white')
@@ -86,8 +88,8 @@ def generate_guest_cards():
                 
                 # כותרת
                 draw.text((400, 50), "הזמנה לחתונה", font=font_large, anchor="mm", fill="black")
-                draw.text((400, 120), f"שלום {guest.name}!", font=font_medium, anchor="mm", fill="blue")
-                draw.text((400, 170), f"מוזמנים: {guest.invited_count} אנשים", font=font_medium, anchor="mm", fill="black")
+                draw.text((400, 120), f"שלום {guest['name']}!", font=font_medium, anchor="mm", fill="blue")
+                draw.text((400, 170), f"מוזמנים: {guest['invited_count']} אנשים", font=font_medium, anchor="mm", fill="black")
                 
                 # הוספת QR code
                 qr_img = qr_img.resize((200, 200))
@@ -97,10 +99,10 @@ def generate_guest_cards():
                 draw.text((400, 510), qr_url, font=font_small, anchor="mm", fill="gray")
                 
                 # שמירת הכרטיס
-                filename = f"invitation_cards/{guest.name.replace(' ', '_')}_invitation.png"
+                filename = f"invitation_cards/{guest['name'].replace(' ', '_')}_invitation.png"
                 card.save(filename)
             
-            print(f"✅ נוצרו {len(guests)} כרטיסי הזמנה בתיקייה: invitation_cards/")
+            print(f"✅ נוצרו {count} כרטיסי הזמנה בתיקייה: invitation_cards/")
             
     except ImportError:
         print("⚠️  להפקת כרטיסים צריך להתקין: pip install Pillow")
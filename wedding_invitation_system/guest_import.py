@@ -0,0 +1,360 @@
+"""
+Guest list import (Excel/CSV) - parsing and normalisation.
+
+The file is read in a single pass (openpyxl ``read_only`` / ``csv``), in
+chunks of ``chunk_size`` rows, so memory is bounded by the chunk and not by
+the file (``iter_guest_chunks``). Each chunk is handled column-wise:
+  * the header -> field mapping is resolved once per chunk (``map_columns``),
+    not once per cell;
+  * cleaning, phone fixing and type coercion are vectorised pandas
+    operations over the whole column (``prepare_rows``);
+  * rows that cannot be imported are reported by row number, with the same
+    messages the row-by-row importer used.
+
+Nothing here touches the database: app.py looks up existing phones in bulk
+and inserts the prepared rows (``import_guest_frame``), committing after
+every chunk for large files (``import_guest_chunks``).
+
+Sync (upsert) mode re-imports an updated copy of the same master sheet: every
+prepared row gets a hash (``row_hashes``) that is stored on the guest, and
+``plan_sync`` diffs the file against the stored hashes - only new, changed and
+removed rows turn into INSERT / UPDATE / DELETE. Guests keep their id and
+token (links that were already sent keep working).
+
+Rows are matched to guests - in both modes - by the canonical phone
+(``phone_e164``, see phones.py), so a number typed differently in the sheet
+is still the same guest.
+"""
+
+import csv
+import hashlib
+import io
+import itertools
+from typing import Dict, Iterator, List, NamedTuple, Set, Tuple
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+import phones
+
+# שורת הכותרת בקובץ של אתרי ההזמנות; לפעמים יש מעליה שורת כותרת של הקובץ
+HEADER_MARKER = 'שם המוזמן'
+NULL_STRINGS = ('', 'nan', 'NaN', 'null', 'None')
+SENT_VALUES = ('נשלחה', 'true', '1', 'yes', 'כן')
+DEFAULT_ATTENDANCE_STATUS = 'ממתין'
+DEFAULT_CHUNK_SIZE = 5000
+ATTENDING_BY_STATUS = {'יגיע': True, 'לא יגיע': False}
+
+TEXT_FIELDS = ('name', 'phone', 'email', 'group_affiliation', 'side', 'notes', 'added_by', 'attendance_status')
+IMPORT_FIELDS = TEXT_FIELDS + ('invited_count', 'estimated_gift_amount', 'message_sent', 'is_attending')
+# בסנכרון: שדות שהאורח עצמו עונה עליהם באתר - נלקחים מהגיליון רק כל עוד לא ענה
+RSVP_FIELDS = ('attendance_status', 'is_attending', 'notes')
+SYNC_PREVIEW_ROWS = 20
+
+
+class ImportResult(NamedTuple):
+    imported: int
+    errors: List[str]  # הודעות לפי סדר השורות (בייבוא בחלקים - עד מספר מקסימלי)
+    error_count: int
+
+
+class SyncPlan(NamedTuple):
+    inserts: List[dict]   # שורות חדשות (IMPORT_FIELDS + import_hash)
+    updates: List[dict]   # {'id', 'values', 'changed'} - changed ריק = רק ה-hash מתעדכן
+    deletes: List[dict]   # {'id', 'name', 'phone'} - אורחים מהגיליון שהוסרו ממנו
+    unchanged: int
+
+    @property
+    def changed_updates(self) -> List[dict]:
+        return [u for u in self.updates if u['changed']]
+
+
+def _clean_header(header) -> List[str]:
+    # ניקוי שמות עמודות - הסרת רווחים מיותרים ותווים מיוחדים
+    return [str(col).strip().replace('\n', ' ').replace('\r', '') if col is not None else ''
+            for col in header]
+
+
+def _split_header(first, second):
+    """(כותרת, שורות נתונים שכבר נקראו) - שורה ראשונה שאינה כותרת (״קובץ רשימות מוזמנים...״) מדולגת"""
+    if (second is not None and HEADER_MARKER not in [str(v) for v in first]
+            and HEADER_MARKER in [str(v) for v in second]):
+        return second, []
+    return first, [second] if second is not None else []
+
+
+def _excel_text(value):
+    """תא Excel כטקסט, כמו read_excel(dtype=str): 500.0 -> '500'"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+def _frame(rows, columns, start: int) -> pd.DataFrame:
+    df = pd.DataFrame(rows, columns=columns, dtype=object)
+    df.index = pd.RangeIndex(start, start + len(df))
+    return df
+
+
+def _iter_csv_chunks(file, chunk_size: int):
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    try:
+        reader = csv.reader(text)
+        first = next(reader, None)
+        if first is None:
+            return
+        header, pending = _split_header(first, next(reader, None))
+        columns = _clean_header(header)
+        # שורות ריקות לא נספרות (כמו ב-read_csv) - שורה באורך שונה מהכותרת מיושרת אליה
+        start, rows = 0, []
+        for row in itertools.chain(pending, reader):
+            if not any(cell.strip() for cell in row):
+                continue
+            rows.append([cell if cell != '' else None for cell in (row + [''] * len(columns))[:len(columns)]])
+            if len(rows) >= chunk_size:
+                yield _frame(rows, columns, start)
+                start, rows = start + len(rows), []
+        if rows:
+            yield _frame(rows, columns, start)
+    finally:
+        text.detach()  # בלי זה סגירת ה-wrapper סוגרת גם את הקובץ שהועלה
+
+
+def _iter_excel_chunks(file, chunk_size: int):
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        values = workbook.active.iter_rows(values_only=True)
+        first = next(values, None)
+        if first is None:
+            return
+        header, pending = _split_header(first, next(values, None))
+        columns = _clean_header(header)
+        start, rows = 0, []
+        for row in itertools.chain(pending, values):
+            cells = [_excel_text(v) for v in row[:len(columns)]]
+            if not any(cells):
+                continue
+            rows.append(cells + [None] * (len(columns) - len(cells)))
+            if len(rows) >= chunk_size:
+                yield _frame(rows, columns, start)
+                start, rows = start + len(rows), []
+        if rows:
+            yield _frame(rows, columns, start)
+    finally:
+        workbook.close()
+
+
+def iter_guest_chunks(file, filename: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """קריאת הקובץ במעבר אחד, chunk_size שורות בכל פעם (Excel ב-read_only, CSV שורה-שורה).
+    זיהוי שורת הכותרת נעשה על שתי השורות הראשונות בלי לקרוא את הקובץ פעמיים. הערכים נשארים
+    טקסט (טלפון 0521234567 לא הופך למספר) וה-index של כל chunk הוא מספר השורה בקובץ כולו."""
+    if filename.lower().endswith('.csv'):
+        return _iter_csv_chunks(file, chunk_size)
+    return _iter_excel_chunks(file, chunk_size)
+
+
+def read_guest_file(file, filename: str) -> pd.DataFrame:
+    """כל הקובץ כ-DataFrame אחד (לקבצים רגילים - קבצים גדולים מיובאים ב-chunks)"""
+    chunks = list(iter_guest_chunks(file, filename))
+    if not chunks:
+        return pd.DataFrame()
+    return pd.concat(chunks)
+
+
+def field_for_column(col: str):
+    """השדה שעמודה ממופה אליו (או None) - לפי שם העמודה בקבצי אתרי ההזמנות"""
+    col_clean = str(col).strip()
+    col_lower = col_clean.lower()
+    if col_clean == 'שם המוזמן' or 'שם' in col_lower:
+        return 'name'
+    if col_clean == 'נייד' or 'נייד' in col_lower or 'טלפון' in col_lower:
+        return 'phone'
+    if col_clean == 'כמה יגיעו' or ('כמה' in col_lower and 'יגיעו' in col_lower):
+        return 'invited_count'
+    if col_clean == 'שיוך לקבוצה' or 'קבוצה' in col_lower:
+        return 'group_affiliation'
+    if col_clean == 'מהצד של...' or ('צד' in col_lower and 'של' in col_lower):
+        return 'side'
+    if 'סטטוס הגעה' in col_clean or ('סטטוס' in col_lower and 'הגעה' in col_lower):
+        return 'attendance_status'
+    if col_clean == 'סכום מתנה משוער' or ('מתנה' in col_lower and ('משוער' in col_lower or 'סכום' in col_lower)):
+        return 'estimated_gift_amount'
+    if 'האם נשלחה הזמנה' in col_clean or ('הזמנה' in col_lower and 'נשלחה' in col_lower):
+        return 'message_sent_text'
+    if col_clean == 'mail' or 'mail' in col_lower or 'מייל' in col_lower:
+        return 'email'
+    if col_clean == 'הערות (מלל חופשי)' or 'הערות' in col_lower:
+        return 'notes'
+    if 'מספר הטלפון של המשתמש' in col_clean or ('מספר' in col_lower and 'הכניס' in col_lower):
+        return 'added_by'
+    return None
+
+
+def map_columns(columns) -> Dict[str, List[str]]:
+    """{field: [columns]} - כמה עמודות לאותו שדה נלקחות לפי הסדר (הערך הראשון שאינו ריק)"""
+    mapping: Dict[str, List[str]] = {}
+    for col in columns:
+        field = field_for_column(col)
+        if field:
+            mapping.setdefault(field, []).append(col)
+    return mapping
+
+
+def clean_column(series: pd.Series) -> pd.Series:
+    """טקסט מנוקה לכל העמודה; ערכים ריקים הופכים ל-NaN"""
+    text = series.astype(str).str.strip()
+    if pd.api.types.is_float_dtype(series):
+        # עמודה מספרית עם תאים ריקים נקראת כ-float - 521234567.0 צריך להיות 521234567
+        whole = series.notna() & np.isfinite(series) & (series % 1 == 0)
+        if whole.any():
+            text = text.where(~whole, series.where(whole).astype('Int64').astype(str))
+    return text.mask(series.isna() | text.isin(NULL_STRINGS))
+
+
+def _field_values(df: pd.DataFrame, mapping: Dict[str, List[str]], field: str) -> pd.Series:
+    values = None
+    for col in mapping.get(field, ()):
+        cleaned = clean_column(df[col])
+        values = cleaned if values is None else values.fillna(cleaned)
+    if values is None:
+        return pd.Series(np.nan, index=df.index, dtype=object)
+    return values
+
+
+def _fix_phones(phone: pd.Series) -> pd.Series:
+    # תיקון: הוספת 0 אם חסר במספר סלולרי ישראלי
+    missing_zero = phone.str.fullmatch(phones.MISSING_ZERO_PATTERN, na=False)
+    return phone.where(~missing_zero, '0' + phone)
+
+
+def phone_keys(phone: pd.Series) -> pd.Series:
+    """phone_e164 לכל שורה (None לטלפון בלי ספרות) - המפתח של בדיקת הכפילויות והסנכרון"""
+    return phone.map(phones.to_e164, na_action='ignore').astype(object)
+
+
+def file_phones(df: pd.DataFrame) -> Set[str]:
+    """כל הטלפונים בקובץ (phone_e164), גם בשורות עם שגיאה - אורח ששורתו פגומה לא נמחק בסנכרון"""
+    return set(phone_keys(_fix_phones(_field_values(df, map_columns(df.columns), 'phone'))).dropna())
+
+
+def prepare_rows(df: pd.DataFrame) -> Tuple[pd.DataFrame, Dict[int, str]]:
+    """מחזיר (שורות תקינות עם עמודות IMPORT_FIELDS ו-phone_e164, {מספר שורה בקובץ: שגיאה}).
+    ה-index של df הוא מיקום השורה בקובץ (0 = השורה הראשונה אחרי הכותרת)."""
+    mapping = map_columns(df.columns)
+    out = pd.DataFrame({field: _field_values(df, mapping, field) for field in TEXT_FIELDS}, index=df.index)
+
+    out['phone'] = _fix_phones(out['phone'])
+    out['phone_e164'] = phone_keys(out['phone'])
+
+    invited = pd.to_numeric(_field_values(df, mapping, 'invited_count'), errors='coerce')
+    invited = np.trunc(invited.where(np.isfinite(invited)))
+    out['invited_count'] = invited.fillna(1).astype(int)
+    gift = pd.to_numeric(_field_values(df, mapping, 'estimated_gift_amount'), errors='coerce')
+    out['estimated_gift_amount'] = gift.fillna(0.0).astype(float)
+    sent = _field_values(df, mapping, 'message_sent_text')
+    out['message_sent'] = sent.str.lower().isin(SENT_VALUES).fillna(False).astype(bool)
+    out['attendance_status'] = out['attendance_status'].fillna(DEFAULT_ATTENDANCE_STATUS)
+    # סטטוס לא מוכר נשמר כמו שהמודל שומר None - ערך ברירת המחדל (False)
+    out['is_attending'] = out['attendance_status'].map(ATTENDING_BY_STATUS).fillna(False).astype(bool)
+
+    row_numbers = out.index + 2  # שורה 1 בקובץ היא הכותרת (ה-index נשמר גם ב-chunks)
+    errors: Dict[int, str] = {}
+    no_name = out['name'].isna()
+    for row in row_numbers[no_name]:
+        errors[row] = f'שורה {row}: חסר שם אורח'
+    no_phone = out['phone'].isna() & ~no_name
+    for row, name in zip(row_numbers[no_phone], out.loc[no_phone, 'name']):
+        errors[row] = f'שורה {row}: חסר מספר טלפון עבור {name}'
+    # אותו טלפון פעמיים בקובץ - הראשון נכנס, השאר מדווחים כקיימים
+    bad_phone = out['phone_e164'].isna() & ~(no_name | no_phone)
+    for row, name, phone in zip(row_numbers[bad_phone], out.loc[bad_phone, 'name'], out.loc[bad_phone, 'phone']):
+        errors[row] = f'שורה {row}: מספר טלפון לא תקין עבור {name} ({phone})'
+    # אותו טלפון פעמיים בקובץ (גם בכתיב אחר: 050-... / +972...) - הראשון נכנס, השאר מדווחים כקיימים
+    valid = ~(no_name | no_phone | bad_phone)
+    repeated = valid & out['phone_e164'].where(valid).duplicated()
+    for row, name, phone in zip(row_numbers[repeated], out.loc[repeated, 'name'], out.loc[repeated, 'phone']):
+        errors[row] = f'שורה {row}: האורח {name} ({phone}) כבר קיים במערכת'
+    out = out[valid & ~repeated]
+    out.index = row_numbers[valid & ~repeated]
+    return out[list(IMPORT_FIELDS) + ['phone_e164']], errors
+
+
+def records(rows: pd.DataFrame) -> List[dict]:
+    """שורות כ-dict לפקודת INSERT אחת; NaN הופך ל-None"""
+    columns = [rows[c].astype(object).where(rows[c].notna(), None).tolist() for c in rows.columns]
+    keys = list(rows.columns)
+    return [dict(zip(keys, values)) for values in zip(*columns)]
+
+
+def row_hashes(rows: pd.DataFrame) -> List[str]:
+    """hash של כל שורה מנורמלת (IMPORT_FIELDS) - שורה שלא השתנתה בגיליון מקבלת אותו hash"""
+    columns = [rows[c].astype(object).where(rows[c].notna(), None).tolist() for c in IMPORT_FIELDS]
+    return [hashlib.blake2b('\x1f'.join('' if v is None else str(v) for v in values).encode('utf-8'),
+                            digest_size=16).hexdigest()
+            for values in zip(*columns)]
+
+
+def _same(current, new) -> bool:
+    if current is None or new is None:
+        return current is None and new is None
+    if isinstance(new, (bool, np.bool_)):
+        return bool(current) == bool(new)
+    if isinstance(new, (int, float, np.number)):
+        return float(current) == float(new)
+    return str(current) == str(new)
+
+
+def _stored_hashes(rows: pd.DataFrame, current: Dict[str, dict]) -> pd.Series:
+    return rows['phone_e164'].map({key: g['import_hash'] for key, g in current.items()})
+
+
+def changed_phones(rows: pd.DataFrame, hashes: List[str], current: Dict[str, dict]) -> List[str]:
+    """טלפונים (phone_e164) של אורחים קיימים שה-hash השמור שלהם שונה - רק להם צריך את כל העמודות"""
+    known = rows['phone_e164'].isin(current.keys())
+    return rows['phone_e164'][known & (_stored_hashes(rows, current) != pd.Series(hashes, index=rows.index))].tolist()
+
+
+def plan_sync(rows: pd.DataFrame, hashes: List[str], current: Dict[str, dict], keep_phones: Set[str]) -> SyncPlan:
+    """ההבדלים בין הגיליון למסד.
+    rows - פלט prepare_rows, hashes - row_hashes(rows); current - {phone_e164: {id, phone, name, import_hash}}
+    לכל אורח שהטלפון שלו בקובץ ולכל אורח שהגיע מסנכרון קודם, ולאורחים שב-changed_phones גם
+    response_date ו-IMPORT_FIELDS; keep_phones - כל הטלפונים בקובץ (file_phones).
+      * טלפון חדש -> insert
+      * hash שונה מהשמור -> update של שדות הגיליון; RSVP_FIELDS רק אם האורח עוד לא ענה באתר,
+        ו-message_sent לא חוזר ל-False (הבוט כבר שלח)
+      * אורח מסנכרון קודם שהטלפון שלו כבר לא בקובץ -> delete (אורחים שנוספו ידנית לא נמחקים)
+    שורות שלא השתנו מסוננות וקטורית, בלי לבנות להן dict."""
+    hashes = pd.Series(hashes, index=rows.index)
+    same = rows['phone_e164'].isin(current.keys()) & (_stored_hashes(rows, current) == hashes)
+    inserts, updates, unchanged = [], [], int(same.sum())
+    for row, row_hash in zip(records(rows[~same]), hashes[~same]):
+        guest = current.get(row['phone_e164'])
+        if guest is None:
+            inserts.append({**row, 'import_hash': row_hash})
+            continue
+        fields = [f for f in IMPORT_FIELDS if f not in RSVP_FIELDS or guest['response_date'] is None]
+        values = {f: row[f] for f in fields}
+        values['message_sent'] = bool(guest['message_sent']) or bool(row['message_sent'])
+        changed = [f for f in fields if not _same(guest[f], values[f])]
+        values['import_hash'] = row_hash
+        if not changed:
+            unchanged += 1
+        updates.append({'id': guest['id'], 'values': values, 'changed': changed})
+    deletes = [{'id': g['id'], 'name': g['name'], 'phone': g['phone']} for key, g in current.items()
+               if g['import_hash'] is not None and key not in keep_phones]
+    return SyncPlan(inserts, updates, sorted(deletes, key=lambda d: d['id']), unchanged)
+
+
+def sync_preview(plan: SyncPlan, current: Dict[str, dict]) -> dict:
+    """תקציר התוכנית לתצוגה מקדימה (dry run) - כמויות ודוגמאות ראשונות מכל סוג"""
+    by_id = {g['id']: g for g in current.values()}
+    return {
+        'inserts': [{'name': r['name'], 'phone': r['phone']} for r in plan.inserts[:SYNC_PREVIEW_ROWS]],
+        'updates': [{'id': u['id'], 'name': by_id[u['id']]['name'],
+                     'changes': {f: [by_id[u['id']][f], u['values'][f]] for f in u['changed']}}
+                    for u in plan.changed_updates[:SYNC_PREVIEW_ROWS]],
+        'deletes': plan.deletes[:SYNC_PREVIEW_ROWS],
+    }
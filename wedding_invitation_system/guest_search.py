@@ -0,0 +1,222 @@
+"""
+Full-text search over guests (name, phone, notes, group).
+
+Documents are normalised before they are indexed, and queries go through the
+same normalisation, so a search matches regardless of:
+  * niqqud / cantillation marks (דָּוִד == דוד)
+  * final letters (ך/ם/ן/ף/ץ are indexed as כ/מ/נ/פ/צ, so a name typed
+    without its final form, or cut mid-word, still matches)
+  * phone formatting: phones are indexed as digits only, both in the stored
+    form and in the local 0XX form (972521234567 and 0521234567)
+
+SQLite uses an FTS5 table with the trigram tokenizer (substring matching,
+bm25 ranking). Postgres uses a plain table with a pg_trgm GIN index. The
+index lives in its own table, keyed by guest id, and is kept in sync by
+the session hooks in app.py through ``index_guests`` / ``remove_guests`` /
+``rebuild``.
+"""
+
+import re
+import unicodedata
+from typing import Iterable, List, Sequence, Tuple
+
+from sqlalchemy import text
+
+import phones
+
+SEARCH_ATTRS = ('name', 'phone', 'notes', 'group_affiliation')
+
+# טעמים וניקוד (U+0591-U+05C7) חוץ ממקף עליון וסימני פיסוק
+_NIQQUD_RE = re.compile('[\u0591-\u05BD\u05BF\u05C1\u05C2\u05C4\u05C5\u05C7]')
+_FINAL_LETTERS = str.maketrans({'ך': 'כ', 'ם': 'מ', 'ן': 'נ', 'ף': 'פ', 'ץ': 'צ'})
+# גרש/גרשיים ומירכאות נמחקים ("צ'ארלי" == "צארלי"); שאר הפיסוק הופך לרווח
+_DROP_RE = re.compile('[\'"`\u05F3\u05F4\u2018\u2019\u201C\u201D]')
+_PUNCT_RE = re.compile(r'[^\w]+')
+_PHONE_QUERY_RE = re.compile(r'^[\d\s()+\-.]+$')
+
+SQLITE_TABLE = 'guest_search_fts'
+POSTGRES_TABLE = 'guest_search'
+MIN_TRIGRAM_LENGTH = 3
+# מעל מספר התאמות זה לא מדרגים ב-bm25 (עלות לינארית במספר ההתאמות)
+RANK_MAX_HITS = 1000
+
+
+def normalize_text(value) -> str:
+    """טקסט מנורמל לאינדקס ולשאילתה: בלי ניקוד, בלי אותיות סופיות, אותיות קטנות"""
+    if not value:
+        return ''
+    value = unicodedata.normalize('NFC', str(value))
+    value = _NIQQUD_RE.sub('', value)
+    value = value.translate(_FINAL_LETTERS).lower()
+    value = _DROP_RE.sub('', value)
+    value = _PUNCT_RE.sub(' ', value).replace('_', ' ')
+    return ' '.join(value.split())
+
+
+def phone_forms(phone) -> str:
+    """ספרות בלבד, גם בצורה הבינלאומית וגם בצורה המקומית (0...)"""
+    forms = (phones.digits(phone), phones.to_e164(phone), phones.local_form(phone))
+    return ' '.join(dict.fromkeys(f for f in forms if f))
+
+
+def search_terms(query: str) -> List[str]:
+    """מילות החיפוש; שאילתה שנראית כמו טלפון הופכת למחרוזת ספרות אחת"""
+    if query and _PHONE_QUERY_RE.match(query) and re.search(r'\d', query):
+        digits = re.sub(r'\D', '', query)
+        if digits.startswith('972') and len(digits) > 3:
+            digits = digits[3:]
+        elif digits.startswith('0'):
+            digits = digits[1:]
+        return [digits] if digits else []
+    return normalize_text(query).split()
+
+
+def _document(row: Sequence) -> Tuple:
+    guest_id, name, phone, notes, group = row
+    return guest_id, normalize_text(name), phone_forms(phone), normalize_text(notes), normalize_text(group)
+
+
+def _is_postgres(conn) -> bool:
+    return conn.dialect.name == 'postgresql'
+
+
+def ensure_schema(conn) -> bool:
+    """יוצר את טבלת האינדקס אם חסרה. מחזיר True אם נוצרה (וצריך rebuild)."""
+    if _is_postgres(conn):
+        exists = conn.execute(text("SELECT to_regclass(:t)"), {'t': POSTGRES_TABLE}).scalar()
+        if exists:
+            return False
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        conn.execute(text(
+            f"CREATE TABLE {POSTGRES_TABLE} ("
+            " guest_id INTEGER PRIMARY KEY, name TEXT, phone TEXT, notes TEXT, grp TEXT, document TEXT)"
+        ))
+        conn.execute(text(
+            f"CREATE INDEX ix_{POSTGRES_TABLE}_document ON {POSTGRES_TABLE} USING gin (document gin_trgm_ops)"
+        ))
+        return True
+    exists = conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE name = :t"), {'t': SQLITE_TABLE}
+    ).first()
+    if exists:
+        return False
+    conn.execute(text(
+        f"CREATE VIRTUAL TABLE {SQLITE_TABLE} USING fts5(name, phone, notes, grp, tokenize='trigram')"
+    ))
+    return True
+
+
+def remove_guests(conn, guest_ids: Iterable[int]):
+    ids = [{'id': i} for i in guest_ids]
+    if not ids:
+        return
+    if _is_postgres(conn):
+        conn.execute(text(f"DELETE FROM {POSTGRES_TABLE} WHERE guest_id = :id"), ids)
+    else:
+        conn.execute(text(f"DELETE FROM {SQLITE_TABLE} WHERE rowid = :id"), ids)
+
+
+def index_guests(conn, rows: Iterable[Sequence]):
+    """rows: (id, name, phone, notes, group_affiliation) - מחליף את המסמכים הקיימים של האורחים"""
+    docs = [_document(row) for row in rows]
+    if not docs:
+        return
+    remove_guests(conn, [d[0] for d in docs])
+    params = [{'id': d[0], 'name': d[1], 'phone': d[2], 'notes': d[3], 'grp': d[4]} for d in docs]
+    if _is_postgres(conn):
+        for p in params:
+            p['document'] = ' '.join(v for v in (p['name'], p['phone'], p['notes'], p['grp']) if v)
+        conn.execute(text(
+            f"INSERT INTO {POSTGRES_TABLE} (guest_id, name, phone, notes, grp, document)"
+            " VALUES (:id, :name, :phone, :notes, :grp, :document)"
+        ), params)
+    else:
+        conn.execute(text(
+            f"INSERT INTO {SQLITE_TABLE} (rowid, name, phone, notes, grp) VALUES (:id, :name, :phone, :notes, :grp)"
+        ), params)
+
+
+def rebuild(conn, rows: Iterable[Sequence], batch_size: int = 1000):
+    """בנייה מחדש של כל האינדקס (אחרי פעולות bulk או כשהטבלה נוצרה זה עתה)"""
+    table = POSTGRES_TABLE if _is_postgres(conn) else SQLITE_TABLE
+    conn.execute(text(f"DELETE FROM {table}"))
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            index_guests(conn, batch)
+            batch = []
+    index_guests(conn, batch)
+
+
+def _like_pattern(term: str) -> str:
+    return '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def _fts_phrase(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _name_hits_first(conn, name_where: str, where: str, params: dict, limit: int) -> List[Tuple[int, float]]:
+    """התאמות בשם (ציון 1) ואחריהן שאר ההתאמות (ציון 0), בלי ORDER BY - ה-LIMIT עוצר את הסריקה"""
+    rows = conn.execute(text(f"SELECT rowid FROM {SQLITE_TABLE} WHERE {name_where} LIMIT :limit"), params)
+    results = [(r[0], 1.0) for r in rows]
+    if len(results) < limit:
+        seen = {r[0] for r in results}
+        rest = conn.execute(text(f"SELECT rowid FROM {SQLITE_TABLE} WHERE {where} LIMIT :limit"),
+                            {**params, 'limit': limit + len(seen)})
+        results += [(r[0], 0.0) for r in rest if r[0] not in seen][:limit - len(results)]
+    return results
+
+
+def search(conn, query: str, limit: int = 20) -> List[Tuple[int, float]]:
+    """[(guest_id, score)] מהטוב לגרוע. ציון גבוה = התאמה טובה יותר."""
+    terms = search_terms(query)
+    if not terms:
+        return []
+    if _is_postgres(conn):
+        params = {'q': ' '.join(terms), 'limit': limit}
+        where = []
+        for i, term in enumerate(terms):
+            params[f't{i}'] = _like_pattern(term)
+            where.append(f"document LIKE :t{i} ESCAPE '\\'")
+        rows = conn.execute(text(
+            f"SELECT guest_id, word_similarity(:q, name) * 2 + similarity(document, :q) AS score"
+            f" FROM {POSTGRES_TABLE} WHERE {' AND '.join(where)}"
+            " ORDER BY score DESC, guest_id LIMIT :limit"
+        ), params)
+        return [(r[0], float(r[1])) for r in rows]
+
+    long_terms = [t for t in terms if len(t) >= MIN_TRIGRAM_LENGTH]
+    # trigram לא מכסה מחרוזות של 1-2 תווים - הן מסננות בעזרת LIKE על השורות שנמצאו
+    params = {'limit': limit}
+    like = []
+    for i, term in enumerate(t for t in terms if len(t) < MIN_TRIGRAM_LENGTH):
+        params[f't{i}'] = _like_pattern(term)
+        like.append(f"(name || ' ' || phone || ' ' || notes || ' ' || grp) LIKE :t{i} ESCAPE '\\'")
+
+    if not long_terms:
+        # אין מה לחפש באינדקס - סריקה של טבלת האינדקס (קטנה ומנורמלת). קודם שמות שמתחילים
+        # במחרוזת, ובלי ORDER BY כדי שה-LIMIT יעצור את הסריקה מוקדם
+        params['prefix'] = params['t0'][1:]
+        return _name_hits_first(
+            conn, f"name LIKE :prefix ESCAPE '\\' AND {' AND '.join(like)}", ' AND '.join(like), params, limit)
+
+    match = ' '.join(_fts_phrase(t) for t in long_terms)
+    where = ' AND '.join([f"{SQLITE_TABLE} MATCH :match"] + like)
+    params['match'] = match
+    # ספירה על האינדקס בלבד (בלי ה-LIKE) - חסם עליון זול למספר ההתאמות
+    hits = conn.execute(text(f"SELECT count(*) FROM {SQLITE_TABLE} WHERE {SQLITE_TABLE} MATCH :match"),
+                        {'match': match}).scalar()
+    if hits <= RANK_MAX_HITS:
+        rows = conn.execute(text(
+            f"SELECT rowid, bm25({SQLITE_TABLE}, 10.0, 5.0, 1.0, 2.0) AS rank FROM {SQLITE_TABLE}"
+            f" WHERE {where} ORDER BY rank, rowid LIMIT :limit"
+        ), params)
+        return [(r[0], -float(r[1])) for r in rows]
+
+    # שאילתה לא סלקטיבית (אלפי התאמות): bm25 על כולן יקר ולא מבדיל ביניהן,
+    # אז מחזירים קודם התאמות בשם ואחריהן את השאר, לפי סדר ההוספה
+    params['name_match'] = f'name : ({match})'
+    name_where = ' AND '.join([f"{SQLITE_TABLE} MATCH :name_match"] + like)
+    return _name_hits_first(conn, name_where, where, params, limit)
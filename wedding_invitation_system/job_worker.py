@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Worker למשימות רקע (ייבוא, ייצוא, הפעלת הבוט) - תהליך נפרד מה-web.
+ברירת המחדל היא thread בתוך תהליך ה-web; להרצת worker נפרד מגדירים
+JOB_WORKER_EMBEDDED=0 לתהליך ה-web ומריצים על אותה מכונה (קבצי ההעלאה נשמרים בדיסק המקומי):
+    python job_worker.py                       # לולאה עד Ctrl+C
+    python job_worker.py --workers 3           # כמה threads (עדיין משימה רצה אחת לכל סוג)
+    python job_worker.py --kinds import,export # רק סוגים מסוימים
+    python job_worker.py --once                # מריץ את מה שבתור ויוצא
+"""
+
+import argparse
+import os
+import sys
+import threading
+
+# ה-worker הזה מחליף את ה-thread המובנה - לא להריץ את שניהם מתוך אותו תהליך
+os.environ['JOB_WORKER_EMBEDDED'] = '0'
+
+from app import app, job_queue, JOB_HANDLERS, cleanup_job_files  # noqa: E402
+import jobs  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--kinds', default='', help='comma separated job kinds (default: all)')
+    parser.add_argument('--poll', type=float, default=float(os.getenv('JOB_POLL_INTERVAL', '1.0')))
+    parser.add_argument('--once', action='store_true', help='run the queued jobs and exit')
+    args = parser.parse_args()
+
+    kinds = [k for k in args.kinds.split(',') if k] or None
+    unknown = set(kinds or ()) - set(JOB_HANDLERS)
+    if unknown:
+        print(f"❌ סוגי משימות לא מוכרים: {', '.join(sorted(unknown))}")
+        sys.exit(1)
+
+    def make_worker():
+        return jobs.JobWorker(job_queue, JOB_HANDLERS, context_factory=app.app_context,
+                              poll_interval=args.poll, kinds=kinds, housekeeping=cleanup_job_files)
+
+    if args.once:
+        worker = make_worker()
+        ran = 0
+        while worker.run_once():
+            ran += 1
+        print(f"✅ הורצו {ran} משימות")
+        return
+
+    print(f"⚙️ job worker: {args.workers} threads, kinds={','.join(kinds or JOB_HANDLERS)}")
+    stop = threading.Event()
+    threads = [threading.Thread(target=make_worker().run_forever, args=(stop,), name=f'job-worker-{i}')
+               for i in range(args.workers)]
+    for t in threads:
+        t.start()
+    try:
+        for t in threads:
+            while t.is_alive():
+                t.join(1)
+    except KeyboardInterrupt:
+        # משימה שרצה כרגע ממשיכה עד שמסתיימת; worker שנהרג באמצע יסומן failed אחרי JOB_STALE_SECONDS
+        print("🛑 עוצר אחרי המשימות הנוכחיות...")
+        stop.set()
+        for t in threads:
+            t.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+"""
+Durable background jobs (imports, exports, WhatsApp bot runs).
+
+A job is a row in the ``job`` table, so it survives restarts and any process
+can report on it. The web request only enqueues the job and returns its id;
+the work itself runs in a worker - a ``JobWorker`` thread inside the web
+process (default) or the standalone ``job_worker.py`` process.
+
+Concurrency rules:
+  * claiming is a single conditional UPDATE (``status = 'queued'`` and no
+    running job of the same kind), so several workers can poll the same
+    table; a partial unique index on ``kind WHERE status = 'running'`` is
+    the backstop for the race between two claims on Postgres;
+  * only one job of each kind runs at a time, later ones wait in the queue;
+  * a running job updates ``heartbeat_at`` while it reports progress - a job
+    whose worker died (no heartbeat for ``stale_seconds``) is marked failed.
+
+Cancellation: a queued job is cancelled at once; a running job gets
+``cancel_requested`` and its handler stops at the next ``ctx.progress()``
+(which raises ``JobCancelled``).
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+from datetime import timedelta
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import exists, select
+from sqlalchemy.exc import IntegrityError
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+PROGRESS_INTERVAL = 0.5  # שניות בין עדכוני התקדמות (עדכון סופי תמיד נכתב)
+
+
+class JobCancelled(Exception):
+    """Raised inside a handler once cancellation of its job was requested."""
+
+
+class JobContext:
+    """What a handler gets: its job id and params, and progress reporting."""
+
+    def __init__(self, queue: 'JobQueue', job_id: int, params: dict):
+        self.queue = queue
+        self.job_id = job_id
+        self.params = params
+        self._last_write = 0.0
+
+    def progress(self, done: Optional[int] = None, total: Optional[int] = None,
+                 message: Optional[str] = None, force: bool = False):
+        """עדכון התקדמות + heartbeat; זורק JobCancelled אם התבקש ביטול.
+        ב-SQLite לקרוא לזה בין טרנזקציות של ה-handler (החיבור כאן נפרד)."""
+        now = time.monotonic()
+        if not force and now - self._last_write < PROGRESS_INTERVAL:
+            return
+        self._last_write = now
+        if self.queue.report(self.job_id, done, total, message):
+            raise JobCancelled()
+
+    def heartbeat(self, message: Optional[str] = None):
+        self.progress(message=message)
+
+
+class JobQueue:
+    """Operations on the job table (a Core ``Table``) through its own connections."""
+
+    def __init__(self, engine, table, clock: Callable, stale_seconds: int = 120):
+        self.engine = engine
+        self.table = table
+        self.clock = clock
+        self.stale_seconds = stale_seconds
+
+    def enqueue(self, kind: str, params: Optional[dict] = None) -> int:
+        t = self.table
+        with self.engine.begin() as conn:
+            return conn.execute(t.insert().values(
+                kind=kind, status=QUEUED, params=_dump_params(params),
+                progress=0, cancel_requested=False, created_at=self.clock(),
+            )).inserted_primary_key[0]
+
+    def get(self, job_id: int):
+        with self.engine.connect() as conn:
+            return conn.execute(select(self.table).where(self.table.c.id == job_id)).mappings().first()
+
+    def active(self, kind: str, params: Optional[dict] = None):
+        """המשימה הפעילה (רצה או בתור) הוותיקה ביותר מסוג זה (ועם אותם params, אם ניתנו)"""
+        t = self.table
+        query = select(t).where(t.c.kind == kind, t.c.status.in_(ACTIVE_STATUSES))
+        if params is not None:
+            query = query.where(t.c.params == _dump_params(params))
+        with self.engine.connect() as conn:
+            return conn.execute(query.order_by(t.c.id).limit(1)).mappings().first()
+
+    def cancel(self, job_id: int) -> Optional[str]:
+        """ביטול: משימה בתור מבוטלת מיד, משימה רצה מסומנת ותיעצר ב-progress הבא"""
+        t = self.table
+        with self.engine.begin() as conn:
+            conn.execute(t.update().where(t.c.id == job_id, t.c.status == QUEUED)
+                         .values(status=CANCELLED, finished_at=self.clock()))
+            conn.execute(t.update().where(t.c.id == job_id, t.c.status == RUNNING)
+                         .values(cancel_requested=True))
+            return conn.execute(select(t.c.status).where(t.c.id == job_id)).scalar()
+
+    def claim(self, worker: str, kinds=None):
+        """לוקח את המשימה הוותיקה בתור שאין משימה רצה מהסוג שלה. None אם אין."""
+        t = self.table
+        other = t.alias('running_job')
+        with self.engine.connect() as conn:
+            query = select(t.c.id, t.c.kind).where(t.c.status == QUEUED).order_by(t.c.id).limit(20)
+            if kinds:
+                query = query.where(t.c.kind.in_(kinds))
+            candidates = conn.execute(query).all()
+        for job_id, kind in candidates:
+            now = self.clock()
+            busy = exists(select(other.c.id).where(other.c.kind == kind, other.c.status == RUNNING))
+            try:
+                with self.engine.begin() as conn:
+                    claimed = conn.execute(
+                        t.update().where(t.c.id == job_id, t.c.status == QUEUED, ~busy)
+                        .values(status=RUNNING, worker=worker, started_at=now, heartbeat_at=now)
+                    ).rowcount
+            except IntegrityError:
+                continue  # worker אחר התחיל משימה מאותו סוג באותו רגע
+            if claimed:
+                return self.get(job_id)
+        return None
+
+    def report(self, job_id: int, done=None, total=None, message=None) -> bool:
+        """כותב התקדמות ו-heartbeat; מחזיר True אם התבקש ביטול"""
+        t = self.table
+        values = {'heartbeat_at': self.clock()}
+        if done is not None:
+            values['progress'] = done
+        if total is not None:
+            values['total'] = total
+        if message is not None:
+            values['message'] = message[:500]
+        with self.engine.begin() as conn:
+            conn.execute(t.update().where(t.c.id == job_id, t.c.status == RUNNING).values(**values))
+            return bool(conn.execute(select(t.c.cancel_requested).where(t.c.id == job_id)).scalar())
+
+    def finish(self, job_id: int, status: str, result=None, error: Optional[str] = None):
+        t = self.table
+        values = {'status': status, 'finished_at': self.clock(), 'error': error}
+        if result is not None:
+            values['result'] = json.dumps(result, ensure_ascii=False, default=str)
+        with self.engine.begin() as conn:
+            conn.execute(t.update().where(t.c.id == job_id, t.c.status == RUNNING).values(**values))
+
+    def reap_stale(self) -> int:
+        """משימות רצות בלי heartbeat מעל stale_seconds - ה-worker שלהן מת"""
+        t = self.table
+        now = self.clock()
+        cutoff = now - timedelta(seconds=self.stale_seconds)
+        with self.engine.begin() as conn:
+            stale = [r.id for r in conn.execute(select(t.c.id, t.c.heartbeat_at).where(t.c.status == RUNNING))
+                     if r.heartbeat_at is None or r.heartbeat_at < _like(cutoff, r.heartbeat_at)]
+            if stale:
+                conn.execute(t.update().where(t.c.id.in_(stale), t.c.status == RUNNING).values(
+                    status=FAILED, finished_at=now, error='worker stopped (no heartbeat)'))
+        return len(stale)
+
+
+def _dump_params(params):
+    return json.dumps(params or {}, ensure_ascii=False, sort_keys=True)
+
+
+def _like(value, other):
+    # SQLite מחזיר datetime נאיבי (שעון מקומי) - משווים בלי אזור הזמן
+    return value.replace(tzinfo=None) if other.tzinfo is None else value
+
+
+class JobWorker:
+    """Claims and runs jobs; a background thread in the web process or the main loop of job_worker.py."""
+
+    def __init__(self, queue: JobQueue, handlers: Dict[str, Callable], context_factory=None,
+                 poll_interval: float = 1.0, kinds=None, housekeeping: Optional[Callable] = None,
+                 housekeeping_every: float = 60.0):
+        self.queue = queue
+        self.handlers = handlers
+        self.context_factory = context_factory
+        self.poll_interval = poll_interval
+        self.kinds = kinds
+        self.housekeeping = housekeeping
+        self.housekeeping_every = housekeeping_every
+        self._last_housekeeping = 0.0
+        self._thread = None
+        self._pid = None
+        self._wake = threading.Event()
+        self._start_lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return f'{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}'
+
+    def run_once(self) -> bool:
+        """מריץ משימה אחת אם יש. מחזיר True אם רצה משימה."""
+        if time.monotonic() - self._last_housekeeping >= self.housekeeping_every:
+            self._last_housekeeping = time.monotonic()
+            self.queue.reap_stale()
+            if self.housekeeping:
+                self.housekeeping()
+        job = self.queue.claim(self.name, self.kinds or list(self.handlers))
+        if job is None:
+            return False
+        self._run(job)
+        return True
+
+    def _run(self, job):
+        ctx = JobContext(self.queue, job['id'], json.loads(job['params'] or '{}'))
+        handler = self.handlers.get(job['kind'])
+        print(f"⚙️ job {job['id']} ({job['kind']}) started")
+        started = time.perf_counter()
+        try:
+            if handler is None:
+                raise ValueError(f"unknown job kind: {job['kind']}")
+            if self.context_factory:
+                with self.context_factory():
+                    result = handler(ctx, ctx.params)
+            else:
+                result = handler(ctx, ctx.params)
+        except JobCancelled:
+            self.queue.finish(job['id'], CANCELLED)
+            print(f"🛑 job {job['id']} cancelled")
+        except Exception as e:
+            self.queue.finish(job['id'], FAILED, error=str(e))
+            print(f"❌ job {job['id']} failed: {e}")
+        else:
+            self.queue.finish(job['id'], DONE, result=result)
+            print(f"✅ job {job['id']} done in {time.perf_counter() - started:.1f}s")
+
+    def run_forever(self, stop: Optional[threading.Event] = None):
+        while stop is None or not stop.is_set():
+            try:
+                if self.run_once():
+                    continue
+            except Exception as e:
+                print(f"⚠️ job worker error: {e}")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def ensure_running(self):
+        # after a gunicorn fork the thread object survives but the thread does not
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self.run_forever, name='job-worker', daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        self._wake.set()
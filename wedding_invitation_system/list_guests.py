@@ -1,11 +1,12 @@
-from app import app, Guest
+from itertools import islice
+
+from app import app, iter_guest_rows
 
 with app.app_context():
-    guests = Guest.query.limit(10).all()
-    if not guests:
+    rows = list(islice(iter_guest_rows(('id', 'name', 'phone', 'message_sent', 'unique_token')), 10))
+    if not rows:
         print("No guests found in DB")
     else:
         print("id\tname\tphone\tmessage_sent\ttoken")
-        for g in guests:
-            token = getattr(g, 'token', None) or getattr(g, 'unique_token', None)
-            print(f"{g.id}\t{g.name}\t{g.phone}\t{getattr(g, 'message_sent', None)}\t{token}")
+        for g in rows:
+            print(f"{g['id']}\t{g['name']}\t{g['phone']}\t{g['message_sent']}\t{g['unique_token']}")
@@ -1,68 +1,66 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-מיגרציה למסד הנתונים - הוספת שדות חדשים
+מיגרציה למסד הנתונים - מריץ את השלבים של migrations.py שעוד לא הורצו.
+רץ בזמן deploy (לפני שה-workers עולים):
+    python migrate_db.py                 # כל השלבים
+    python migrate_db.py --to 5          # עד שלב מסוים
+    python migrate_db.py status          # אילו שלבים הורצו
+    python migrate_db.py issue_tokens    # מיגרציה + הנפקת טוקנים חתומים
 """
 
-from app import app, db, Guest
+from app import app, db, Guest, issue_guest_token, run_migrations
+from tokens import is_legacy_token
+import migrations
 import sys
 
-def migrate_database():
-    """הוסף שדות חדשים למסד הנתונים"""
+def migrate_database(target=None):
+    """מריץ את כל המיגרציות שעוד לא הורצו (ראו migrations.py)"""
+    try:
+        print("🔄 מתחיל מיגרציה למסד הנתונים...")
+        applied = run_migrations(target=target)
+        total_ms = sum(ms for _, _, ms in applied)
+        print(f"✅ מיגרציה הושלמה בהצלחה! ({len(applied)} שלבים, {total_ms}ms)")
+    except Exception as e:
+        print(f"❌ שגיאה במיגרציה: {str(e)}")
+        sys.exit(1)
+
+def show_status():
+    with app.app_context():
+        with db.engine.connect() as conn:
+            done = migrations.applied_versions(conn)
+    for m in migrations.MIGRATIONS:
+        print(f"{'✅' if m.version in done else '⏳'} {m.version:>3} {m.name}")
+
+def issue_signed_tokens(batch_size=500):
+    """מעביר טוקני UUID ישנים ל-legacy_token ומנפיק טוקנים חתומים.
+    קישורים שכבר נשלחו ממשיכים לעבוד דרך legacy_token."""
     with app.app_context():
         try:
-            print("🔄 מתחיל מיגרציה למסד הנתונים...")
-            
-            # בדיקה אם השדות החדשים כבר קיימים
-            inspector = db.inspect(db.engine)
-            columns = [col['name'] for col in inspector.get_columns('guest')]
-            
-            new_columns = [
-                'email', 'group_affiliation', 'side', 'attendance_status', 
-                'estimated_gift_amount', 'added_by'
-            ]
-            
-            missing_columns = [col for col in new_columns if col not in columns]
-            
-            if not missing_columns:
-                print("✅ כל השדות כבר קיימים במסד הנתונים")
-                return
-            
-            print(f"📝 מוסיף שדות חסרים: {', '.join(missing_columns)}")
-            
-            # הוספת שדות חדשים
-            with db.engine.connect() as conn:
-                if 'email' in missing_columns:
-                    conn.execute(db.text("ALTER TABLE guest ADD COLUMN email VARCHAR(100)"))
-                    print("✅ הוסף שדה email")
-                
-                if 'group_affiliation' in missing_columns:
-                    conn.execute(db.text("ALTER TABLE guest ADD COLUMN group_affiliation VARCHAR(100)"))
-                    print("✅ הוסף שדה group_affiliation")
-                
-                if 'side' in missing_columns:
-                    conn.execute(db.text("ALTER TABLE guest ADD COLUMN side VARCHAR(50)"))
-                    print("✅ הוסף שדה side")
-                
-                if 'attendance_status' in missing_columns:
-                    conn.execute(db.text("ALTER TABLE guest ADD COLUMN attendance_status VARCHAR(20) DEFAULT 'ממתין'"))
-                    print("✅ הוסף שדה attendance_status")
-                
-                if 'estimated_gift_amount' in missing_columns:
-                    conn.execute(db.text("ALTER TABLE guest ADD COLUMN estimated_gift_amount FLOAT DEFAULT 0.0"))
-                    print("✅ הוסף שדה estimated_gift_amount")
-                
-                if 'added_by' in missing_columns:
-                    conn.execute(db.text("ALTER TABLE guest ADD COLUMN added_by VARCHAR(20)"))
-                    print("✅ הוסף שדה added_by")
-                
-                conn.commit()
-            
-            print("✅ מיגרציה הושלמה בהצלחה!")
-            
+            guests = Guest.query.order_by(Guest.id).all()
+            converted = 0
+            for guest in guests:
+                if not is_legacy_token(guest.unique_token):
+                    continue
+                if not guest.legacy_token:
+                    guest.legacy_token = guest.unique_token
+                issue_guest_token(guest)
+                converted += 1
+                if converted % batch_size == 0:
+                    db.session.commit()
+            db.session.commit()
+            print(f"✅ הונפקו טוקנים חתומים ל-{converted} אורחים")
         except Exception as e:
-            print(f"❌ שגיאה במיגרציה: {str(e)}")
+            db.session.rollback()
+            print(f"❌ שגיאה בהנפקת טוקנים: {str(e)}")
             sys.exit(1)
 
 if __name__ == '__main__':
-    migrate_database()
\ No newline at end of file
+    args = sys.argv[1:]
+    if 'status' in args:
+        show_status()
+        sys.exit(0)
+    target = int(args[args.index('--to') + 1]) if '--to' in args else None
+    migrate_database(target)
+    if 'issue_tokens' in args:
+        issue_signed_tokens()
@@ -0,0 +1,307 @@
+"""
+Versioned schema migrations.
+
+Every schema change is a numbered step in ``MIGRATIONS``. Applied steps are
+recorded in the ``schema_version`` table (with their duration), so each one
+runs exactly once per database. Steps are written to be idempotent: a
+database created by an older ``db.create_all()`` may already have some of the
+columns and indexes, in which case the step simply finds nothing to do.
+
+Concurrency: the whole run holds a lock, so two workers (or two deploys)
+starting together cannot race - the second one waits and then finds every
+step already applied.
+  * Postgres: ``pg_advisory_lock``. Steps run in their own transaction,
+    except index builds, which use ``CREATE INDEX CONCURRENTLY`` so the table
+    stays writable while they build.
+  * SQLite: the run is one ``BEGIN IMMEDIATE`` transaction (SQLite DDL is
+    transactional), which is both the lock and all-or-nothing.
+
+Migrations run at deploy time (``python migrate_db.py``), not on import.
+"""
+
+import time
+from contextlib import contextmanager
+from typing import Callable, List, NamedTuple
+
+from sqlalchemy import text
+
+import guest_search
+import phones
+
+SCHEMA_TABLE = 'schema_version'
+LOCK_KEY = 0x5745444449  # ״WEDDI״ - מפתח קבוע ל-pg_advisory_lock
+SQLITE_LOCK_TIMEOUT_MS = 10 * 60 * 1000  # כמה זמן worker ממתין למיגרציה שרצה במקביל
+BACKFILL_BATCH = 1000  # שורות לכל executemany במילוי עמודה חדשה
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    fn: Callable
+    transactional: bool
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, name: str, transactional: bool = True):
+    """רישום שלב מיגרציה. transactional=False לשלבים שחייבים לרוץ מחוץ לטרנזקציה (CONCURRENTLY)"""
+    def register(fn):
+        assert all(m.version != version for m in MIGRATIONS), f'duplicate migration {version}'
+        MIGRATIONS.append(Migration(version, name, fn, transactional))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return fn
+    return register
+
+
+class MigrationContext:
+    """Helpers for writing steps that work on both SQLite and Postgres."""
+
+    def __init__(self, conn, metadata):
+        self.conn = conn
+        self.metadata = metadata
+        self.postgres = conn.dialect.name == 'postgresql'
+
+    def execute(self, sql, params=None):
+        return self.conn.execute(text(sql), params or {})
+
+    def columns(self, table):
+        if self.postgres:
+            rows = self.execute(
+                "SELECT column_name FROM information_schema.columns"
+                " WHERE table_schema = current_schema() AND table_name = :t", {'t': table})
+        else:
+            rows = self.conn.exec_driver_sql(f'PRAGMA table_info("{table}")')
+            return {r[1] for r in rows}
+        return {r[0] for r in rows}
+
+    def has_table(self, table):
+        if self.postgres:
+            return self.execute("SELECT to_regclass(:t)", {'t': table}).scalar() is not None
+        return self.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :t", {'t': table}).first() is not None
+
+    def add_column(self, table, column, ddl, backfill=None):
+        """ALTER TABLE ADD COLUMN אם העמודה חסרה; backfill - UPDATE שרץ רק כשהעמודה נוספה עכשיו"""
+        if column in self.columns(table):
+            return False
+        self.execute(f'ALTER TABLE "{table}" ADD COLUMN {column} {ddl}')
+        if backfill:
+            self.execute(backfill)
+        return True
+
+    def create_index(self, name, table, columns, unique=False):
+        """ב-Postgres: CONCURRENTLY (השלב חייב להיות transactional=False); אינדקס שנשאר INVALID
+        מבנייה שנכשלה נמחק ונבנה מחדש"""
+        unique_sql = 'UNIQUE ' if unique else ''
+        if self.postgres:
+            valid = self.execute(
+                "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid"
+                " WHERE c.relname = :n", {'n': name}).scalar()
+            if valid:
+                return False
+            if valid is False:
+                self.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+            self.execute(f'CREATE {unique_sql}INDEX CONCURRENTLY IF NOT EXISTS {name} ON "{table}" ({columns})')
+            return True
+        self.execute(f'CREATE {unique_sql}INDEX IF NOT EXISTS {name} ON "{table}" ({columns})')
+        return True
+
+
+# ====== השלבים ======
+# שלב שנוסף כאן לא משתנה אחרי שהגיע לפרודקשן - שינוי נוסף הוא שלב חדש עם מספר חדש.
+
+@migration(1, 'create missing tables')
+def _create_tables(ctx):
+    # מסד חדש מקבל כאן את כל הסכמה הנוכחית; במסד קיים נוצרות רק טבלאות חסרות
+    ctx.metadata.create_all(ctx.conn, checkfirst=True)
+
+
+@migration(2, 'guest contact and grouping columns')
+def _guest_details(ctx):
+    ctx.add_column('guest', 'email', 'VARCHAR(100)')
+    ctx.add_column('guest', 'group_affiliation', 'VARCHAR(100)')
+    ctx.add_column('guest', 'side', 'VARCHAR(50)')
+    ctx.add_column('guest', 'attendance_status', "VARCHAR(20) DEFAULT 'ממתין'")
+    ctx.add_column('guest', 'estimated_gift_amount', 'FLOAT DEFAULT 0.0')
+    ctx.add_column('guest', 'added_by', 'VARCHAR(20)')
+
+
+@migration(3, 'guest.legacy_token and guest.updated_at')
+def _guest_tokens(ctx):
+    ctx.add_column('guest', 'legacy_token', 'VARCHAR(36)')
+    timestamp = 'TIMESTAMP' if ctx.postgres else 'DATETIME'
+    ctx.add_column('guest', 'updated_at', timestamp,
+                   backfill='UPDATE guest SET updated_at = COALESCE(response_date, created_at)')
+
+
+@migration(4, 'drop stray seating columns from message_log')
+def _message_log_cleanup(ctx):
+    # גרסה ישנה של המודל הכילה בטעות את עמודות Table (table_number NOT NULL) - כל INSERT נכשל
+    stray = {'table_number', 'capacity', 'description'} & ctx.columns('message_log')
+    if not stray:
+        return
+    if ctx.postgres:
+        ctx.execute('ALTER TABLE message_log ' + ', '.join(f'DROP COLUMN {c}' for c in sorted(stray)))
+        return
+    # SQLite לא יודע להסיר עמודה עם UNIQUE - בונים את הטבלה מחדש
+    ctx.execute('ALTER TABLE message_log RENAME TO message_log_old')
+    for index in ('ix_message_log_guest_id', 'ix_message_log_created_at'):
+        ctx.execute(f'DROP INDEX IF EXISTS {index}')
+    ctx.metadata.tables['message_log'].create(ctx.conn)
+    ctx.execute('INSERT INTO message_log (id, guest_id, status, error, created_at)'
+                ' SELECT id, guest_id, status, error, created_at FROM message_log_old')
+    ctx.execute('DROP TABLE message_log_old')
+
+
+@migration(5, 'data version row')
+def _data_version_row(ctx):
+    if ctx.execute('SELECT 1 FROM data_version WHERE id = 1').first() is None:
+        ctx.execute('INSERT INTO data_version (id, version) VALUES (1, 0)')
+
+
+@migration(6, 'guest search index')
+def _guest_search(ctx):
+    if guest_search.ensure_schema(ctx.conn):
+        rows = ctx.execute('SELECT id, name, phone, notes, group_affiliation FROM guest').all()
+        guest_search.rebuild(ctx.conn, rows)
+
+
+@migration(7, 'indexes for admin list, guest stream and hot filters', transactional=False)
+def _hot_indexes(ctx):
+    ctx.create_index('ix_guest_legacy_token', 'guest', 'legacy_token')
+    ctx.create_index('ix_guest_name', 'guest', 'name')
+    ctx.create_index('ix_guest_side', 'guest', 'side')
+    ctx.create_index('ix_guest_group_affiliation', 'guest', 'group_affiliation')
+    ctx.create_index('ix_guest_updated_at', 'guest', 'updated_at')
+    ctx.create_index('ix_guest_phone', 'guest', 'phone')
+    ctx.create_index('ix_guest_table_number', 'guest', 'table_number')
+    ctx.create_index('ix_guest_message_sent_response', 'guest', 'message_sent, response_date')
+    ctx.create_index('ix_guest_attending_response', 'guest', 'is_attending, response_date')
+    ctx.create_index('ix_guest_response_date', 'guest', 'response_date')
+    ctx.create_index('ix_message_log_status_guest', 'message_log', 'status, guest_id')
+
+
+@migration(8, 'background job table')
+def _job_table(ctx):
+    # טבלה חדשה (כולל האינדקס החלקי של משימה רצה אחת לכל סוג) - ריקה, אז אין צורך ב-CONCURRENTLY
+    ctx.metadata.tables['job'].create(ctx.conn, checkfirst=True)
+
+
+@migration(9, 'guest.import_hash for sheet sync', transactional=False)
+def _guest_import_hash(ctx):
+    ctx.add_column('guest', 'import_hash', 'VARCHAR(32)')
+    ctx.create_index('ix_guest_import_hash', 'guest', 'import_hash')
+
+
+@migration(10, 'guest.phone_e164 (canonical phone, unique)', transactional=False)
+def _guest_phone_e164(ctx):
+    ctx.add_column('guest', 'phone_e164', 'VARCHAR(20)')
+    # מילוי ב-Python (phones.to_e164 - אותו נרמול של האפליקציה). טלפון שכבר קיים אצל אורח ותיק
+    # יותר נשאר NULL, אחרת האינדקס הייחודי לא ייבנה - הכפילויות מדווחות לתיקון ידני
+    taken = {r[0] for r in ctx.execute('SELECT phone_e164 FROM guest WHERE phone_e164 IS NOT NULL')}
+    updates, duplicates = [], []
+    for guest_id, name, phone in ctx.execute('SELECT id, name, phone FROM guest WHERE phone_e164 IS NULL ORDER BY id'):
+        key = phones.to_e164(phone)
+        if key is None:
+            continue
+        if key in taken:
+            duplicates.append((guest_id, name, phone))
+            continue
+        taken.add(key)
+        updates.append({'id': guest_id, 'key': key})
+    for i in range(0, len(updates), BACKFILL_BATCH):
+        ctx.conn.execute(text('UPDATE guest SET phone_e164 = :key WHERE id = :id'), updates[i:i + BACKFILL_BATCH])
+    for guest_id, name, phone in duplicates:
+        print(f"⚠️ guest {guest_id} ({name}, {phone}): phone already belongs to another guest - left without phone_e164")
+    ctx.create_index('ix_guest_phone_e164', 'guest', 'phone_e164', unique=True)
+
+
+@migration(11, 'guest bot send leases')
+def _guest_bot_lease(ctx):
+    # עמודות nullable בלי אינדקס: שליפת הממתינים נשענת על ix_guest_message_sent_response והשאר לפי id
+    ctx.add_column('guest', 'bot_lease_owner', 'VARCHAR(32)')
+    ctx.add_column('guest', 'bot_lease_until', 'TIMESTAMP' if ctx.postgres else 'DATETIME')
+
+
+# ====== הרצה ======
+
+def _ensure_version_table(conn):
+    timestamp = 'TIMESTAMP' if conn.dialect.name == 'postgresql' else 'DATETIME'
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {SCHEMA_TABLE} ("
+        " version INTEGER PRIMARY KEY, name VARCHAR(200) NOT NULL,"
+        f" applied_at {timestamp} NOT NULL DEFAULT CURRENT_TIMESTAMP, duration_ms INTEGER)"
+    ))
+
+
+def applied_versions(conn):
+    if conn.dialect.name == 'postgresql':
+        exists = conn.execute(text("SELECT to_regclass(:t)"), {'t': SCHEMA_TABLE}).scalar()
+    else:
+        exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = :t"), {'t': SCHEMA_TABLE}).first()
+    if not exists:
+        return set()
+    return {r[0] for r in conn.execute(text(f"SELECT version FROM {SCHEMA_TABLE}"))}
+
+
+def pending_migrations(engine):
+    with engine.connect() as conn:
+        done = applied_versions(conn)
+    return [m for m in MIGRATIONS if m.version not in done]
+
+
+@contextmanager
+def _migration_lock(conn):
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text("SELECT pg_advisory_lock(:k)"), {'k': LOCK_KEY})
+        try:
+            yield
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:k)"), {'k': LOCK_KEY})
+        return
+    # SQLite: טרנזקציית כתיבה אחת לכל הריצה - worker שני ממתין כאן עד שהראשון מסיים
+    conn.exec_driver_sql(f'PRAGMA busy_timeout = {SQLITE_LOCK_TIMEOUT_MS}')
+    conn.exec_driver_sql('BEGIN IMMEDIATE')
+    try:
+        yield
+    except BaseException:
+        conn.exec_driver_sql('ROLLBACK')
+        raise
+    conn.exec_driver_sql('COMMIT')
+
+
+def migrate(engine, metadata, target=None, log=print):
+    """מריץ את כל השלבים שעוד לא הורצו (עד target אם ניתן). מחזיר [(version, name, ms)]."""
+    applied = []
+    # AUTOCOMMIT: הטרנזקציות מנוהלות כאן במפורש (CONCURRENTLY אסור בתוך טרנזקציה)
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        postgres = conn.dialect.name == 'postgresql'
+        with _migration_lock(conn):
+            _ensure_version_table(conn)
+            done = applied_versions(conn)
+            ctx = MigrationContext(conn, metadata)
+            for step in MIGRATIONS:
+                if step.version in done or (target is not None and step.version > target):
+                    continue
+                log(f"🔄 migration {step.version}: {step.name} ...")
+                started = time.perf_counter()
+                in_tx = postgres and step.transactional
+                if in_tx:
+                    conn.exec_driver_sql('BEGIN')
+                try:
+                    step.fn(ctx)
+                    duration_ms = int((time.perf_counter() - started) * 1000)
+                    conn.execute(text(
+                        f"INSERT INTO {SCHEMA_TABLE} (version, name, duration_ms) VALUES (:v, :n, :d)"
+                    ), {'v': step.version, 'n': step.name, 'd': duration_ms})
+                except BaseException:
+                    if in_tx:
+                        conn.exec_driver_sql('ROLLBACK')
+                    raise
+                if in_tx:
+                    conn.exec_driver_sql('COMMIT')
+                log(f"✅ migration {step.version} done in {duration_ms}ms")
+                applied.append((step.version, step.name, duration_ms))
+    if not applied:
+        log("✅ schema is up to date")
+    return applied
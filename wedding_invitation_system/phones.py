@@ -0,0 +1,67 @@
+"""
+Phone number normalisation - the one implementation shared by the web app,
+the guest import, the search index and both WhatsApp bots.
+
+``Guest.phone`` keeps the number as it was typed; ``Guest.phone_e164`` holds
+the canonical key: E.164 digits without the leading ``+`` (``972501234567``),
+which is also what WhatsApp links and the bot export expect. Every lookup by
+phone is an equality match on that (uniquely indexed) column, so
+``050-123-4567``, ``+972 50 1234567`` and ``501234567`` all find the same guest.
+
+No database or Flask imports here: the remote bot uses this module on its own.
+"""
+
+import re
+from typing import Optional
+
+# קידומת המדינה למספרים מקומיים (0501234567 / 501234567)
+COUNTRY_CODE = '972'
+# מספר מקומי בלי ה-0 המוביל (Excel מוחק אותו מתאים מספריים) - עד 9 ספרות
+LOCAL_MAX_DIGITS = 9
+# ייבוא: נייד ישראלי בלי 0 - אותו כלל שהייבוא תמיד הפעיל על הטלפון שנשמר
+MISSING_ZERO_PATTERN = r'5\d{9}'
+
+_NON_DIGITS = re.compile(r'\D')
+
+
+def _text(phone) -> str:
+    if phone is None:
+        return ''
+    if isinstance(phone, float):
+        # תא מספרי מ-Excel/pandas: 972501234567.0, או NaN לתא ריק
+        if phone != phone:
+            return ''
+        return str(int(phone)) if phone.is_integer() else str(phone)
+    return str(phone)
+
+
+def digits(phone) -> str:
+    """ספרות בלבד (None / NaN / מספר -> מחרוזת)"""
+    return _NON_DIGITS.sub('', _text(phone))
+
+
+def to_e164(phone, country_code: str = COUNTRY_CODE) -> Optional[str]:
+    """המפתח הקנוני: ספרות E.164 בלי '+'. None למספר בלי ספרות.
+        '+972 50-123-4567' / '00972501234567' / '0501234567' / '501234567' -> '972501234567'"""
+    text = _text(phone).strip()
+    number = digits(text)
+    if not number:
+        return None
+    if text.startswith('+'):
+        return number
+    if number.startswith('00'):
+        return number[2:] or None
+    if number.startswith('0'):
+        return country_code + number[1:]
+    if len(number) <= LOCAL_MAX_DIGITS and not number.startswith(country_code):
+        return country_code + number
+    return number
+
+
+def local_form(phone, country_code: str = COUNTRY_CODE) -> Optional[str]:
+    """הצורה המקומית (0501234567) של מספר מהמדינה; None למספר זר או ריק"""
+    e164 = to_e164(phone, country_code)
+    if e164 and e164.startswith(country_code) and len(e164) > len(country_code):
+        return '0' + e164[len(country_code):]
+    return None
+
@@ -0,0 +1,193 @@
+"""
+Shared cache for RSVP QR codes.
+
+The RSVP page and the printable invitation cards (get_links.py) both render a
+QR code for the same per-guest link. Rendering is CPU bound, so encoded images
+are kept in a small in-memory LRU and persisted on disk, which lets restarted
+gunicorn workers and the offline scripts reuse work already done.
+
+Entries are keyed by the full RSVP URL, so a changed ``unique_token`` simply
+misses the cache. A change of ``WEBSITE_URL`` wipes the disk cache as well,
+since none of the stored images can be served anymore.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import qrcode
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'qr_cache')
+BASE_URL_STAMP = 'base_url.txt'
+
+
+def rsvp_url(base_url: str, token: str) -> str:
+    """הקישור האישי לאורח - זהה לזה שמופיע בהודעות ובכרטיסים"""
+    return f"{base_url}/rsvp/{token}"
+
+
+# bump when the rendering below changes, so ETags handed to browsers change too
+RENDER_VERSION = 1
+
+MIMETYPES = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+
+def _make_qr(url: str) -> qrcode.QRCode:
+    qr = qrcode.QRCode(version=1, box_size=10, border=5)
+    qr.add_data(url)
+    qr.make(fit=True)
+    return qr
+
+
+def render_qr_png(url: str) -> bytes:
+    img = _make_qr(url).make_image(fill_color="black", back_color="white")
+    buffered = BytesIO()
+    img.save(buffered)
+    return buffered.getvalue()
+
+
+def render_qr_svg(url: str) -> bytes:
+    """SVG compact: one path, one sub-path per horizontal run of dark modules."""
+    matrix = _make_qr(url).get_matrix()
+    size = len(matrix)
+    runs = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < size:
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < size and row[x]:
+                x += 1
+            runs.append(f'M{start} {y}h{x - start}v1h-{x - start}z')
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+        f'<rect width="{size}" height="{size}" fill="#fff"/>'
+        f'<path d="{"".join(runs)}"/></svg>'
+    ).encode('utf-8')
+
+
+RENDERERS = {
+    'png': render_qr_png,
+    'svg': render_qr_svg,
+}
+
+
+def qr_etag(url: str, fmt: str) -> str:
+    """ETag חזק שנגזר מהקישור בלבד - אפשר לענות 304 בלי לרנדר"""
+    return hashlib.sha256(f'{RENDER_VERSION}:{fmt}:{url}'.encode('utf-8')).hexdigest()[:32]
+
+
+class QRCache:
+    """In-memory LRU of rendered QR images, backed by a directory on disk."""
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_items: int = 512):
+        self.cache_dir = cache_dir
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self._base_url = None
+
+    @staticmethod
+    def _key(url: str) -> str:
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()[:32]
+
+    def _path(self, key: str, fmt: str) -> str:
+        return os.path.join(self.cache_dir, f'{key}.{fmt}')
+
+    def _remember(self, key: str, data: bytes):
+        with self._lock:
+            self._items[key] = data
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def ensure_base_url(self, base_url: str):
+        """Drop every cached image when the public site URL changes."""
+        if base_url == self._base_url:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        stamp = os.path.join(self.cache_dir, BASE_URL_STAMP)
+        try:
+            with open(stamp, 'r', encoding='utf-8') as f:
+                stored = f.read()
+        except OSError:
+            stored = None
+        if stored != base_url:
+            self.clear()
+            with open(stamp, 'w', encoding='utf-8') as f:
+                f.write(base_url)
+        self._base_url = base_url
+
+    def get(self, url: str, fmt: str = 'png') -> bytes:
+        digest = self._key(url)
+        key = f'{digest}.{fmt}'
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+                return data
+
+        path = self._path(digest, fmt)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            data = RENDERERS[fmt](url)
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                tmp_path = f'{path}.{os.getpid()}.tmp'
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except OSError:
+                # a read-only disk only costs us persistence
+                pass
+
+        self._remember(key, data)
+        return data
+
+    def invalidate(self, url: str):
+        key = self._key(url)
+        for fmt in RENDERERS:
+            with self._lock:
+                self._items.pop(f'{key}.{fmt}', None)
+            try:
+                os.remove(self._path(key, fmt))
+            except OSError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+        if not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            if name.rsplit('.', 1)[-1] in RENDERERS:
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+
+
+qr_cache = QRCache(
+    cache_dir=os.getenv('QR_CACHE_DIR', DEFAULT_CACHE_DIR),
+    max_items=int(os.getenv('QR_CACHE_SIZE', '512')),
+)
+
+
+def get_rsvp_qr(base_url: str, token: str, fmt: str = 'png') -> bytes:
+    """קוד QR (png/svg) לקישור ה-RSVP של האורח (מהמטמון אם קיים)"""
+    qr_cache.ensure_base_url(base_url)
+    return qr_cache.get(rsvp_url(base_url, token), fmt)
+
+
+def invalidate_rsvp_qr(base_url: str, token: str):
+    """יש לקרוא כאשר הטוקן של אורח מוחלף"""
+    qr_cache.invalidate(rsvp_url(base_url, token))
@@ -0,0 +1,195 @@
+"""
+Write-behind journal for RSVP submissions.
+
+With RSVP_WRITE_BEHIND enabled, ``submit_rsvp`` appends the answer to a local
+append-only JSON-lines file (fsync'ed, so an acknowledged answer survives a
+crash) and returns immediately. A background flusher later applies the
+journal to the ``guest`` table in batched transactions.
+
+Several gunicorn workers share the same files: appends are serialised with an
+exclusive ``flock`` on the journal, and only one process at a time may hold
+the flusher lock. A drain first renames the live journal to ``*.flushing`` so
+new answers keep flowing into a fresh file; the flushing file is removed only
+after its entries were committed, so a crash mid-flush simply replays it
+(entries carry absolute values, so replaying is harmless).
+"""
+
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows - single process only
+    fcntl = None
+
+DEFAULT_JOURNAL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'rsvp_journal.jsonl')
+
+_fallback_lock = threading.RLock()
+
+
+@contextmanager
+def _file_lock(fh, exclusive: bool = True, blocking: bool = True):
+    """flock על קובץ פתוח; בלי fcntl נשענים על נעילת threads בלבד"""
+    if fcntl is None:
+        with _fallback_lock:
+            yield True
+        return
+    flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+    if not blocking:
+        flags |= fcntl.LOCK_NB
+    try:
+        fcntl.flock(fh.fileno(), flags)
+    except BlockingIOError:
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+
+
+class RSVPJournal:
+    def __init__(self, path: str = DEFAULT_JOURNAL_PATH):
+        self.path = path
+        self.flushing_path = path + '.flushing'
+        self.lock_path = path + '.lock'
+        # (path, inode, size, mtime) -> {guest_id: entry}
+        self._index_key = None
+        self._index: Dict[int, dict] = {}
+        self._index_lock = threading.Lock()
+
+    def _ensure_dir(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+
+    def append(self, entry: dict):
+        """Durably record one RSVP answer. Returns once it is on disk."""
+        self._ensure_dir()
+        line = json.dumps(entry, ensure_ascii=False) + '\n'
+        while True:
+            with open(self.path, 'a', encoding='utf-8') as fh:
+                with _file_lock(fh):
+                    # the flusher may have renamed the file while we waited for the lock
+                    try:
+                        current = os.stat(self.path).st_ino
+                    except FileNotFoundError:
+                        current = None
+                    if current != os.fstat(fh.fileno()).st_ino:
+                        continue
+                    fh.write(line)
+                    fh.flush()
+                    os.fsync(fh.fileno())
+                    return
+
+    @staticmethod
+    def _read_entries(path: str) -> List[dict]:
+        entries = []
+        try:
+            with open(path, 'r', encoding='utf-8') as fh:
+                with _file_lock(fh, exclusive=False):
+                    for line in fh:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        try:
+                            entries.append(json.loads(line))
+                        except ValueError:
+                            # a torn last line from a crash mid-append
+                            continue
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def _stat_key(self):
+        key = []
+        for path in (self.flushing_path, self.path):
+            try:
+                st = os.stat(path)
+                key.append((path, st.st_ino, st.st_size, st.st_mtime_ns))
+            except FileNotFoundError:
+                key.append((path, None))
+        return tuple(key)
+
+    def pending(self, guest_id: int) -> Optional[dict]:
+        """The newest not-yet-applied answer of a guest, if any."""
+        key = self._stat_key()
+        with self._index_lock:
+            if key != self._index_key:
+                index = {}
+                for path in (self.flushing_path, self.path):
+                    for entry in self._read_entries(path):
+                        index[entry['guest_id']] = entry
+                self._index, self._index_key = index, key
+            return self._index.get(guest_id)
+
+    def has_pending(self) -> bool:
+        return any(os.path.exists(p) and os.path.getsize(p) > 0 for p in (self.flushing_path, self.path))
+
+    @contextmanager
+    def drain(self) -> Iterator[List[dict]]:
+        """Yield the entries to apply; they are discarded only if the block succeeds.
+
+        Yields an empty list when another process is already flushing.
+        """
+        self._ensure_dir()
+        with open(self.lock_path, 'a') as lock_fh:
+            with _file_lock(lock_fh, blocking=False) as acquired:
+                if not acquired:
+                    yield []
+                    return
+                if not os.path.exists(self.flushing_path) and os.path.exists(self.path):
+                    with open(self.path, 'a', encoding='utf-8') as fh:
+                        with _file_lock(fh):
+                            os.replace(self.path, self.flushing_path)
+                entries = self._read_entries(self.flushing_path)
+                yield entries
+                try:
+                    os.remove(self.flushing_path)
+                except FileNotFoundError:
+                    pass
+
+
+class RSVPFlusher:
+    """Background thread that periodically calls ``apply_fn`` with drained entries."""
+
+    def __init__(self, journal: RSVPJournal, apply_fn, interval: float = 1.0):
+        self.journal = journal
+        self.apply_fn = apply_fn
+        self.interval = interval
+        self._thread = None
+        self._pid = None
+        self._wake = threading.Event()
+        self._start_lock = threading.Lock()
+
+    def flush_once(self) -> int:
+        if not self.journal.has_pending():
+            return 0
+        with self.journal.drain() as entries:
+            if entries:
+                self.apply_fn(entries)
+            return len(entries)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush_once()
+            except Exception as e:
+                print(f"⚠️ RSVP flusher error: {e}")
+
+    def ensure_running(self):
+        # after a gunicorn fork the thread object survives but the thread does not
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='rsvp-flusher', daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        self._wake.set()
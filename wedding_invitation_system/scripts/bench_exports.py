@@ -0,0 +1,203 @@
+"""
+Benchmark: building the bot export files, per-guest loops vs the columnar pipeline.
+
+Seeds a fresh SQLite database with --guests guests, then builds the rows of
+each bot export with each implementation:
+
+  legacy   - the original export_for_bot / export_for_bot_simple loop
+             (Guest.query.all(), full ORM objects, a dict per guest, then a
+             DataFrame), kept here verbatim
+  rows     - the previous streaming loop: Core rows in keyset batches, but
+             status, phone, link and message derived guest by guest
+  columnar - export_rows in app.py (export_pipeline.py): only the needed
+             columns, every output column derived for a whole batch at once,
+             messages from the cached invitation template
+
+Each path is timed twice: once building the rows only, and once writing the
+whole .xlsx (legacy: DataFrame.to_excel; the others: export_formats, the
+streaming writer the routes use). The peak Python memory of each path comes
+from a separate tracemalloc run, so the timings are not slowed down by it.
+All paths must produce the same rows; the script exits with status 1
+otherwise.
+
+Usage:
+    python scripts/bench_exports.py                      # 50k guests
+    python scripts/bench_exports.py --guests 200000 --skip-legacy
+    python scripts/bench_exports.py --exports bot --no-xlsx
+"""
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+import pandas as pd
+
+WORKDIR = tempfile.mkdtemp(prefix='export_bench_')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(WORKDIR, 'bench.db')}"
+os.environ['QR_CACHE_DIR'] = os.path.join(WORKDIR, 'qr')
+os.environ['RSVP_JOURNAL_PATH'] = os.path.join(WORKDIR, 'rsvp_journal.jsonl')
+os.environ['JOB_WORKER_EMBEDDED'] = '0'
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import (app, db, Guest, DEFAULT_WEBSITE_URL, EXPORTS, build_invitation_message,  # noqa: E402
+                 export_rows, iter_guest_batches, reset_database)
+import export_formats  # noqa: E402
+import phones  # noqa: E402
+
+STATUSES = ['יגיע', 'לא יגיע', 'מתלבט', None]
+
+
+def seed(count):
+    reset_database()
+    with app.app_context():
+        for start in range(0, count, 10000):
+            db.session.execute(db.insert(Guest), [
+                {'name': f'אורח {i}', 'phone': f'05{i % 10}{i:07d}', 'unique_token': str(uuid.uuid4()),
+                 'invited_count': (i % 4) + 1, 'attendance_status': STATUSES[i % 4],
+                 'is_attending': [None, True, False][i % 3] if STATUSES[i % 4] is None else None}
+                for i in range(start, min(start + 10000, count))
+            ])
+        db.session.commit()
+
+
+def legacy_bot(simple):
+    """The original per-guest loops from export_for_bot / export_for_bot_simple, unchanged."""
+    guests = Guest.query.all()
+    website_url = os.getenv('WEBSITE_URL', DEFAULT_WEBSITE_URL)
+
+    rows = []
+    for g in guests:
+        token = getattr(g, 'unique_token', None)
+        link = f"{website_url.rstrip('/')}/rsvp/{token}" if token else website_url
+        # Try to use existing message builder; fallback to a simple template
+        try:
+            message = build_invitation_message(g)
+        except Exception:
+            message = f"שלום {g.name}!\nנשמח לאישור הגעה כאן: {link}"
+
+        # normalize phone to E.164 without leading + (e.g. 97250...)
+        raw_phone = (g.phone or '')
+        digits = ''.join(ch for ch in raw_phone if ch.isdigit())
+        if digits.startswith('0') and len(digits) >= 10:
+            # convert local 0-leading Israeli numbers to 972...
+            digits = '972' + digits[1:]
+        elif raw_phone.startswith('+') and digits.startswith(''):
+            digits = digits.lstrip('+')
+
+        # determine RSVP status
+        if g.attendance_status:
+            status = g.attendance_status
+        elif g.is_attending is True:
+            status = 'יגיע'
+        elif g.is_attending is False:
+            status = 'לא יגיע'
+        else:
+            status = 'ממתין'
+
+        if simple:
+            rows.append({'guest_id': g.id, 'name': g.name, 'phone': g.phone or '',
+                         'personal_message': message, 'status': status})
+        else:
+            rows.append({'guest_id': g.id, 'name': g.name, 'phone_e164_no_plus': digits, 'link': link,
+                         'personal_message': message, 'status': status})
+    return pd.DataFrame(rows)
+
+
+def rows_bot(simple):
+    """The streaming per-guest loop that preceded the columnar pipeline (bot_export_rows /
+    bot_simple_export_rows with their helpers inlined)."""
+    website_url = os.getenv('WEBSITE_URL', DEFAULT_WEBSITE_URL)
+    fields = ('name', 'phone', 'phone_e164', 'unique_token', 'invited_count', 'attendance_status', 'is_attending')
+    for batch in iter_guest_batches(fields):
+        for g in batch:
+            link = f"{website_url.rstrip('/')}/rsvp/{g.unique_token}" if g.unique_token else website_url
+            try:
+                message = build_invitation_message(g)
+            except Exception:
+                message = f"שלום {g.name}!\nנשמח לאישור הגעה כאן: {link}"
+            if g.attendance_status:
+                status = g.attendance_status
+            elif g.is_attending is True:
+                status = 'יגיע'
+            elif g.is_attending is False:
+                status = 'לא יגיע'
+            else:
+                status = 'ממתין'
+            if simple:
+                yield [g.id, g.name, g.phone or '', message, status]
+            else:
+                phone = g.phone_e164 or phones.to_e164(g.phone) or ''
+                yield [g.id, g.name, phone, link, message, status]
+
+
+def build(path, name, xlsx):
+    """Runs one path; returns (rows, bytes written or None)."""
+    export = EXPORTS[name]
+    simple = name == 'bot_simple'
+    if path == 'legacy':
+        df = legacy_bot(simple)
+        if not xlsx:
+            return df.values.tolist(), None
+        out = io.BytesIO()
+        df.to_excel(out, index=False, engine='openpyxl')
+        return None, out.tell()
+    rows = rows_bot(simple) if path == 'rows' else export_rows(export)
+    if not xlsx:
+        return list(rows), None
+    size = sum(len(chunk) for chunk in export_formats.iter_export('xlsx', export.headers, rows))
+    return None, size
+
+
+def run_path(path, name, count, xlsx):
+    with app.app_context():
+        started = time.perf_counter()
+        rows, size = build(path, name, xlsx)
+        elapsed = time.perf_counter() - started
+        db.session.remove()
+
+        tracemalloc.start()
+        build(path, name, xlsx)
+        peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+        db.session.remove()
+    what = f'xlsx {size / 2 ** 20:5.1f} MiB' if xlsx else 'rows only    '
+    print(f"  {path:>8} {what}: {elapsed:6.2f}s ({count / elapsed:8.0f} guests/s) | peak {peak:7.1f} MiB")
+    return elapsed, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--guests', type=int, default=50000)
+    parser.add_argument('--exports', default='bot,bot_simple')
+    parser.add_argument('--skip-legacy', action='store_true', help='only run the streaming paths')
+    parser.add_argument('--no-xlsx', action='store_true', help='time building the rows only')
+    args = parser.parse_args()
+
+    seed(args.guests)
+    print(f"📄 {args.guests} guests, db in {WORKDIR}")
+    paths = ['columnar', 'rows'] + ([] if args.skip_legacy else ['legacy'])
+    mismatch = False
+    for name in args.exports.split(','):
+        print(f"📦 {name}")
+        results = {path: run_path(path, name, args.guests, False) for path in paths}
+        for path in paths[1:]:
+            if results[path][1] != results['columnar'][1]:
+                mismatch = True
+                print(f'  ❌ {path} and columnar rows differ')
+        print('  speedup (rows): ' + ', '.join(
+            f"{results[path][0] / results['columnar'][0]:.1f}x vs {path}" for path in paths[1:]))
+        if not args.no_xlsx:
+            xlsx = {path: run_path(path, name, args.guests, True)[0] for path in paths}
+            print('  speedup (xlsx): ' + ', '.join(
+                f"{xlsx[path] / xlsx['columnar']:.1f}x vs {path}" for path in paths[1:]))
+    sys.exit(1 if mismatch else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+"""
+Benchmark: guest import, row-by-row (legacy) vs vectorised bulk paths.
+
+Generates guest files the way the invitation sites export them (Hebrew
+headers, some rows without a name or phone, phones repeated inside the file
+and phones that already exist in the database), then imports each file into
+a fresh SQLite database with each implementation:
+
+  legacy - the previous import loop (iterrows, a column-mapping scan per
+           field, one SELECT per row for duplicates), kept here verbatim
+  bulk   - import_guest_frame in app.py (guest_import.py), one transaction
+  stream - import_guest_chunks: the file is read and committed in chunks,
+           so memory is bounded by --chunk-size instead of the file size
+
+Reading the file is timed separately where the path reads it up front. All
+paths must produce the same guests and the same per-row errors; the script
+exits with status 1 otherwise. --memory adds the tracemalloc peak per path.
+
+Usage:
+    python scripts/bench_import.py --sizes 10000,100000
+    python scripts/bench_import.py --sizes 10000 --format xlsx --skip-legacy-above 50000
+    python scripts/bench_import.py --sizes 100000 --skip-legacy-above 0 --memory --chunk-size 2000
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+import pandas as pd
+
+WORKDIR = tempfile.mkdtemp(prefix='import_bench_')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(WORKDIR, 'bench.db')}"
+os.environ['QR_CACHE_DIR'] = os.path.join(WORKDIR, 'qr')
+os.environ['RSVP_JOURNAL_PATH'] = os.path.join(WORKDIR, 'rsvp_journal.jsonl')
+os.environ.pop('RSVP_WRITE_BEHIND', None)
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import (app, db, Guest, import_guest_chunks, import_guest_frame, issue_guest_token,  # noqa: E402
+                 reset_database)
+import guest_import  # noqa: E402
+
+SIDES = ['חתן', 'כלה']
+GROUPS = ['משפחה', 'חברים', 'עבודה', 'צבא', 'שכנים']
+STATUSES = ['יגיע', 'לא יגיע', 'מתלבט', None]
+EXISTING_EVERY = 97  # כל אורח 97 כבר קיים במסד לפני הייבוא
+
+
+def make_file(count, fmt):
+    rows = []
+    for i in range(count):
+        rows.append({
+            'שם המוזמן': None if i % 211 == 5 else f'אורח {i}',
+            'נייד': None if i % 307 == 7 else f'05{(i if i % 149 else i - 1) % 10}{(i if i % 149 else i - 1):07d}',
+            'כמה יגיעו': (i % 4) + 1 if i % 13 else None,
+            'שיוך לקבוצה': GROUPS[i % 5],
+            'מהצד של...': SIDES[i % 2],
+            'סטטוס הגעה': STATUSES[i % 4],
+            'סכום מתנה משוער': 300 + (i % 5) * 100 if i % 3 else None,
+            'האם נשלחה הזמנה': 'כן' if i % 2 else 'לא',
+            'הערות (מלל חופשי)': 'צמחוני' if i % 17 == 0 else None,
+        })
+    df = pd.DataFrame(rows)
+    path = os.path.join(WORKDIR, f'guests_{count}.{fmt}')
+    if fmt == 'csv':
+        df.to_csv(path, index=False, encoding='utf-8-sig')
+    else:
+        df.to_excel(path, index=False, engine='openpyxl')
+    return path
+
+
+def legacy_import(df):
+    """The pre-bulk import loop from app.import_guests, unchanged."""
+    df.columns = [str(col).strip().replace('\n', ' ').replace('\r', '') for col in df.columns]
+    column_mapping = {col: guest_import.field_for_column(col) for col in df.columns}
+    column_mapping = {col: field for col, field in column_mapping.items() if field}
+
+    success_count = 0
+    errors = []
+    new_guests = []
+    for index, row in df.iterrows():
+        try:
+            def get_value(mapping_key):
+                for col, mapped in column_mapping.items():
+                    if mapped == mapping_key:
+                        value = row.get(col)
+                        if pd.notna(value) and str(value).strip() not in ['', 'nan', 'NaN', 'null', 'None']:
+                            return str(value).strip()
+                return None
+
+            name = get_value('name')
+            phone = get_value('phone')
+            if phone and phone.isdigit() and len(phone) == 10 and not phone.startswith('0') and phone.startswith('5'):
+                phone = '0' + phone
+            if not name:
+                errors.append(f'שורה {index + 2}: חסר שם אורח')
+                continue
+            if not phone:
+                errors.append(f'שורה {index + 2}: חסר מספר טלפון עבור {name}')
+                continue
+            existing_guest = Guest.query.filter_by(phone=phone).first()
+            if existing_guest:
+                errors.append(f'שורה {index + 2}: האורח {name} ({phone}) כבר קיים במערכת')
+                continue
+
+            guest = Guest(name=name, phone=phone, unique_token=str(uuid.uuid4()))
+            guest.email = get_value('email')
+            guest.group_affiliation = get_value('group_affiliation')
+            guest.side = get_value('side')
+            guest.notes = get_value('notes')
+            guest.added_by = get_value('added_by')
+            guest.attendance_status = get_value('attendance_status') or 'ממתין'
+            invited_count_str = get_value('invited_count')
+            try:
+                guest.invited_count = int(float(invited_count_str)) if invited_count_str else 1
+            except (ValueError, TypeError):
+                guest.invited_count = 1
+            gift_amount_str = get_value('estimated_gift_amount')
+            try:
+                guest.estimated_gift_amount = float(gift_amount_str) if gift_amount_str else 0.0
+            except (ValueError, TypeError):
+                guest.estimated_gift_amount = 0.0
+            message_sent_str = get_value('message_sent_text')
+            if message_sent_str:
+                guest.message_sent = message_sent_str.lower() in ['נשלחה', 'true', '1', 'yes', 'כן']
+            else:
+                guest.message_sent = False
+            if guest.attendance_status == 'יגיע':
+                guest.is_attending = True
+            elif guest.attendance_status == 'לא יגיע':
+                guest.is_attending = False
+            else:
+                guest.is_attending = None
+
+            db.session.add(guest)
+            new_guests.append(guest)
+            success_count += 1
+        except Exception as e:
+            errors.append(f'שורה {index + 2}: {str(e)}')
+
+    db.session.flush()
+    for guest in new_guests:
+        issue_guest_token(guest)
+    db.session.commit()
+    return success_count, errors
+
+
+def seed_existing(count):
+    reset_database()
+    with app.app_context():
+        db.session.execute(db.insert(Guest), [
+            {'name': f'קיים {i}', 'phone': f'05{i % 10}{i:07d}', 'unique_token': str(uuid.uuid4())}
+            for i in range(0, count, EXISTING_EVERY)
+        ])
+        db.session.commit()
+
+
+def snapshot():
+    columns = [getattr(Guest, f) for f in guest_import.IMPORT_FIELDS]
+    with app.app_context():
+        return sorted(tuple(r) for r in db.session.execute(db.select(*columns).order_by(Guest.id)))
+
+
+def run_path(name, path, fmt, count, chunk_size, memory):
+    """Import the file on a fresh database; returns (seconds, imported, error count, errors, guests)."""
+    seed_existing(count)
+    filename = f'guests.{fmt}'
+    if memory:
+        tracemalloc.start()
+    with app.app_context(), open(path, 'rb') as f:
+        started = time.perf_counter()
+        if name == 'stream':
+            # reading and importing are interleaved, so only the total is measured
+            result = import_guest_chunks(guest_import.iter_guest_chunks(f, filename, chunk_size))
+            read_s = None
+        else:
+            df = guest_import.read_guest_file(f, filename)
+            read_s = time.perf_counter() - started
+            result = (import_guest_frame if name == 'bulk' else legacy_import)(df)
+        total_s = time.perf_counter() - started
+    peak = ''
+    if memory:
+        peak = f' | peak {tracemalloc.get_traced_memory()[1] / 2 ** 20:6.1f} MiB'
+        tracemalloc.stop()
+    imported, errors = result[0], result[1]
+    error_count = result[2] if len(result) > 2 else len(errors)
+    read = f'read {read_s:6.2f}s' if read_s is not None else 'read   (inline)'
+    print(f"  {name:>6}: {read} | total {total_s:7.2f}s ({count / total_s:8.0f} rows/s)"
+          f" | {imported} imported, {error_count} errors{peak}")
+    return total_s, imported, error_count, errors, snapshot()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10000,100000')
+    parser.add_argument('--format', choices=['csv', 'xlsx'], default='csv')
+    parser.add_argument('--chunk-size', type=int, default=guest_import.DEFAULT_CHUNK_SIZE,
+                        help='rows per chunk for the streaming path')
+    parser.add_argument('--skip-legacy-above', type=int, default=0,
+                        help='only run the bulk paths for files larger than this (0 = always run legacy)')
+    parser.add_argument('--memory', action='store_true',
+                        help='report peak Python memory per path (tracemalloc; slows every path down)')
+    args = parser.parse_args()
+
+    mismatch = False
+    for count in (int(s) for s in args.sizes.split(',')):
+        path = make_file(count, args.format)
+        print(f"📄 {count} rows ({args.format}), db in {WORKDIR}")
+        results = {}
+        names = ['bulk', 'stream']
+        if not (args.skip_legacy_above and count > args.skip_legacy_above):
+            names.append('legacy')
+        for name in names:
+            results[name] = run_path(name, path, args.format, count, args.chunk_size, args.memory)
+        if 'legacy' in results:
+            print(f"  speedup vs legacy: bulk {results['legacy'][0] / results['bulk'][0]:.1f}x,"
+                  f" stream {results['legacy'][0] / results['stream'][0]:.1f}x")
+        _, imported, error_count, errors, guests = results['bulk']
+        for name in names[1:]:
+            # the streaming path keeps only the first IMPORT_MAX_ERRORS messages
+            other = results[name]
+            if (other[1], other[2], other[4]) != (imported, error_count, guests) or errors[:len(other[3])] != other[3]:
+                mismatch = True
+                print(f'  ❌ {name} and bulk results differ')
+    sys.exit(1 if mismatch else 0)
+
+
+if __name__ == '__main__':
+    main()
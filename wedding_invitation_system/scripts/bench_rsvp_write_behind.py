@@ -0,0 +1,89 @@
+"""
+Benchmark: RSVP submissions per second with and without write-behind mode.
+
+Seeds a throw-away SQLite database, then fires concurrent POST /rsvp/<token>
+requests through the Flask test client, once with synchronous commits and once
+with RSVP_WRITE_BEHIND. For write-behind it also measures how long the flusher
+needs to apply the journal, so both the acknowledged and the applied rate are
+reported.
+
+Usage:
+    python scripts/bench_rsvp_write_behind.py --guests 2000 --threads 16
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+WORKDIR = tempfile.mkdtemp(prefix='rsvp_bench_')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(WORKDIR, 'bench.db')}"
+os.environ['RSVP_JOURNAL_PATH'] = os.path.join(WORKDIR, 'rsvp_journal.jsonl')
+os.environ.pop('RSVP_WRITE_BEHIND', None)
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import app, db, Guest, reset_database, rsvp_flusher, rsvp_journal  # noqa: E402
+
+
+def seed(count):
+    reset_database()
+    with app.app_context():
+        db.session.bulk_insert_mappings(Guest, [
+            {'name': f'אורח {i}', 'phone': f'05{i:08d}', 'unique_token': str(uuid.uuid4()), 'invited_count': 2}
+            for i in range(count)
+        ])
+        db.session.commit()
+        return [t for (t,) in db.session.query(Guest.unique_token).all()]
+
+
+def post_all(tokens, threads):
+    errors = 0
+
+    def submit(token):
+        client = app.test_client()
+        resp = client.post(f'/rsvp/{token}', data={'is_attending': 'yes', 'confirmed_count': '2', 'notes': 'bench'})
+        return resp.status_code == 200
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for ok in pool.map(submit, tokens):
+            if not ok:
+                errors += 1
+    return time.perf_counter() - start, errors
+
+
+def run(mode, count, threads):
+    tokens = seed(count)
+    app.config['RSVP_WRITE_BEHIND'] = mode == 'write_behind'
+    elapsed, errors = post_all(tokens, threads)
+    drain = 0.0
+    if mode == 'write_behind':
+        start = time.perf_counter()
+        # the background flusher may hold the drain lock, so wait for the journal to empty
+        while rsvp_journal.has_pending():
+            if not rsvp_flusher.flush_once():
+                time.sleep(0.01)
+        drain = time.perf_counter() - start
+    with app.app_context():
+        applied = Guest.query.filter(Guest.response_date.isnot(None)).count()
+    ok = count - errors
+    print(f"{mode:>13}: {ok} ok / {errors} errors | ack {elapsed:.2f}s ({ok / elapsed:.0f}/s)"
+          f" | applied {applied} in {elapsed + drain:.2f}s ({applied / (elapsed + drain):.0f}/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--guests', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=16)
+    args = parser.parse_args()
+    print(f"RSVP bench: {args.guests} submissions, {args.threads} threads, db in {WORKDIR}")
+    for mode in ('sync', 'write_behind'):
+        run(mode, args.guests, args.threads)
+
+
+if __name__ == '__main__':
+    main()
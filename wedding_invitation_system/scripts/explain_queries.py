@@ -0,0 +1,282 @@
+"""
+Query-plan audit for the hot Guest / MessageLog queries.
+
+Seeds a throw-away database with N guests (default 50k) and a message log,
+drives the app's routes through the Flask test client, records every SQL
+statement they issue (before_cursor_execute) and runs EXPLAIN on each one
+with the parameters it was actually called with.
+
+The run fails (exit code 1) when a statement does a full table scan of
+``guest`` or ``message_log``, unless:
+  * it is an early-terminating scan without a filter (key order + LIMIT, no
+    WHERE, no sort step), or
+  * it matches ALLOWED_SCANS - queries that read every row by design.
+
+Usage:
+    python scripts/explain_queries.py                      # SQLite, 50k guests
+    python scripts/explain_queries.py --guests 10000 -v    # print every plan
+    python scripts/explain_queries.py --database-url postgresql://...  # EXPLAIN (FORMAT JSON)
+"""
+
+import argparse
+import io
+import os
+import re
+import sys
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
+
+WORKDIR = tempfile.mkdtemp(prefix='explain_')
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+AUDITED_TABLES = ('guest', 'message_log')
+
+# שאילתות שקוראות את כל השורות בכוונה - (regex על ה-SQL, הסבר)
+ALLOWED_SCANS = [
+    (r'count\(guest\.id\).*sum\(CASE', 'full stats aggregate - read from the counters row when GUEST_STATS_COUNTERS is on'),
+    (r'GROUP BY coalesce\(guest\.side', 'side/group breakdown - cached per data_version'),
+    (r'^SELECT guest\.id, guest\.name, guest\.phone, guest\.notes, guest\.group_affiliation\s+FROM guest$',
+     'search index rebuild after bulk statements'),
+    (r'FROM guest ORDER BY guest\.id$', 'full guest list stream / export'),
+]
+
+SIDES = ('חתן', 'כלה')
+GROUPS = ('משפחה', 'עבודה', 'צבא', 'חברים', 'שכנים')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--guests', type=int, default=50000)
+    parser.add_argument('--database-url', help='default: a temporary SQLite file')
+    parser.add_argument('-v', '--verbose', action='store_true', help='print the plan of every statement')
+    return parser.parse_args()
+
+
+ARGS = parse_args()
+os.environ['DATABASE_URL'] = ARGS.database_url or f"sqlite:///{os.path.join(WORKDIR, 'explain.db')}"
+os.environ['BOT_API_KEY'] = 'explain-queries'
+os.environ['QR_CACHE_DIR'] = os.path.join(WORKDIR, 'qr')
+os.environ['RSVP_JOURNAL_PATH'] = os.path.join(WORKDIR, 'rsvp_journal.jsonl')
+os.environ['JOB_FILES_DIR'] = os.path.join(WORKDIR, 'jobs')
+# משימות הרקע רצות בתוך התרחיש (job_worker.run_once) ולא ב-thread, כדי שהשאילתות שלהן ייתפסו
+os.environ['JOB_WORKER_EMBEDDED'] = '0'
+os.environ.pop('RSVP_WRITE_BEHIND', None)
+sys.path.insert(0, APP_DIR)
+os.chdir(APP_DIR)
+
+from app import (app, db, Guest, MessageLog, Table, get_local_time, issue_guest_token, job_worker,  # noqa: E402
+                 rebuild_guest_search, rebuild_guest_stats_counters, reset_database)
+
+
+def seed(count):
+    print(f'🌱 seeding {count} guests ...')
+    started = time.perf_counter()
+    reset_database()
+    with app.app_context():
+        rows = []
+        for i in range(count):
+            sent = i % 10 < 7
+            responded = sent and i % 10 < 4
+            rows.append({
+                'name': f'אורח {i}', 'phone': f'05{i % 10}{i:07d}', 'unique_token': str(uuid.uuid4()),
+                'invited_count': 1 + i % 4, 'side': SIDES[i % 2], 'group_affiliation': GROUPS[i % 5],
+                'message_sent': sent, 'is_attending': responded and i % 3 != 0,
+                'confirmed_count': 2 if responded and i % 3 != 0 else 0,
+                'response_date': get_local_time() if responded else None,
+                'table_number': (i % 40) + 1 if i % 10 < 3 else None,
+            })
+        db.session.execute(Guest.__table__.insert(), rows)
+        logs = [{'guest_id': gid, 'status': 'failed' if gid % 20 == 0 else 'sent', 'created_at': get_local_time()}
+                for gid in range(1, count + 1) if (gid - 1) % 10 < 7]
+        db.session.execute(MessageLog.__table__.insert(), logs)
+        db.session.add_all([Table(table_number=n, capacity=10) for n in range(1, 41)])
+        rebuild_guest_stats_counters()
+        rebuild_guest_search()
+        db.session.commit()
+        for guest in Guest.query.filter(Guest.id <= 5):
+            guest.legacy_token = guest.unique_token
+            issue_guest_token(guest)
+        db.session.commit()
+        # ב-Postgres ה-autovacuum מריץ ANALYZE בפרודקשן; ב-SQLite אף אחד לא מריץ אותו,
+        # ולכן גם כאן לא - התוכנית צריכה להיות זו שהאפליקציה תקבל בפועל
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute(db.text('ANALYZE'))
+            db.session.commit()
+    print(f'   done in {time.perf_counter() - started:.1f}s')
+
+
+def scenarios(client, bot):
+    """(שם, פעולה) - כל מסלול חם באפליקציה, עם פרמטרים אופייניים"""
+    with app.app_context():
+        signed = db.session.get(Guest, 1).unique_token
+        legacy = db.session.get(Guest, 2).legacy_token
+        some_phone = db.session.get(Guest, 1234).phone
+        recent = db.session.query(db.func.max(Guest.updated_at)).scalar()
+
+    def admin_pages():
+        first = client.get('/api/admin/guests?sort=name').get_json()
+        client.get('/api/admin/guests', query_string={'sort': 'name', 'cursor': first['next_cursor']})
+
+    def csv_upload(path, body, **form):
+        return client.post(path, data={'file': (io.BytesIO(body.encode('utf-8-sig')), 'file.csv'), **form},
+                           content_type='multipart/form-data')
+
+    def run_job(response):
+        # הבקשה רק מכניסה לתור - ה-worker מריץ את המשימה, והדפדפן מושך את הסטטוס
+        while job_worker.run_once():
+            pass
+        job_id = int(response.headers['Location'].split('job=')[1]) if response.status_code == 302 \
+            else response.get_json()['job']['id']
+        client.get(f'/api/jobs/{job_id}')
+
+    return [
+        ('admin page', lambda: client.get('/admin')),
+        ('admin list by id', lambda: client.get('/api/admin/guests')),
+        ('admin list by name (2 pages)', admin_pages),
+        ('admin list name desc', lambda: client.get('/api/admin/guests?sort=name&dir=desc')),
+        ('admin filter confirmed', lambda: client.get('/api/admin/guests?status=confirmed')),
+        ('admin filter declined', lambda: client.get('/api/admin/guests?status=declined')),
+        ('admin filter pending', lambda: client.get('/api/admin/guests?status=pending')),
+        ('admin filter side', lambda: client.get('/api/admin/guests', query_string={'side': SIDES[0]})),
+        ('admin filter group', lambda: client.get('/api/admin/guests', query_string={'group': GROUPS[1]})),
+        ('admin filter not sent', lambda: client.get('/api/admin/guests?message_sent=0')),
+        ('admin filter table', lambda: client.get('/api/admin/guests?table=3')),
+        ('admin filter no table', lambda: client.get('/api/admin/guests?table=none')),
+        ('search name', lambda: client.get('/api/guests/search', query_string={'q': 'אורח 123'})),
+        ('search phone', lambda: client.get('/api/guests/search', query_string={'q': some_phone[:6]})),
+        ('bot pending', lambda: client.get('/api/bot/pending?limit=50', headers=bot)),
+        ('bot pending resend', lambda: client.get('/api/bot/pending?limit=50&resend=1', headers=bot)),
+        ('bot logs', lambda: client.get('/api/bot/logs', headers=bot)),
+        ('bot mark', lambda: client.post('/api/bot/mark', json={'sent': [8, 9], 'failed': [{'id': 10, 'error': 'x'}],
+                                                                     'release': [11, 12], 'lease': 'x'},
+                                         headers=bot)),
+        ('guests stream since', lambda: client.get('/api/guests', query_string={'since': recent.isoformat()},
+                                                   headers=bot).get_data()),
+        ('seating chart', lambda: client.get('/seating')),
+        ('rsvp page (signed token)', lambda: client.get(f'/rsvp/{signed}')),
+        ('rsvp page (legacy token)', lambda: client.get(f'/rsvp/{legacy}')),
+        ('rsvp submit', lambda: client.post(f'/rsvp/{signed}', data={'is_attending': 'yes', 'confirmed_count': '2'})),
+        ('guest stats', lambda: client.get('/api/guest_stats')),
+        ('edit guest', lambda: client.post('/edit_guest/3', data={'name': 'שם חדש', 'phone': '0501112233'})),
+        ('add guest', lambda: client.post('/add_guest', data={'name': 'אורח חדש', 'phone': '+972 59 999 9991'})),
+        ('import dedupe by phone (job)', lambda: run_job(
+            csv_upload('/import_guests', f'שם,טלפון\nכפול,{some_phone}\nחדש,0599999999\n'))),
+        ('sheet sync (job)', lambda: run_job(csv_upload(
+            '/import_guests', f'שם,טלפון\nמסונכרן,{some_phone}\nחדש בגיליון,0599999998\n', mode='sync', dry_run='0'))),
+        ('sheet sync again (job)', lambda: run_job(csv_upload(
+            '/import_guests', f'שם,טלפון\nשם חדש,{some_phone}\n', mode='sync', dry_run='0'))),
+        ('export bot file (job)', lambda: run_job(client.post('/api/exports/bot'))),
+        ('active jobs', lambda: client.get('/api/jobs?active=1')),
+        ('upload bot results', lambda: csv_upload('/upload_bot_results', f'phone\n{some_phone}\n')),
+        ('upload bot results (e164)', lambda: csv_upload('/upload_bot_results', 'phone_e164_no_plus\n972599999990\n')),
+        # whatsapp_bot.py (מקומי, דורש selenium) מריץ את אותן שאילתות ישירות מול המסד
+        ('whatsapp_bot send_all', lambda: Guest.query.filter_by(message_sent=False).all()),
+        ('whatsapp_bot reminders', lambda: Guest.query.filter_by(message_sent=True, response_date=None).all()),
+    ]
+
+
+def capture(run):
+    statements = OrderedDict()
+    current = {'name': None}
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if current['name'] is None or not re.match(r'\s*(SELECT|UPDATE|DELETE)\b', statement, re.I):
+            return
+        if executemany:
+            parameters = parameters[0] if parameters else ()
+        key = ' '.join(statement.split())
+        statements.setdefault(key, (current['name'], statement, parameters))
+
+    with app.app_context():
+        engine = db.engine
+    db.event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        run(current)
+    finally:
+        db.event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    return statements
+
+
+def _early_exit(statement, limit_without_sort):
+    """סריקה לפי סדר המפתח הראשי שנעצרת ב-LIMIT זולה רק בלי WHERE - עם תנאי סינון היא עלולה
+    לעבור על כל הטבלה כשמעט שורות עונות עליו (למשל מעט אורחים שעוד לא נשלחה אליהם הודעה)"""
+    return limit_without_sort and re.search(r'\bLIMIT\b', statement, re.I) and not re.search(r'\bWHERE\b', statement, re.I)
+
+
+def explain_sqlite(conn, statement, params):
+    rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, params).all()
+    details = [r[-1] for r in rows]
+    scans = [d for d in details
+             if re.match(rf"SCAN ({'|'.join(AUDITED_TABLES)})\b", d) and 'USING' not in d]
+    return details, scans, _early_exit(statement, not any('TEMP B-TREE' in d for d in details))
+
+
+def explain_postgres(conn, statement, params):
+    plan = conn.exec_driver_sql('EXPLAIN (FORMAT JSON) ' + statement, params).scalar()
+    details, scans = [], []
+
+    def walk(node, depth=0):
+        relation = node.get('Relation Name')
+        line = '  ' * depth + node['Node Type'] + (f' on {relation}' if relation else '')
+        details.append(line)
+        if node['Node Type'] == 'Seq Scan' and relation in AUDITED_TABLES:
+            scans.append(line.strip())
+        for child in node.get('Plans', []):
+            walk(child, depth + 1)
+
+    walk(plan[0]['Plan'])
+    return details, scans, _early_exit(statement, details[0].startswith('Limit') and not any('Sort' in d for d in details))
+
+
+def main():
+    seed(ARGS.guests)
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['admin_logged_in'] = True
+    bot = {'X-API-KEY': os.environ['BOT_API_KEY']}
+
+    def run(current):
+        for name, action in scenarios(client, bot):
+            current['name'] = name
+            with app.app_context():
+                started = time.perf_counter()
+                action()
+                if ARGS.verbose:
+                    print(f'▶ {name}: {(time.perf_counter() - started) * 1000:.1f}ms')
+        current['name'] = None
+
+    statements = capture(run)
+    failures = []
+    with app.app_context():
+        conn = db.session.connection()
+        explain = explain_postgres if conn.dialect.name == 'postgresql' else explain_sqlite
+        for key, (scenario, statement, params) in statements.items():
+            details, scans, early_exit = explain(conn, statement, params)
+            allowed = next((reason for pattern, reason in ALLOWED_SCANS if re.search(pattern, key)), None)
+            status = 'ok'
+            if scans and allowed:
+                status = f'allowed ({allowed})'
+            elif scans and early_exit:
+                status = 'ok (stops at LIMIT)'
+            elif scans:
+                status = 'FULL SCAN'
+                failures.append((scenario, key, details))
+            if ARGS.verbose or status == 'FULL SCAN':
+                print(f'\n[{scenario}] {status}\n  {key[:300]}')
+                for d in details:
+                    print(f'    {d}')
+        db.session.rollback()
+
+    print(f'\n📊 {len(statements)} distinct statements checked against {ARGS.guests} guests')
+    if failures:
+        print(f'❌ {len(failures)} hot queries do a full table scan:')
+        for scenario, key, _ in failures:
+            print(f'   - [{scenario}] {key[:160]}')
+        sys.exit(1)
+    print('✅ no unexpected full table scans')
+
+
+if __name__ == '__main__':
+    main()
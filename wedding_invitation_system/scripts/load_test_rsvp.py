@@ -0,0 +1,292 @@
+"""
+Concurrent RSVP load test.
+
+Mimics the burst right after an invitation wave: every seeded guest opens
+their link (GET /rsvp/<token>) and answers (POST /rsvp/<token>), with many
+guests doing so at the same time. Each backend gets a fresh database seeded
+through the models in app.py and a real local HTTP server, then throughput and
+p50/p95/p99 latency are reported per endpoint.
+
+Backends:
+  sqlite       - SQLite with the default rollback journal
+  sqlite-wal   - SQLite in WAL mode
+  postgres     - a local Postgres stand-in, e.g.
+                 docker run --rm -p 5432:5432 -e POSTGRES_PASSWORD=pw postgres:16
+                 (pass --postgres-url or set LOADTEST_POSTGRES_URL; skipped otherwise)
+
+Results are written as JSON so runs can be compared:
+    python scripts/load_test_rsvp.py run --guests 500 --concurrency 32
+    python scripts/load_test_rsvp.py compare loadtest_results/a.json loadtest_results/b.json
+
+Use --server gunicorn to test the production setup (2 workers) instead of the
+threaded werkzeug server.
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.abspath(os.path.join(SCRIPTS_DIR, '..'))
+REPO_DIR = os.path.abspath(os.path.join(APP_DIR, '..'))
+RESULTS_DIR = os.path.join(APP_DIR, 'loadtest_results')
+ENDPOINTS = ('GET /rsvp/<token>', 'POST /rsvp/<token>')
+
+
+# ------------- child process commands -------------
+
+def cmd_seed(args):
+    """Create the schema (migrations) and N guests through the models; print the tokens as JSON."""
+    os.environ['DATABASE_URL'] = args.db
+    sys.path.insert(0, APP_DIR)
+    from app import app, db, Guest, reset_database
+
+    reset_database()
+    with app.app_context():
+        if args.db.startswith('sqlite'):
+            mode = 'WAL' if args.wal else 'DELETE'
+            db.session.execute(db.text(f'PRAGMA journal_mode={mode}'))
+        guests = [
+            Guest(name=f'אורח בדיקה {i}', phone=f'05{i:08d}', unique_token=str(uuid.uuid4()),
+                  invited_count=1 + i % 4, message_sent=True)
+            for i in range(args.guests)
+        ]
+        db.session.add_all(guests)
+        db.session.commit()
+        tokens = [g.unique_token for g in guests]
+    with open(args.tokens_out, 'w', encoding='utf-8') as f:
+        json.dump(tokens, f)
+
+
+def cmd_serve(args):
+    """Threaded werkzeug server on the given database."""
+    os.environ['DATABASE_URL'] = args.db
+    sys.path.insert(0, APP_DIR)
+    os.chdir(APP_DIR)
+    from werkzeug.serving import make_server
+    from app import app
+
+    make_server('127.0.0.1', args.port, app, threaded=True).serve_forever()
+
+
+# ------------- harness -------------
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(kind, db_url, port):
+    env = dict(os.environ, DATABASE_URL=db_url)
+    if kind == 'gunicorn':
+        cmd = [sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f'127.0.0.1:{port}',
+               '--workers', '2', '--log-level', 'warning']
+        proc = subprocess.Popen(cmd, cwd=REPO_DIR, env=env)
+    else:
+        cmd = [sys.executable, __file__, 'serve', '--db', db_url, '--port', str(port)]
+        proc = subprocess.Popen(cmd, cwd=APP_DIR, env=env, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if requests.get(f'http://127.0.0.1:{port}/health', timeout=1).ok:
+                return proc
+        except requests.RequestException:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError(f'server did not start on port {port}')
+
+
+def percentile(sorted_values, pct):
+    """nearest-rank percentile"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(samples, errors, elapsed):
+    values = sorted(samples)
+    return {
+        'count': len(values),
+        'errors': errors,
+        'throughput_rps': round(len(values) / elapsed, 1) if elapsed else None,
+        'p50_ms': round(percentile(values, 50) * 1000, 2) if values else None,
+        'p95_ms': round(percentile(values, 95) * 1000, 2) if values else None,
+        'p99_ms': round(percentile(values, 99) * 1000, 2) if values else None,
+        'max_ms': round(values[-1] * 1000, 2) if values else None,
+    }
+
+
+def fire_burst(base_url, tokens, concurrency):
+    local = threading.local()
+    lock = threading.Lock()
+    samples = {name: [] for name in ENDPOINTS}
+    errors = {name: 0 for name in ENDPOINTS}
+
+    def record(name, started, ok):
+        took = time.perf_counter() - started
+        with lock:
+            if ok:
+                samples[name].append(took)
+            else:
+                errors[name] += 1
+
+    def guest_visit(i_token):
+        i, token = i_token
+        if not hasattr(local, 'http'):
+            local.http = requests.Session()
+        url = f'{base_url}/rsvp/{token}'
+        started = time.perf_counter()
+        try:
+            ok = local.http.get(url, timeout=30).status_code == 200
+        except requests.RequestException:
+            ok = False
+        record(ENDPOINTS[0], started, ok)
+
+        attending = i % 5 != 0
+        form = {'is_attending': 'yes' if attending else 'no', 'confirmed_count': '2', 'notes': 'load test'}
+        started = time.perf_counter()
+        try:
+            ok = local.http.post(url, data=form, timeout=30, allow_redirects=False).status_code == 200
+        except requests.RequestException:
+            ok = False
+        record(ENDPOINTS[1], started, ok)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(guest_visit, enumerate(tokens)))
+    elapsed = time.perf_counter() - started
+    return {name: summarize(samples[name], errors[name], elapsed) for name in ENDPOINTS}
+
+
+def run_backend(name, db_url, args):
+    print(f'▶ {name}: seeding {args.guests} guests ...')
+    with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as tmp:
+        tokens_path = tmp.name
+    try:
+        seed_cmd = [sys.executable, __file__, 'seed', '--db', db_url, '--guests', str(args.guests),
+                    '--tokens-out', tokens_path]
+        if name == 'sqlite-wal':
+            seed_cmd.append('--wal')
+        subprocess.run(seed_cmd, check=True, cwd=APP_DIR)
+        with open(tokens_path, encoding='utf-8') as f:
+            tokens = json.load(f)
+    finally:
+        os.remove(tokens_path)
+
+    port = free_port()
+    proc = start_server(args.server, db_url, port)
+    try:
+        print(f'  firing {len(tokens)} guest visits with concurrency {args.concurrency} ...')
+        result = fire_burst(f'http://127.0.0.1:{port}', tokens, args.concurrency)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    for endpoint, stats in result.items():
+        print(f"  {endpoint:<20} {stats['throughput_rps']} req/s | p50 {stats['p50_ms']}ms"
+              f" p95 {stats['p95_ms']}ms p99 {stats['p99_ms']}ms | errors {stats['errors']}")
+    return result
+
+
+def cmd_run(args):
+    workdir = tempfile.mkdtemp(prefix='rsvp_loadtest_')
+    backends = {
+        'sqlite': f"sqlite:///{os.path.join(workdir, 'plain.db')}",
+        'sqlite-wal': f"sqlite:///{os.path.join(workdir, 'wal.db')}",
+    }
+    postgres_url = args.postgres_url or os.getenv('LOADTEST_POSTGRES_URL')
+    if postgres_url:
+        backends['postgres'] = postgres_url
+    else:
+        print('ℹ️ postgres skipped (no --postgres-url / LOADTEST_POSTGRES_URL)')
+
+    selected = args.backends.split(',') if args.backends else list(backends)
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'guests': args.guests,
+            'concurrency': args.concurrency,
+            'server': args.server,
+            'write_behind': os.getenv('RSVP_WRITE_BEHIND', ''),
+        },
+        'results': {},
+    }
+    for name in selected:
+        if name not in backends:
+            print(f'⚠️ unknown or unavailable backend: {name}')
+            continue
+        report['results'][name] = run_backend(name, backends[name], args)
+
+    out = args.out or os.path.join(RESULTS_DIR, f"rsvp_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f'✅ results saved to {out}')
+
+
+def cmd_compare(args):
+    with open(args.before, encoding='utf-8') as f:
+        before = json.load(f)['results']
+    with open(args.after, encoding='utf-8') as f:
+        after = json.load(f)['results']
+    for backend in sorted(set(before) & set(after)):
+        print(backend)
+        for endpoint in ENDPOINTS:
+            a, b = before[backend].get(endpoint), after[backend].get(endpoint)
+            if not a or not b:
+                continue
+            cols = []
+            for key in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+                if a[key] and b[key] is not None:
+                    cols.append(f'{key} {a[key]} → {b[key]} ({(b[key] - a[key]) / a[key] * 100:+.0f}%)')
+            print(f'  {endpoint:<20} ' + ' | '.join(cols))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='cmd')
+
+    p_run = sub.add_parser('run', help='run the load test')
+    p_run.add_argument('--guests', type=int, default=500)
+    p_run.add_argument('--concurrency', type=int, default=32)
+    p_run.add_argument('--backends', help='comma separated subset of sqlite,sqlite-wal,postgres')
+    p_run.add_argument('--postgres-url')
+    p_run.add_argument('--server', choices=['werkzeug', 'gunicorn'], default='werkzeug')
+    p_run.add_argument('--out', help='JSON results path (default: loadtest_results/rsvp_<timestamp>.json)')
+
+    p_cmp = sub.add_parser('compare', help='compare two result files')
+    p_cmp.add_argument('before')
+    p_cmp.add_argument('after')
+
+    p_seed = sub.add_parser('seed')
+    p_seed.add_argument('--db', required=True)
+    p_seed.add_argument('--guests', type=int, required=True)
+    p_seed.add_argument('--tokens-out', required=True)
+    p_seed.add_argument('--wal', action='store_true')
+
+    p_serve = sub.add_parser('serve')
+    p_serve.add_argument('--db', required=True)
+    p_serve.add_argument('--port', type=int, required=True)
+
+    args = parser.parse_args()
+    commands = {'run': cmd_run, 'compare': cmd_compare, 'seed': cmd_seed, 'serve': cmd_serve}
+    if args.cmd not in commands:
+        parser.print_help()
+        return
+    commands[args.cmd](args)
+
+
+if __name__ == '__main__':
+    main()
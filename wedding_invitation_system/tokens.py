@@ -0,0 +1,67 @@
+"""
+Signed RSVP tokens.
+
+A token looks like ``<guest id in base36>.<nonce>.<signature>`` where the
+signature is an HMAC-SHA256 (keyed by the app's SECRET_KEY) over the first two
+parts. A valid signature tells us which row to load by primary key, and forged
+or mistyped links are rejected without touching the database.
+
+The random nonce keeps links unique even if SQLite reuses the id of a deleted
+guest, so callers must still compare the token against ``Guest.unique_token``.
+
+Tokens issued before this format were plain UUID4 strings; ``is_legacy_token``
+recognises them so they can be looked up the old way.
+"""
+
+import base64
+import hashlib
+import hmac
+import re
+import secrets
+from typing import Optional
+
+LEGACY_TOKEN_RE = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+SIGNATURE_LENGTH = 16  # 96 bits, base64url
+
+_BASE36 = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def _to_base36(n: int) -> str:
+    if n == 0:
+        return '0'
+    out = []
+    while n:
+        n, rem = divmod(n, 36)
+        out.append(_BASE36[rem])
+    return ''.join(reversed(out))
+
+
+def _sign(payload: str, secret: str) -> str:
+    digest = hmac.new(secret.encode('utf-8'), payload.encode('utf-8'), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).decode('ascii')[:SIGNATURE_LENGTH]
+
+
+def make_guest_token(guest_id: int, secret: str) -> str:
+    """טוקן חתום חדש לאורח (אורך ~30 תווים, נכנס בעמודת unique_token)"""
+    payload = f'{_to_base36(guest_id)}.{secrets.token_hex(3)}'
+    return f'{payload}.{_sign(payload, secret)}'
+
+
+def parse_guest_token(token: str, secret: str) -> Optional[int]:
+    """Return the guest id of a correctly signed token, otherwise None."""
+    if not token or len(token) > 64 or token.count('.') != 2:
+        return None
+    id_part, nonce, signature = token.split('.')
+    if not id_part or not nonce:
+        return None
+    expected = _sign(f'{id_part}.{nonce}', secret)
+    if not hmac.compare_digest(signature.encode('utf-8'), expected.encode('ascii')):
+        return None
+    try:
+        return int(id_part, 36)
+    except ValueError:
+        return None
+
+
+def is_legacy_token(token: str) -> bool:
+    return bool(token) and LEGACY_TOKEN_RE.match(token) is not None
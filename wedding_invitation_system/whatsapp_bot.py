@@ -28,7 +28,8 @@ from selenium.common.exceptions import WebDriverException
 from jinja2 import Template
 
 # Import your Flask app and models
-from app import app, Guest, db
+from app import app, Guest, db, claim_bot_guests, release_bot_leases
+import phones
 
 load_dotenv()
 
@@ -320,15 +321,6 @@ class WhatsAppBot:
             return False
         return False
 
-    @staticmethod
-    def normalize_phone(phone_raw: str) -> str:
-        p = "".join(ch for ch in phone_raw if ch.isdigit() or ch == "+")
-        if p.startswith("+"):
-            p = p[1:]
-        if p.startswith("0"):
-            p = "972" + p[1:]
-        return p
-
     def build_invitation_text(self, guest) -> str:
         couple_names = os.getenv("COUPLE_NAMES", "החתן והכלה")
         wedding_date = os.getenv("WEDDING_DATE", "תאריך החתונה")
@@ -379,8 +371,8 @@ class WhatsAppBot:
         if not self.is_logged_in and not self.login_to_whatsapp():
             return False
 
-        phone = self.normalize_phone(guest.phone)
-        if not phone.startswith("972"):
+        phone = guest.phone_e164 or phones.to_e164(guest.phone) or ""
+        if not phone.startswith(phones.COUNTRY_CODE):
             print(f"⚠️ Unsupported/invalid phone: {guest.phone}")
             return False
 
@@ -413,7 +405,7 @@ class WhatsAppBot:
     def send_reminder(self, guest) -> bool:
         if not self.is_logged_in and not self.login_to_whatsapp():
             return False
-        phone = self.normalize_phone(guest.phone)
+        phone = guest.phone_e164 or phones.to_e164(guest.phone) or ""
         text = self.build_reminder_text(guest)
         if not self.open_chat(phone):
             return False
@@ -462,20 +454,37 @@ def send_invitations_to_all(wait_for_login: bool = False):
                 print("❌ Cannot login to WhatsApp")
                 bot.close()
                 return
-        guests_to_invite = Guest.query.filter_by(message_sent=False).all()
-        if not guests_to_invite:
+        total = Guest.query.filter_by(message_sent=False).count()
+        if not total:
             print("✅ Everyone already invited")
             bot.close()
             return
-        print(f"📤 Sending invitations to {len(guests_to_invite)} guests...")
+        print(f"📤 Sending invitations to {total} guests...")
         success = 0
-        for i, guest in enumerate(guests_to_invite, 1):
-            print(f"[{i}/{len(guests_to_invite)}] Sending to {guest.name} ({guest.phone})")
-            if bot.send_invitation(guest):
-                success += 1
-            time.sleep(random.uniform(6, 14))
-        print(f"✅ Sent {success} invitations out of {len(guests_to_invite)}")
-        bot.close()
+        attempted = {}  # guest_id -> lease
+        try:
+            # אורח אחד בכל פעם דרך אותה השכרה של /api/bot/pending - בוטים מרוחקים שרצים במקביל לא ישלחו לו שוב
+            while True:
+                lease, _, ids = claim_bot_guests(1)
+                if not ids:
+                    break
+                if ids[0] in attempted:
+                    # נכשל כבר בריצה הזו וההשכרה פגה - השליפה חידשה אותה, לא מנסים שוב
+                    attempted[ids[0]] = lease
+                    continue
+                guest = db.session.get(Guest, ids[0])
+                attempted[guest.id] = lease
+                print(f"[{len(attempted)}/{total}] Sending to {guest.name} ({guest.phone})")
+                if bot.send_invitation(guest):
+                    success += 1
+                time.sleep(random.uniform(6, 14))
+        finally:
+            # מי שלא נשלח (נכשל / הופסק באמצע) חוזר לתור
+            for guest_id, lease in attempted.items():
+                release_bot_leases([guest_id], lease)
+            db.session.commit()
+            print(f"✅ Sent {success} invitations out of {len(attempted)}")
+            bot.close()
 
 
 def send_reminders():
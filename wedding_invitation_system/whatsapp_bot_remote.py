@@ -1,9 +1,10 @@
 """Remote-mode WhatsApp bot.
 
 Runs locally and talks to the hosted Flask app via the bot API endpoints:
-  GET  /api/bot/pending        - fetch guests to send messages to
-  POST /api/bot/mark           - report successes / failures
+  GET  /api/bot/pending        - claim guests to send messages to (leased to this runner)
+  POST /api/bot/mark           - report successes / failures, release what was not attempted
   GET  /api/bot/logs?limit=50  - (optional) view recent logs
+  GET  /api/guests             - (optional) stream the guest list as NDJSON (`guests` command)
 
 Usage:
   1. Set environment variables (put in .env next to this file):
@@ -18,6 +19,9 @@ Usage:
 
 Notes:
   * Stores WhatsApp profile in ./whatsapp_profile_remote so session stays logged in.
+  * Several runners (one WhatsApp account each) can send in parallel: give each its own
+    --profile directory. Claimed guests are leased to one runner until it reports them or
+    the lease expires, so no guest is sent twice.
   * Respects --headless flag (off by default so you can see the browser). Add --headless to run invisible.
   * Safe delays & randomization to mimic human behaviour.
 """
@@ -41,6 +45,8 @@ from selenium.webdriver.support import expected_conditions as EC
 from webdriver_manager.chrome import ChromeDriverManager
 from selenium.common.exceptions import WebDriverException
 
+import phones  # אותו נרמול טלפון כמו באתר (מודול בלי תלויות)
+
 load_dotenv()
 
 REMOTE_BASE_URL = os.getenv('REMOTE_BASE_URL', 'http://localhost:5000')
@@ -50,6 +56,9 @@ COUPLE_NAMES = os.getenv('COUPLE_NAMES', 'הזוג')
 WEDDING_DATE = os.getenv('WEDDING_DATE', '')
 SESSION_DIR = os.path.abspath('whatsapp_profile_remote')
 HEADLESS_DEFAULT = False
+LOGIN_TIMEOUT = 300
+# זמן ההשכרה שמבקשים מהשרת: המתנה להתחברות ועוד זמן נדיב לכל אורח (הקלדה איטית + השהיות)
+LEASE_SECONDS_PER_GUEST = 60
 
 # ------------- HTTP helpers -------------
 
@@ -67,6 +76,16 @@ def api_post(path: str, payload: Dict[str, Any]):
     r.raise_for_status()
     return r.json()
 
+def api_stream(path: str, **params):
+    """Yield the rows of an NDJSON endpoint one by one, without buffering the whole body."""
+    url = REMOTE_BASE_URL.rstrip('/') + path
+    headers = {'X-API-KEY': BOT_API_KEY} if BOT_API_KEY else {}
+    with requests.get(url, params=params, headers=headers, timeout=30, stream=True) as r:
+        r.raise_for_status()
+        for line in r.iter_lines():
+            if line:
+                yield json.loads(line)
+
 # ------------- Selenium helpers -------------
 
 def human_type(el, text: str, base_delay: float = 0.05):
@@ -75,9 +94,10 @@ def human_type(el, text: str, base_delay: float = 0.05):
         time.sleep(base_delay + random.uniform(0.0, 0.07))
 
 class RemoteWhatsAppBot:
-    def __init__(self, headless: bool = HEADLESS_DEFAULT):
+    def __init__(self, headless: bool = HEADLESS_DEFAULT, profile_dir: str = SESSION_DIR):
         self.driver = None
         self.headless = headless
+        self.profile_dir = profile_dir
         self.is_logged_in = False
 
     def setup_driver(self) -> bool:
@@ -90,9 +110,9 @@ class RemoteWhatsAppBot:
         opts.add_argument('--disable-blink-features=AutomationControlled')
         opts.add_experimental_option('excludeSwitches', ['enable-automation'])
         opts.add_experimental_option('useAutomationExtension', False)
-        if not os.path.exists(SESSION_DIR):
-            os.makedirs(SESSION_DIR, exist_ok=True)
-        opts.add_argument(f'--user-data-dir={SESSION_DIR}')
+        if not os.path.exists(self.profile_dir):
+            os.makedirs(self.profile_dir, exist_ok=True)
+        opts.add_argument(f'--user-data-dir={self.profile_dir}')
         try:
             service = Service(ChromeDriverManager().install())
             self.driver = webdriver.Chrome(service=service, options=opts)
@@ -169,15 +189,6 @@ class RemoteWhatsAppBot:
             print(f'⚠️ Enter failed: {e}')
             return False
 
-    @staticmethod
-    def normalize_phone(p: str) -> str:
-        digits = ''.join(ch for ch in p if ch.isdigit() or ch == '+')
-        if digits.startswith('+'):
-            digits = digits[1:]
-        if digits.startswith('0'):
-            digits = '972' + digits[1:]
-        return digits
-
     def close(self):
         if self.driver:
             try:
@@ -199,9 +210,19 @@ def fallback_message(data_guest: Dict[str, Any]) -> str:
 
 # ------------- Core loop -------------
 
-def send_cycle(limit: int, headless: bool, dry_run: bool, resend_failed: bool):
+def report_results(lease, sent_ids: List[int], failed: List[Dict[str, Any]], release: List[int]):
+    """Mark sent / failed guests and hand back the ones that were claimed but not attempted."""
+    print(f"📦 Reporting results: {len(sent_ids)} sent, {len(failed)} failed, {len(release)} released")
+    try:
+        resp = api_post('/api/bot/mark', {'sent': sent_ids, 'failed': failed, 'release': release, 'lease': lease})
+        print('🗒 Mark response:', resp)
+    except Exception as e:
+        print('❌ Failed to report results:', e)
+
+def send_cycle(limit: int, headless: bool, dry_run: bool, resend_failed: bool,
+               profile_dir: str = SESSION_DIR, lease_seconds: int = None):
     print(f"🔄 Fetching up to {limit} guests (resend_failed={resend_failed}) ...")
-    params = {'limit': limit}
+    params = {'limit': limit, 'lease': lease_seconds or LOGIN_TIMEOUT + limit * LEASE_SECONDS_PER_GUEST}
     if resend_failed:
         params['resend'] = '1'
     try:
@@ -213,21 +234,33 @@ def send_cycle(limit: int, headless: bool, dry_run: bool, resend_failed: bool):
         print('❌ API responded with failure:', pending)
         return
     guests = pending.get('guests', [])
+    lease = pending.get('lease')
     if not guests:
         print('✅ No guests to send')
         return
 
-    print(f"📤 Will attempt {len(guests)} sends")
-    bot = RemoteWhatsAppBot(headless=headless)
-    if not bot.wait_for_login(timeout=300):
+    print(f"📤 Will attempt {len(guests)} sends (leased until {pending.get('lease_until')})")
+    bot = RemoteWhatsAppBot(headless=headless, profile_dir=profile_dir)
+    if not bot.wait_for_login(timeout=LOGIN_TIMEOUT):
         bot.close()
+        # השרת משחרר אותם מיד - runner אחר יכול לשלוח
+        report_results(lease, [], [], [g.get('id') for g in guests])
         return
 
     sent_ids: List[int] = []
     failed: List[Dict[str, Any]] = []
+    try:
+        _send_guests(bot, guests, dry_run, sent_ids, failed)
+    finally:
+        # גם כשנעצרים באמצע (Ctrl+C / קריסת Chrome): מה שנשלח מסומן, והשאר חוזר לתור
+        bot.close()
+        done = set(sent_ids) | {f.get('id') for f in failed}
+        report_results(lease, sent_ids, failed, [g.get('id') for g in guests if g.get('id') not in done])
 
+def _send_guests(bot: RemoteWhatsAppBot, guests: List[Dict[str, Any]], dry_run: bool,
+                 sent_ids: List[int], failed: List[Dict[str, Any]]):
     for idx, g in enumerate(guests, 1):
-        phone = bot.normalize_phone(g.get('phone',''))
+        phone = g.get('phone_e164') or phones.to_e164(g.get('phone')) or ''
         print(f"[{idx}/{len(guests)}] {g.get('name')} -> {phone}")
         message_text = g.get('message') or fallback_message(g)
         if dry_run:
@@ -250,14 +283,6 @@ def send_cycle(limit: int, headless: bool, dry_run: bool, resend_failed: bool):
             failed.append({'id': g.get('id'), 'error': 'send_failed'})
             time.sleep(random.uniform(3, 6))
 
-    bot.close()
-    print(f"📦 Reporting results: {len(sent_ids)} sent, {len(failed)} failed")
-    try:
-        resp = api_post('/api/bot/mark', {'sent': sent_ids, 'failed': failed})
-        print('🗒 Mark response:', resp)
-    except Exception as e:
-        print('❌ Failed to report results:', e)
-
 # ------------- CLI -------------
 
 def main():
@@ -269,11 +294,15 @@ def main():
     p_send.add_argument('--headless', action='store_true')
     p_send.add_argument('--dry-run', action='store_true')
     p_send.add_argument('--resend-failed', action='store_true')
+    p_send.add_argument('--profile', default=SESSION_DIR, help='Chrome profile dir (one per WhatsApp account)')
+    p_send.add_argument('--lease', type=int, default=None, help='Seconds the claimed guests stay reserved')
 
     p_loop = sub.add_parser('loop', help='Continuous loop (poll every X seconds)')
     p_loop.add_argument('--interval', type=int, default=600, help='Seconds between cycles')
     p_loop.add_argument('--limit', type=int, default=15)
     p_loop.add_argument('--headless', action='store_true')
+    p_loop.add_argument('--profile', default=SESSION_DIR, help='Chrome profile dir (one per WhatsApp account)')
+    p_loop.add_argument('--lease', type=int, default=None, help='Seconds the claimed guests stay reserved')
 
     p_file = sub.add_parser('send_file', help='Send messages from a local Excel/CSV file')
     p_file.add_argument('path', help='Path to .xlsx/.xls/.csv file')
@@ -283,13 +312,20 @@ def main():
     p_file.add_argument('--message-col', help='Column name for message text (default: personal_message or message)', default=None)
     p_file.add_argument('--dry-run', action='store_true', help='Do not actually send messages')
 
+    p_guests = sub.add_parser('guests', help='Stream the guest list from the server (NDJSON)')
+    p_guests.add_argument('--fields', default='id,name,phone,invited_count,message_sent,unique_token',
+                          help='Comma separated columns to fetch')
+    p_guests.add_argument('--since', help='Only guests changed since this ISO datetime')
+    p_guests.add_argument('--out', help='Write the rows to this .jsonl file instead of printing them')
+
     args = parser.parse_args()
 
     if not BOT_API_KEY:
         print('⚠️ BOT_API_KEY not set – API calls will likely fail (unauthorized). Set it in .env.')
 
     if args.cmd == 'send_all':
-        send_cycle(limit=args.limit, headless=args.headless, dry_run=args.dry_run, resend_failed=args.resend_failed)
+        send_cycle(limit=args.limit, headless=args.headless, dry_run=args.dry_run, resend_failed=args.resend_failed,
+                   profile_dir=os.path.abspath(args.profile), lease_seconds=args.lease)
     elif args.cmd == 'send_file':
         from pathlib import Path
         import pandas as pd
@@ -334,7 +370,7 @@ def main():
         failed = []
         for idx, row in df.iterrows():
             raw_phone = str(row.get(phone_col, '') or '')
-            phone = bot.normalize_phone(raw_phone)
+            phone = phones.to_e164(raw_phone) or ''
             name = str(row.get(name_col, '') or '')
             message = ''
             if msg_col and msg_col in df.columns:
@@ -363,9 +399,26 @@ def main():
 
         bot.close()
         print(f'Finished. Sent: {len(sent)}, Failed: {len(failed)}')
+    elif args.cmd == 'guests':
+        params = {'fields': args.fields}
+        if args.since:
+            params['since'] = args.since
+        rows = api_stream('/api/guests', **params)
+        count = 0
+        if args.out:
+            with open(args.out, 'w', encoding='utf-8') as f:
+                for row in rows:
+                    f.write(json.dumps(row, ensure_ascii=False) + '\n')
+                    count += 1
+        else:
+            for row in rows:
+                print('\t'.join(str(row.get(field, '')) for field in args.fields.split(',')))
+                count += 1
+        print(f'✅ {count} guests')
     elif args.cmd == 'loop':
         while True:
-            send_cycle(limit=args.limit, headless=args.headless, dry_run=False, resend_failed=False)
+            send_cycle(limit=args.limit, headless=args.headless, dry_run=False, resend_failed=False,
+                       profile_dir=os.path.abspath(args.profile), lease_seconds=args.lease)
             print(f'⏲ Sleeping {args.interval}s...')
             time.sleep(args.interval)
     else:
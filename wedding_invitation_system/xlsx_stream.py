@@ -0,0 +1,167 @@
+"""
+Streaming XLSX writer - the .xlsx is produced part by part while it is sent.
+
+An .xlsx file is a zip of XML parts. ``iter_xlsx`` writes the small fixed
+parts, then the worksheet row by row into a ``zipfile`` entry opened for
+writing on an unseekable buffer (sizes go into data descriptors), and yields
+the compressed bytes every ``chunk_size`` bytes. Nothing is written to disk
+(openpyxl's ``write_only`` mode still spools every sheet to a temp file) and
+memory stays flat: one row of XML plus the compressor's window.
+
+Cells: str -> inline string, int/float -> number, bool -> boolean,
+date/datetime -> ISO text, None / '' / NaN -> empty. One sheet per file.
+
+No app imports here - app.py feeds rows from batched queries (``send_export``).
+"""
+
+import math
+import numbers
+import re
+import zipfile
+from datetime import date, datetime
+from typing import Iterable, Iterator, Sequence
+from xml.sax.saxutils import escape
+
+CHUNK_SIZE = 64 * 1024
+MAX_CELL_CHARS = 32767  # מגבלה של Excel לתא
+# תווי בקרה שאסורים ב-XML (openpyxl זורק עליהם שגיאה - כאן הם מוסרים)
+_ILLEGAL_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml"'
+    ' ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml"'
+    ' ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml"'
+    ' ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Target="xl/workbook.xml"'
+    ' Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+    '</Relationships>'
+)
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+    ' xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Target="worksheets/sheet1.xml"'
+    ' Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+    '<Relationship Id="rId2" Target="styles.xml"'
+    ' Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles"/>'
+    '</Relationships>'
+)
+_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+_SHEET_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+_SHEET_TAIL = '</sheetData></worksheet>'
+
+
+class _Buffer:
+    """יעד לא-seekable ל-ZipFile: הבתים נאספים כאן עד שהגנרטור מוציא אותם"""
+
+    def __init__(self):
+        self._parts = []
+        self.size = 0
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def take(self) -> bytes:
+        data = b''.join(self._parts)
+        self._parts, self.size = [], 0
+        return data
+
+
+def _column_letters(index: int) -> str:
+    letters = ''
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def _cell(ref: str, value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return f'<c r="{ref}" t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, numbers.Integral):
+        return f'<c r="{ref}"><v>{int(value)}</v></c>'
+    if isinstance(value, numbers.Real):
+        value = float(value)
+        return f'<c r="{ref}"><v>{value!r}</v></c>' if math.isfinite(value) else ''
+    if isinstance(value, (datetime, date)):
+        value = value.isoformat()
+    text = _ILLEGAL_XML_CHARS.sub('', str(value))[:MAX_CELL_CHARS]
+    if not text:
+        return ''
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{escape(text)}</t></is></c>'
+
+
+def _row(number: int, values: Sequence, letters: list) -> str:
+    while len(letters) < len(values):
+        letters.append(_column_letters(len(letters)))
+    cells = ''.join(_cell(f'{letters[i]}{number}', v) for i, v in enumerate(values))
+    return f'<row r="{number}">{cells}</row>'
+
+
+def iter_xlsx(rows: Iterable[Sequence], sheet_name: str = 'Sheet1', chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """קובץ xlsx כזרם של חתיכות bytes (לתשובת HTTP או לכתיבה לקובץ). rows - רצף של שורות (רשימות ערכים)"""
+    buffer = _Buffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('[Content_Types].xml', _CONTENT_TYPES)
+        zf.writestr('_rels/.rels', _ROOT_RELS)
+        zf.writestr('xl/workbook.xml', _WORKBOOK.format(name=escape(sheet_name, {'"': '&quot;'})))
+        zf.writestr('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS)
+        zf.writestr('xl/styles.xml', _STYLES)
+        with zf.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            sheet.write(_SHEET_HEAD.encode('utf-8'))
+            letters = []
+            for number, values in enumerate(rows, 1):
+                sheet.write(_row(number, values, letters).encode('utf-8'))
+                if buffer.size >= chunk_size:
+                    yield buffer.take()
+            sheet.write(_SHEET_TAIL.encode('utf-8'))
+    yield buffer.take()
+
+
+def write_xlsx(path: str, rows: Iterable[Sequence], sheet_name: str = 'Sheet1') -> None:
+    """אותו זרם לקובץ (ייצוא כמשימת רקע)"""
+    with open(path, 'wb') as f:
+        for chunk in iter_xlsx(rows, sheet_name):
+            f.write(chunk)